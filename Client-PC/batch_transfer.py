@@ -0,0 +1,122 @@
+import os
+import struct
+
+from file_index import TEMP_SUFFIX, local_path
+from hashing import new_hasher
+
+# Files up to this size are fetched in batches instead of one request each.
+BATCH_MAX_FILE_SIZE = 256 * 1024
+BATCH_MAX_FILES = 1000
+BATCH_MAX_BYTES = 64 * 1024 * 1024
+READ_SIZE = 64 * 1024
+
+# Stream format, repeated per file and ended by a zero name length:
+#   name length (u16) | name (utf-8) | size (i64, -1 if missing) | data
+_NAME_LEN = struct.Struct(">H")
+_SIZE = struct.Struct(">q")
+
+
+class BatchError(Exception):
+    pass
+
+
+def plan_batches(files):
+    """Split [(file_name, size)] into lists of names within the batch limits."""
+    batches, current, current_bytes = [], [], 0
+    for file_name, size in files:
+        if current and (len(current) >= BATCH_MAX_FILES or current_bytes + size > BATCH_MAX_BYTES):
+            batches.append(current)
+            current, current_bytes = [], 0
+        current.append(file_name)
+        current_bytes += size
+    if current:
+        batches.append(current)
+    return batches
+
+
+def pack_files(folder, names):
+    """Yield the framed stream for `names` inside `folder`."""
+    root = os.path.realpath(folder)
+    for file_name in names:
+        encoded = file_name.encode()
+        yield _NAME_LEN.pack(len(encoded)) + encoded
+        path = os.path.realpath(os.path.join(root, file_name))
+        try:
+            if os.path.commonpath([root, path]) != root:
+                raise FileNotFoundError(file_name)
+            f = open(path, "rb")
+        except (OSError, ValueError):
+            yield _SIZE.pack(-1)
+            continue
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            yield _SIZE.pack(size)
+            remaining = size
+            while remaining:
+                data = f.read(min(READ_SIZE, remaining))
+                if not data:
+                    # Truncated while we were sending it; the receiver's hash
+                    # check rejects the padding.
+                    data = bytes(min(READ_SIZE, remaining))
+                remaining -= len(data)
+                yield data
+    yield _NAME_LEN.pack(0)
+
+
+def _read_exact(stream, n):
+    parts = []
+    while n:
+        data = stream.read(n)
+        if not data:
+            raise BatchError("stream ended early")
+        parts.append(data)
+        n -= len(data)
+    return b"".join(parts)
+
+
+def unpack_stream(stream, folder, expected, algorithm):
+    """Write every file in the stream into `folder`, verifying its hash.
+
+    `expected` maps file name -> hash (None skips the check). Each file is
+    written under TEMP_SUFFIX and renamed into place only once its hash
+    matches. Returns {file_name: hash} for the files that were stored.
+    """
+    stored = {}
+    while True:
+        (name_len,) = _NAME_LEN.unpack(_read_exact(stream, _NAME_LEN.size))
+        if not name_len:
+            return stored
+        file_name = _read_exact(stream, name_len).decode()
+        (size,) = _SIZE.unpack(_read_exact(stream, _SIZE.size))
+        if size < 0:
+            continue
+        if file_name not in expected:
+            raise BatchError(f"peer sent unrequested file {file_name}")
+        try:
+            path = local_path(folder, file_name)
+        except ValueError as e:
+            raise BatchError(str(e))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + TEMP_SUFFIX
+        hasher = new_hasher(algorithm)
+        try:
+            with open(tmp_path, "wb") as f:
+                remaining = size
+                while remaining:
+                    data = _read_exact(stream, min(READ_SIZE, remaining))
+                    hasher.update(data)
+                    f.write(data)
+                    remaining -= len(data)
+        except BaseException:
+            # A truncated stream leaves nothing behind for this member.
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        file_hash = hasher.hexdigest()
+        if expected[file_name] is not None and file_hash != expected[file_name]:
+            os.remove(tmp_path)
+            continue
+        os.replace(tmp_path, path)
+        stored[file_name] = file_hash
@@ -1,29 +1,96 @@
-import hashlib
-import ipaddress
-import json
 import os
+import glob
+import queue
+import shutil
 import requests
-import socket
+import urllib3
 import time
 import threading
 import webbrowser
-from flask import Flask, jsonify, send_file, request, render_template
+from urllib.parse import quote, urlsplit
+from contextlib import ExitStack
+from flask import Flask, Response, jsonify, send_file, request, render_template
 from tqdm import tqdm
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
+from batch_transfer import BATCH_MAX_FILE_SIZE, BatchError, pack_files, plan_batches, unpack_stream
+from discovery import DiscoveryCache, find_server, listen_for_announce, scan, subnet_hosts
+from compression import LINK_HEADER, Decoder, LinkMeter, accept_encoding
+from chunking import DELTA_MIN_SIZE, ManifestStore, chunk_hash, rebuild_file
+from file_index import TEMP_SUFFIX, FileIndex, local_path, partial_path, relative_name, scan_directory, served_path
+from transfer_scheduler import TransferScheduler
+from event_pipeline import EventPipeline
+from file_server import FileServer
+from http_session import Backoff, make_session, post_json
+from hashing import LEGACY_ALGORITHM, available_algorithms, hash_file, hash_files
+from metadata_store import ClientMetadata
+from metrics import counter, histogram, instrument_app
+from swarm import SWARM_MIN_SIZE, SwarmError, swarm_download
+
+try:
+    # Keeps peer connections alive; Werkzeug's development server closes each one.
+    from waitress import serve
+except ImportError:
+    serve = None
 
 app = Flask(__name__, template_folder=".")
+# Request timings, GET /metrics (Prometheus) and the /profile switch.
+instrument_app(app)
 
 SERVER_URL = "http://10.20.36.113:5000"
 CLIENT_PORT = 6001  # Change for each client (6002, 6003, etc.)
 SETUP_FILE = "./client_setup_done"
+DISCOVERY_CACHE_FILE = "./server_cache.json"  # Last address each server was found at
 SYNC_FOLDER = ""
 CLIENT_ID = ""
 METADATA_FILE = ""
+INDEX_FILE = ""
+MANIFEST_FILE = ""
+MANIFEST_WAIT = 2  # Seconds a peer waits for a manifest being built before answering without one
 SYNC_TIME = 30
-RETRY_TIME = 60
+RETRY_TIME = 60  # Longest wait between retries; they back off up to it
 SERVER_NAME = ""
-currently_downloading = False
+MAX_PARALLEL_DOWNLOADS = 4
+PER_PEER_DOWNLOADS = 2
+DOWNLOAD_PRIORITY = "smallest"  # or "newest" / "fifo"
+HASH_ALGORITHM = LEGACY_ALGORITHM  # Replaced by the server's choice on register
+PUSH_NOTIFICATIONS = True  # Long-poll the server for changes; SYNC_TIME polling is the fallback
+LONG_POLL_TIMEOUT = 25
+PUSH_SAFETY_TIME = 300  # Full round even when nothing was pushed
+COMPRESS_REQUESTS = True  # gzip large JSON uploads if the server accepts it
+FAST_POLL = True  # Idle rounds are one /poll digest check instead of a metadata upload plus /sync
+FILE_SERVER_PORT_OFFSET = 1000  # Peers download from CLIENT_PORT + this (sendfile); None serves them from Flask
+COMPRESS_TRANSFERS = True  # zstd/gzip whole-file downloads when the link is slow enough for it to pay
+PARTIAL_MAX_AGE = 7 * 24 * 3600  # Interrupted downloads are kept this long for resuming
+transfers = TransferScheduler(MAX_PARALLEL_DOWNLOADS, PER_PEER_DOWNLOADS, DOWNLOAD_PRIORITY)
+sync_cursor = None
+applied_delete_version = 0  # Highest delete from /sync we have applied, acked on the next /sync
+deletion_notices = queue.Queue()  # Local (file_name, moved_to) deletes waiting to be reported to the server
+recent_moves = {}  # dest path -> src path of watchdog move events not yet processed
+recent_moves_lock = threading.Lock()
+file_events = None  # EventPipeline fed by the watchdog
+pending_downloads = {}  # file_name -> {peer_ids, peers, size, last_modified, hash}, kept until downloaded
+metadata_generation = None  # Server's generation of our table, None forces a full upload
+metadata_bytes_sent = {"full": 0, "tree": 0, "delta": 0}
+metadata_store = None  # ClientMetadata, flushed to METADATA_FILE in the background
+file_index = None
+manifest_store = None
+discovery_cache = DiscoveryCache(DISCOVERY_CACHE_FILE)
+hash_seconds = histogram("syncit_hash_seconds", "Time spent hashing files, by call.")
+hashed_bytes = counter("syncit_hashed_bytes_total", "Bytes of file content hashed one file at a time.")
+download_seconds = histogram("syncit_download_seconds", "Time to download from peers, by method.")
+peer_bytes_received = counter("syncit_peer_bytes_received_total", "Bytes received from peers, by peer and method.")
+downloads_total = counter("syncit_downloads_total", "Files downloaded from peers, by method and result.")
+metadata_upload_bytes = counter("syncit_metadata_upload_bytes_total", "Metadata bytes sent to the server, by upload mode.")
+# Kept-alive connection pools: one session for the server, one for peers.
+server_http = make_session(pool_hosts=2, pool_size=4)
+peer_http = make_session()
+link_meter = LinkMeter()  # Throughput from each peer, for the level it compresses downloads at
+server_accepts_gzip = False  # Set from the server's register answer
+sync_wakeup = threading.Event()  # Set by pushed server changes and local edits
+sync_round = threading.Condition()  # Notified after every sync round
+push_available = False
+fleet_digest = None  # Server's digest over every client's table at our last /sync
 
 # ------------------ Setup and Configuration ------------------
 
@@ -33,12 +100,14 @@ def index():
 
 @app.route("/submit", methods=["POST"])
 def handle_form():
-    global CLIENT_ID, SYNC_FOLDER, METADATA_FILE, SERVER_URL, SERVER_NAME, SYNC_TIME
+    global CLIENT_ID, SYNC_FOLDER, METADATA_FILE, INDEX_FILE, MANIFEST_FILE, SERVER_URL, SERVER_NAME, SYNC_TIME
 
     CLIENT_ID = request.form["client_id"]
     SYNC_FOLDER = request.form["folder_path"]
     SERVER_URL = f"http://{request.form['server_url']}:5000"
     METADATA_FILE = f"./{CLIENT_ID}_metadata.json"
+    INDEX_FILE = f"./{CLIENT_ID}_index.json"
+    MANIFEST_FILE = f"./{CLIENT_ID}_manifests.json"
     SYNC_TIME = int(request.form["sync_duration"])
     fetch_server_name()
 
@@ -59,52 +128,26 @@ def handle_form():
 
 @app.route("/discover_servers")
 def discover_servers():
-    port = 5000
-    discovered = []
-
-    def get_local_ip():
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        try:
-            s.connect(("8.8.8.8", 80))
-            return s.getsockname()[0]
-        finally:
-            s.close()
-
-    local_ip = get_local_ip()
-    
-    ip_parts = local_ip.split('.')
-    subnet = f"{ip_parts[0]}.{ip_parts[1]}.{ip_parts[2]}.0/24"
-    network = ipaddress.ip_network(subnet, strict=False)
-
-    def check_server(ip):
-        try:
-            r = requests.get(f"http://{ip}:{port}/server_name", timeout=0.4)
-            if r.status_code == 200:
-                name = r.json().get("name", f"Server @ {ip}")
-                discovered.append({"ip": ip, "name": name})
-        except:
-            pass
-
-    threads = []
-    for ip in network.hosts():  
-        # if str(ip) == local_ip:
-        #     continue  # Skip own IP
-        t = threading.Thread(target=check_server, args=(str(ip),))
-        t.start()
-        threads.append(t)
-
-    for t in threads:
-        t.join()
-
-    return jsonify(discovered)
+    # Servers announcing themselves over UDP, plus whatever answers on
+    # our /24, probed by a bounded pool.
+    announced = []
+    listener = threading.Thread(target=lambda: announced.extend(listen_for_announce()))
+    listener.start()
+    discovered = {server["ip"]: server for server in scan(subnet_hosts())}
+    listener.join()
+    for server in announced:
+        discovered.setdefault(server["ip"], {"ip": server["ip"], "name": server["name"]})
+    return jsonify(list(discovered.values()))
 
 def fetch_server_name():
     global SERVER_NAME
     try:
-        response = requests.get(f"{SERVER_URL}/server_name", timeout=5)
+        response = server_http.get(f"{SERVER_URL}/server_name", timeout=5)
         if response.status_code == 200:
             SERVER_NAME = response.json().get("name")
             print(f"Connected to server: {SERVER_NAME}")
+            address = urlsplit(SERVER_URL)
+            discovery_cache.put(SERVER_NAME, address.hostname, address.port)
         else:
             print("Failed to fetch server name.")
     except Exception as e:
@@ -113,186 +156,787 @@ def fetch_server_name():
 # ------------------ File Sync and Metadata ------------------
 
 def compute_file_hash(file_path):
-    hasher = hashlib.md5()
-    with open(file_path, 'rb') as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hasher.update(chunk)
-    return hasher.hexdigest()
+    with hash_seconds.time(call="file"):
+        file_hash = hash_file(file_path, HASH_ALGORITHM)
+    hashed_bytes.inc(os.path.getsize(file_path))
+    return file_hash
+
+def use_hash_algorithm(algorithm):
+    global HASH_ALGORITHM
+    if not algorithm or algorithm == HASH_ALGORITHM:
+        return
+    if algorithm not in available_algorithms():
+        print(f"Warning: server requested unsupported hash algorithm {algorithm}, keeping {HASH_ALGORITHM}.")
+        return
+    print(f"Using {algorithm} file hashes as requested by server.")
+    HASH_ALGORITHM = algorithm
 
 def initialize_client():
+    global metadata_store, file_index, manifest_store
+    metadata_store = ClientMetadata(METADATA_FILE)
+    metadata_store.load()
+    metadata_store.start()
+    file_index = FileIndex(INDEX_FILE)
+    file_index.load()
+    manifest_store = ManifestStore(MANIFEST_FILE)
+    manifest_store.load()
+    manifest_store.start()
     if not os.path.exists(SYNC_FOLDER):
         os.makedirs(SYNC_FOLDER)
-    if not os.path.exists(METADATA_FILE):
-        with open(METADATA_FILE, "w") as f:
-            json.dump({}, f)
 
-def load_metadata():
-    if os.path.exists(METADATA_FILE):
-        try:
-            with open(METADATA_FILE, "r") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"Warning: Failed to load metadata from {METADATA_FILE}: {e}")
-            return {}  # Return empty metadata if file corrupt or unreadable
-    else:
-        return {}
+def set_file_metadata(file_name, st, file_hash):
+    metadata_store.put(file_name, st.st_size, file_hash, HASH_ALGORITHM, st.st_mtime)
+    schedule_manifest(file_name, st.st_size, file_hash)
 
-def save_metadata(metadata):
-    try:
-        with open(METADATA_FILE, "w") as f:
-            json.dump(metadata, f, indent=4)
-    except IOError as e:
-        print(f"Error: Failed to save metadata to {METADATA_FILE}: {e}")
+def schedule_manifest(file_name, size, file_hash):
+    # Large files get their chunk manifest built in the background, so it
+    # is ready before a delta transfer needs it, here or on a peer.
+    if size >= DELTA_MIN_SIZE:
+        manifest_store.schedule(file_name, file_hash, local_path(SYNC_FOLDER, file_name))
 
 def register_with_server():
+    global server_accepts_gzip
+    backoff = Backoff(1, RETRY_TIME)
     while True:
         try:
-            response = requests.post(f"{SERVER_URL}/register", json={
+            response = server_http.post(f"{SERVER_URL}/register", json={
                 "client_id": CLIENT_ID,
                 "port": CLIENT_PORT,
-                "sync_folder": SYNC_FOLDER
-            })
+                "sync_folder": SYNC_FOLDER,
+                "file_port": file_server_port()
+            }, timeout=10)
             print(response.json())
+            use_hash_algorithm(response.json().get("hash_algorithm"))
+            server_accepts_gzip = "gzip" in response.json().get("request_encodings", [])
             return True
         except requests.exceptions.RequestException:
             print("Server offline... Trying local rediscovery...")
             if(rediscover_server_locally() == False):
-                time.sleep(RETRY_TIME)
+                time.sleep(backoff.next())
+        except Exception as e:
+            # A reply we didn't expect mustn't end the sync thread.
+            delay = backoff.next()
+            print(f"Sync round failed: {e!r}. Retrying in {delay:.0f} seconds...")
+            time.sleep(delay)
 
 def scan_folder():
-    metadata = {}
-    for file_name in os.listdir(SYNC_FOLDER):
-        file_path = os.path.join(SYNC_FOLDER, file_name)
-        if os.path.isfile(file_path):
-            metadata[file_name] = {
-                "size": os.path.getsize(file_path),
-                "hash": compute_file_hash(file_path),
-                "last_modified": os.path.getmtime(file_path)
-            }
-    save_metadata(metadata)
+    with hash_seconds.time(call="scan"):
+        metadata = scan_directory(SYNC_FOLDER, file_index, HASH_ALGORITHM)
+    metadata_store.replace_all(metadata)
+    metadata_store.flush()
+    manifest_store.retain(metadata)
+    for file_name, info in metadata.items():
+        schedule_manifest(file_name, info["size"], info["hash"])
     return metadata
 
+def fetch_server_tree(directory):
+    response = server_http.get(f"{SERVER_URL}/tree/{CLIENT_ID}", params={"dir": directory}, timeout=30)
+    if response.status_code == 404:
+        return None  # Server predates the tree index
+    response.raise_for_status()
+    return response.json()
+
+def reconcile_metadata():
+    """Find what differs between our table and the server's copy of it by
+    walking both Merkle trees from the root, descending only into
+    subtrees whose hashes differ. Returns (generation, changed, removed),
+    or None if the server can't do this."""
+    top = fetch_server_tree("")
+    if top is None or not top["generation"]:
+        # Old server, or nothing stored for us yet: a full upload it is.
+        return None
+    changed, removed = {}, []
+    if top["root"] == metadata_store.root_hash():
+        return top["generation"], changed, removed
+    stack = [("", top["children"])]
+    while stack:
+        directory, remote = stack.pop()
+        local = metadata_store.tree_children(directory) or {}
+        prefix = f"{directory}/" if directory else ""
+        for name in set(local) | set(remote):
+            mine, theirs = local.get(name), remote.get(name)
+            if mine == theirs:
+                continue
+            path = prefix + name
+            if theirs is not None and theirs[1]:
+                subtree = fetch_server_tree(path)
+                if subtree is None:
+                    # The server stopped answering tree requests midway.
+                    return None
+                stack.append((path, subtree["children"]))
+            elif theirs is not None and (mine is None or mine[1]):
+                removed.append(path)
+            if mine is not None and mine[1]:
+                if theirs is None or not theirs[1]:
+                    changed.update((n, metadata_store.get(n)) for n in metadata_store.names_under(path))
+            elif mine is not None:
+                changed[path] = metadata_store.get(path)
+    # Entries removed meanwhile are in the store's unsent set already.
+    return top["generation"], {n: info for n, info in changed.items() if info is not None}, removed
+
+def build_metadata_payload():
+    # Returns (mode, payload, names sent) where names sent have to be
+    # handed back to the store if the upload doesn't go through. payload
+    # is None when the server already has exactly our table.
+    global metadata_generation
+    if metadata_generation is None:
+        metadata_store.clear_changes()
+        reconciled = reconcile_metadata()
+        if reconciled is None:
+            return "full", {"client_id": CLIENT_ID, "metadata": metadata_store.snapshot()}, []
+        generation, changed, removed = reconciled
+        if not changed and not removed:
+            metadata_generation = generation
+            return "tree", None, []
+        return "tree", {
+            "client_id": CLIENT_ID,
+            "base_generation": generation,
+            "changed": changed,
+            "removed": removed
+        }, []
+    changed, removed = metadata_store.take_changes()
+    return "delta", {
+        "client_id": CLIENT_ID,
+        "base_generation": metadata_generation,
+        "changed": changed,
+        "removed": removed
+    }, list(changed) + removed
+
 def update_server_metadata():
-    metadata = load_metadata()
+    global metadata_generation
+    backoff = Backoff(1, RETRY_TIME)
     while True:
+        sent = []
         try:
-            requests.post(f"{SERVER_URL}/update_metadata", json={"client_id": CLIENT_ID, "metadata": metadata})
-            print("Updated metadata with server.")
+            mode, payload, sent = build_metadata_payload()
+            if payload is None:
+                print("Server metadata already up to date (tree root matches).")
+                break
+            response = post_json(server_http, f"{SERVER_URL}/update_metadata", payload,
+                                 compress=COMPRESS_REQUESTS and server_accepts_gzip, timeout=60)
+            metadata_bytes_sent[mode] += len(response.request.body or b"")
+            metadata_upload_bytes.inc(len(response.request.body or b""), mode=mode)
+            if response.status_code == 409:
+                # Server's copy isn't what we think it is, compare trees again.
+                print("Metadata generation mismatch, resynchronising with the server.")
+                metadata_generation = None
+                continue
+            response.raise_for_status()
+            metadata_generation = response.json().get("generation")
+            print(f"Updated metadata with server ({mode}). Bytes sent so far: "
+                  f"full {metadata_bytes_sent['full']}, tree {metadata_bytes_sent['tree']}, "
+                  f"delta {metadata_bytes_sent['delta']}.")
             break
         except requests.exceptions.RequestException:
-            print("Failed to update server metadata. Retrying in 60 seconds...")
+            metadata_store.restore_changes(sent)
+            print("Failed to update server metadata. Retrying...")
             if(rediscover_server_locally() == False):
-                time.sleep(RETRY_TIME)
+                time.sleep(backoff.next())
+
+def notify_server_file_deleted(file_name, moved_to=None):
+    # Sent by send_deletion_notices so the watchdog never waits on the server.
+    deletion_notices.put((file_name, moved_to))
 
-def notify_server_file_deleted(file_name):
+def send_deletion_notices():
+    while True:
+        file_name, moved_to = deletion_notices.get()
+        backoff = Backoff(1, RETRY_TIME)
+        while True:
+            try:
+                response = server_http.post(f"{SERVER_URL}/delete_file", json={
+                    "client_id": CLIENT_ID,
+                    "file_name": file_name,
+                    "moved_to": moved_to
+                }, timeout=10)
+                print(response.json()["message"])
+                break
+            except (requests.exceptions.RequestException, ValueError, KeyError):
+                delay = backoff.next()
+                print(f"Failed to notify server about deletion of {file_name}. Retrying in {delay:.0f} seconds...")
+                time.sleep(delay)
+
+def resolve_peers(peer_ids, known):
+    peers = []
+    for peer_id in peer_ids:
+        if peer_id not in known:
+            continue
+        peer_ip, peer_port, peer_folder, *rest = known[peer_id]
+        peers.append({"ip": peer_ip, "port": peer_port, "sync_folder": peer_folder,
+                      "file_port": rest[0] if rest else None})
+    return peers
+
+def fetch_sync_instructions():
+    # Apply the changes since our cursor to pending_downloads and return
+    # the files to delete, the ones among them that were moved
+    # ({name: [new name, hash]}), what each deleted version was
+    # ({name: [last_modified, hash]}) and the version to ack once they're
+    # handled.
+    global sync_cursor
+    params = {"cursor": sync_cursor} if sync_cursor else {}
+    params["deletes_ack"] = applied_delete_version
+    response = server_http.get(f"{SERVER_URL}/sync/{CLIENT_ID}", params=params, timeout=30)
+    response.raise_for_status()
+    changes = response.json()
+
+    if changes["reset"]:
+        pending_downloads.clear()
+    for file_name in changes["drop"]:
+        pending_downloads.pop(file_name, None)
+    for file_name, peer_ids, size, last_modified, file_hash in changes["get"]:
+        pending_downloads[file_name] = {
+            "peer_ids": peer_ids, "size": size, "last_modified": last_modified, "hash": file_hash
+        }
+    # Every response lists the current address of every peer, so entries
+    # still pending from earlier rounds are re-resolved too.
+    for download in pending_downloads.values():
+        download["peers"] = resolve_peers(download["peer_ids"], changes["peers"])
+    sync_cursor = changes["cursor"]
+    return (changes["delete_files"], changes.get("moves", {}), changes.get("deleted", {}),
+            changes.get("delete_version", 0))
+
+def check_sync():
+    global applied_delete_version
+    backoff = Backoff(1, RETRY_TIME)
     while True:
         try:
-            response = requests.post(f"{SERVER_URL}/delete_file", json={
-                "client_id": CLIENT_ID,
-                "file_name": file_name
-            })
-            print(response.json()["message"])
+            delete_files, moves, deleted, delete_version = fetch_sync_instructions()
+            for file_name in delete_files:
+                moved_to, move_hash = moves.get(file_name, (None, None))
+                last_modified, file_hash = deleted.get(file_name, (None, move_hash))
+                apply_remote_delete(file_name, moved_to, file_hash, last_modified)
+            applied_delete_version = max(applied_delete_version, delete_version)
+
+            downloaded = copy_local_duplicates()
+            downloaded = run_small_file_batches() or downloaded
+            jobs = [
+                {
+                    "file_name": file_name,
+                    "peer": (download["peers"][0]["ip"], download["peers"][0]["port"]),
+                    "size": download["size"],
+                    "last_modified": download["last_modified"],
+                    "download": download
+                }
+                for file_name, download in list(pending_downloads.items())
+                if download["peers"] and download["peers"][0]["ip"] and download["peers"][0]["port"]
+            ]
+            if jobs:
+                results = transfers.run_batch(jobs, run_download_job)
+                # Failed downloads stay pending and are retried next round.
+                for file_name, ok in results.items():
+                    if ok:
+                        pending_downloads.pop(file_name, None)
+                downloaded = downloaded or any(results.values())
+            # One metadata flush for the whole round.
+            if downloaded:
+                update_server_metadata()
             break
         except requests.exceptions.RequestException:
-            print("Failed to notify server about deletion. Retrying in 60 seconds...")
-            time.sleep(60)
+            delay = backoff.next()
+            print(f"Sync check failed. Retrying in {delay:.0f} seconds...")
+            time.sleep(delay)
 
-def check_sync():
-    while True:
+def run_small_file_batches():
+    # Small files are fetched from their peer many at a time in a single
+    # framed stream; whatever a batch misses falls through to the normal
+    # per-file downloads. Returns whether anything arrived.
+    by_peer = {}
+    for file_name, download in pending_downloads.items():
+        if download["size"] <= BATCH_MAX_FILE_SIZE and download["peers"]:
+            primary = download["peers"][0]
+            if primary["ip"] and primary["port"]:
+                by_peer.setdefault((primary["ip"], primary["port"]), []).append((file_name, download["size"]))
+    jobs = []
+    for peer, files in by_peer.items():
+        if len(files) < 2:
+            continue
+        for names in plan_batches(sorted(files)):
+            jobs.append({
+                "file_name": f"batch {peer[0]}:{peer[1]} {names[0]}",
+                "peer": peer,
+                "size": sum(pending_downloads[name]["size"] for name in names),
+                "last_modified": 0,
+                "names": names
+            })
+    if not jobs:
+        return False
+    stored = 0
+    for result in transfers.run_batch(jobs, run_batch_job).values():
+        for file_name in result or ():
+            pending_downloads.pop(file_name, None)
+            stored += 1
+    return stored > 0
+
+def run_batch_job(job):
+    return batch_download_from_peer(job["peer"], job["names"])
+
+def batch_download_from_peer(peer, names):
+    peer_ip, peer_port = peer
+    expected = {name: pending_downloads[name]["hash"] for name in names}
+    start_time = time.time()
+    with ExitStack() as claims:
+        for file_name in names:
+            claims.enter_context(transfers.claim(file_name))
         try:
-            response = requests.get(f"{SERVER_URL}/sync")
-            sync_instructions = response.json()
+            response = peer_http.post(f"http://{peer_ip}:{peer_port}/batch_download",
+                                      json={"files": names}, stream=True, timeout=30)
+            with response:
+                if response.status_code != 200:
+                    print(f"Batch download from {peer_ip}:{peer_port} failed: HTTP {response.status_code}")
+                    return {}
+                stored = unpack_stream(response.raw, SYNC_FOLDER, expected, HASH_ALGORITHM)
+                peer_bytes_received.inc(response.raw.tell(), peer=peer_ip, method="batch")
+        except (requests.exceptions.RequestException, BatchError, OSError) as e:
+            print(f"Batch download from {peer_ip}:{peer_port} failed: {e}")
+            downloads_total.inc(len(names), method="batch", result="failed")
+            return {}
+        record_downloaded_files(stored)
+    download_seconds.observe(time.time() - start_time, method="batch")
+    downloads_total.inc(len(stored), method="batch", result="ok")
+    print(f"Downloaded {len(stored)}/{len(names)} files in one batch from {peer_ip}:{peer_port} "
+          f"in {time.time() - start_time:.2f} seconds.")
+    return stored
 
-            if CLIENT_ID in sync_instructions:
-                instructions = sync_instructions[CLIENT_ID]
+def record_downloaded_files(hashes):
+    # Index and metadata entries for files whose hash we already know,
+    # with one index write for the whole set.
+    for file_name, file_hash in hashes.items():
+        try:
+            st = os.stat(local_path(SYNC_FOLDER, file_name))
+        except (OSError, ValueError):
+            continue
+        file_index.store(file_name, st, file_hash)
+        set_file_metadata(file_name, st, file_hash)
+    file_index.save()
 
-                for file_name in instructions.get("delete_files", []):
-                    delete_local_file(file_name)
+def run_download_job(job):
+    download = job["download"]
+    primary = download["peers"][0]
+    return download_file_from_peer(job["file_name"], primary["ip"], primary["port"], primary["sync_folder"],
+                                   download["peers"], download["size"], download["hash"], primary.get("file_port"))
 
-                for missing_file, peer_info in instructions.items():
-                    if missing_file == "delete_files":
-                        continue
-                    peer_ip, peer_port, peer_folder = peer_info["ip"], peer_info["port"], peer_info["sync_folder"]
-                    if peer_ip and peer_port:
-                        download_file_from_peer(missing_file, peer_ip, peer_port, peer_folder)
-            break
-        except requests.exceptions.RequestException:
-            print("Sync check failed. Retrying in 60 seconds...")
-            time.sleep(60)
+def has_content(file_name, file_hash):
+    # Whether our file_name hashes to file_hash right now: from the index
+    # when it knows the file as it is, else by hashing it again (files
+    # written moments ago are never trusted to the index).
+    try:
+        path = local_path(SYNC_FOLDER, file_name)
+        st = os.stat(path)
+    except (OSError, ValueError):
+        return False
+    known = file_index.lookup(file_name, st)
+    if known is not None:
+        return known == file_hash
+    info = metadata_store.get(file_name)
+    if info is None or info["hash"] != file_hash or info["size"] != st.st_size:
+        return False
+    return compute_file_hash(path) == file_hash
+
+def local_copy_of(file_hash):
+    # (name, path) of a file of ours with this content, or None.
+    for file_name in metadata_store.names_with_hash(file_hash):
+        if has_content(file_name, file_hash):
+            return file_name, local_path(SYNC_FOLDER, file_name)
+    return None
+
+def copy_local_duplicates():
+    # Pending downloads whose content we already have under another name
+    # (or already have, full stop) are copied locally instead. A copy
+    # rather than a hardlink, so editing one never changes the other.
+    copied = {}
+    for file_name, download in list(pending_downloads.items()):
+        source = local_copy_of(download["hash"]) if download["hash"] else None
+        if source is None:
+            continue
+        source_name, source_path = source
+        if source_name != file_name:
+            try:
+                file_path = local_path(SYNC_FOLDER, file_name)
+                with transfers.claim(file_name):
+                    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                    tmp_path = f"{file_path}{TEMP_SUFFIX}"
+                    shutil.copyfile(source_path, tmp_path)
+                    os.replace(tmp_path, file_path)
+            except (OSError, ValueError) as e:
+                print(f"Local copy of {source_name} to {file_name} failed ({e}), downloading instead.")
+                continue
+            copied[file_name] = download["hash"]
+            print(f"Copied {source_name} to {file_name} locally instead of downloading it.")
+        pending_downloads.pop(file_name, None)
+    record_downloaded_files(copied)
+    return bool(copied)
 
 def delete_local_file(file_name):
-    file_path = os.path.join(SYNC_FOLDER, file_name)
-    if os.path.exists(file_path):
-        os.remove(file_path)
-        print(f"Deleted {file_name} from {SYNC_FOLDER}.")
-
-def download_file_from_peer(file_name, peer_ip, peer_port, peer_folder):
-    global currently_downloading
-    file_url = f"http://{peer_ip}:{peer_port}/download/{file_name}"
     try:
-        currently_downloading = True
+        file_path = local_path(SYNC_FOLDER, file_name)
+    except ValueError:
+        return
+    with transfers.claim(file_name):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            print(f"Deleted {file_name} from {SYNC_FOLDER}.")
+            remove_empty_dirs(os.path.dirname(file_path))
+
+def remove_empty_dirs(directory):
+    # Directories only exist to hold files; drop the ones a delete emptied.
+    root = os.path.abspath(SYNC_FOLDER)
+    while directory != root and os.path.commonpath([root, directory]) == root:
+        try:
+            os.rmdir(directory)
+        except OSError:
+            return
+        directory = os.path.dirname(directory)
+
+def forget_local_file(file_name):
+    # Drop a file that no longer exists from our metadata and caches.
+    metadata_store.remove(file_name)
+    if file_index is not None:
+        file_index.discard(file_name)
+        manifest_store.discard(file_name)
+
+def apply_remote_delete(file_name, moved_to=None, file_hash=None, last_modified=None):
+    # A delete that records a move renames our copy when it has the moved
+    # content and the new name is free; anything else is deleted, unless
+    # our copy was edited after the deleted version. Returns False when
+    # the copy is kept: our next upload brings the file back.
+    if moved_to and move_local_file(file_name, moved_to, file_hash):
+        return True
+    if not is_deleted_version(file_name, file_hash, last_modified):
+        print(f"Kept {file_name}: it was edited here after the version deleted elsewhere.")
+        sync_wakeup.set()
+        return False
+    delete_local_file(file_name)
+    forget_local_file(file_name)
+    return True
+
+def is_deleted_version(file_name, file_hash, last_modified):
+    # Whether our copy is the version that was deleted, or older. Deletes
+    # that don't say which version was deleted (older servers) always are.
+    if file_hash is None and last_modified is None:
+        return True
+    try:
+        st = os.stat(local_path(SYNC_FOLDER, file_name))
+    except (OSError, ValueError):
+        return True
+    if last_modified is not None and st.st_mtime <= last_modified:
+        return True
+    return file_hash is not None and has_content(file_name, file_hash)
+
+def move_local_file(file_name, moved_to, file_hash):
+    try:
+        src_path = local_path(SYNC_FOLDER, file_name)
+        dst_path = local_path(SYNC_FOLDER, moved_to)
+    except ValueError:
+        return False
+    if not has_content(file_name, file_hash):
+        return False
+    with transfers.claim(file_name), transfers.claim(moved_to):
+        if not os.path.exists(src_path) or os.path.exists(dst_path):
+            return False
+        try:
+            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            os.rename(src_path, dst_path)
+            st = os.stat(dst_path)
+        except OSError as e:
+            print(f"Could not move {file_name} to {moved_to}: {e}")
+            return False
+        remove_empty_dirs(os.path.dirname(src_path))
+    forget_local_file(file_name)
+    record_downloaded_files({moved_to: file_hash})
+    print(f"Moved {file_name} to {moved_to}, as on the peer that moved it.")
+    return True
+
+def delta_download_from_peer(file_name, peer_ip, peer_port):
+    # Rebuild the peer's version from our own chunks plus only the missing
+    # ones. Returns False whenever a plain full download should be used,
+    # which includes either side's manifest not being built yet: chunking
+    # on demand would take longer than the download.
+    file_path = local_path(SYNC_FOLDER, file_name)
+    local_info = metadata_store.get(file_name)
+    if local_info is None or local_info["size"] < DELTA_MIN_SIZE or not os.path.exists(file_path):
+        return False
+    local_manifest = manifest_store.ready(file_name, local_info["hash"])
+    if local_manifest is None:
+        return False
+
+    base_url = f"http://{peer_ip}:{peer_port}"
+    tmp_path = f"{file_path}{TEMP_SUFFIX}"
+    try:
+        response = peer_http.get(f"{base_url}/manifest/{quote(file_name)}", timeout=10)
+        if response.status_code != 200:
+            return False
+        remote = response.json()
+        if remote.get("hash_algo") != HASH_ALGORITHM:
+            return False
+
+        def fetch_chunk(chunk_id):
+            r = peer_http.get(f"{base_url}/chunk/{chunk_id}", timeout=10)
+            r.raise_for_status()
+            return r.content
+
+        fetched = rebuild_file(remote["chunks"], file_path, local_manifest["chunks"], tmp_path, fetch_chunk)
+        if compute_file_hash(tmp_path) != remote["hash"]:
+            raise ValueError("rebuilt file hash mismatch")
+        os.replace(tmp_path, file_path)
+        total = sum(length for _, length in remote["chunks"])
+        peer_bytes_received.inc(fetched, peer=peer_ip, method="delta")
+        print(f"Delta-synced {file_name}: fetched {fetched} of {total} bytes from {peer_ip}:{peer_port}")
+        return True
+    except (requests.exceptions.RequestException, ValueError, OSError) as e:
+        print(f"Delta transfer of {file_name} failed ({e}), falling back to full download.")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+def swarm_download_from_peers(file_name, peers, size, expected_hash):
+    # Split a large file across every peer that has it, then verify it.
+    # Segments already written by an interrupted attempt are not fetched
+    # again.
+    file_path = local_path(SYNC_FOLDER, file_name)
+    tmp_path = partial_path(file_path, expected_hash)
+    state_path = partial_path(file_path, expected_hash, ".segments")
+    urls = [f"http://{peer['ip']}:{peer.get('file_port') or peer['port']}/download/{quote(file_name)}" for peer in peers]
+    try:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        fetched = swarm_download(urls, tmp_path, size, http=peer_http, state_path=state_path)
+    except (SwarmError, OSError) as e:
+        print(f"Swarm download of {file_name} failed, keeping what arrived for the next try: {e}")
+        return False
+    os.remove(state_path)
+    if not finish_download(file_name, tmp_path, file_path, expected_hash):
+        return False
+    for url, count in fetched.items():
+        peer_bytes_received.inc(count, peer=urlsplit(url).hostname, method="swarm")
+        print(f"  {count} bytes of {file_name} from {url}")
+    return True
+
+def finish_download(file_name, tmp_path, file_path, expected_hash):
+    # Move a complete download into place, only if it is the content we
+    # asked for; a partial file never shows up under the real name.
+    if expected_hash and compute_file_hash(tmp_path) != expected_hash:
+        print(f"Download of {file_name} failed verification, discarding it.")
+        os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, file_path)
+    # Partials of versions we no longer want.
+    for part in ("", ".segments"):
+        for path in glob.glob(f"{glob.escape(file_path)}.{'[0-9a-f]' * 16}{part}{TEMP_SUFFIX}"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return True
+
+def prune_partial_downloads():
+    # Interrupted downloads nobody came back for, and temp files left by a
+    # crash.
+    cutoff = time.time() - PARTIAL_MAX_AGE
+    for root, _, names in os.walk(SYNC_FOLDER):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                if name.endswith(TEMP_SUFFIX) and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+def download_file_from_peer(file_name, peer_ip, peer_port, peer_folder, swarm_peers=(), size=0, expected_hash=None,
+                            file_port=None):
+    # Peers that run a file server take plain downloads there.
+    file_url = f"http://{peer_ip}:{file_port or peer_port}/download/{quote(file_name)}"
+    try:
+        file_path = local_path(SYNC_FOLDER, file_name)
+    except ValueError as e:
+        print(f"Refusing to download {file_name}: {e}")
+        return False
+    try:
         start_time = time.time()
-        response = requests.get(file_url, stream=True, timeout=10)
-        if response.status_code == 200:
-            total_size = int(response.headers.get('content-length', 0))
-            file_path = os.path.join(SYNC_FOLDER, file_name)
-            with open(file_path, "wb") as f:
-                for chunk in tqdm(response.iter_content(chunk_size=4096), total=total_size//4096, unit='KB', unit_scale=True, desc=file_name):
-                    if chunk:
-                        f.write(chunk)
+        if delta_download_from_peer(file_name, peer_ip, peer_port):
+            method, verified = "delta", False
+        elif size >= SWARM_MIN_SIZE and len(swarm_peers) > 1 and expected_hash:
+            method, verified = "swarm", True
+            if not swarm_download_from_peers(file_name, swarm_peers, size, expected_hash):
+                downloads_total.inc(method=method, result="failed")
+                return False
+        else:
+            method, verified = "plain", bool(expected_hash)
+            if not plain_download_from_peer(file_name, file_url, file_path, peer_ip, size, expected_hash):
+                downloads_total.inc(method=method, result="failed")
+                return False
 
         end_time = time.time()
         duration = end_time - start_time
+        download_seconds.observe(duration, method=method)
+        downloads_total.inc(method=method, result="ok")
         print(f"Downloaded {file_name} from {peer_ip}:{peer_port} at {peer_folder} in {duration:.2f} seconds.")
-        update_file_metadata(file_path)
-        update_server_metadata()
-    except requests.exceptions.RequestException:
-        print(f"Failed to download {file_name} from {peer_ip}:{peer_port}")
-    finally:
-        currently_downloading = False
+        if verified:
+            record_downloaded_files({file_name: expected_hash})
+        else:
+            update_file_metadata(file_path)
+        return True
+    except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError, ValueError, OSError) as e:
+        print(f"Failed to download {file_name} from {peer_ip}:{peer_port}: {e}")
+        downloads_total.inc(method="plain", result="failed")
+        return False
+
+def plain_download_from_peer(file_name, file_url, file_path, peer_ip, size, expected_hash=None):
+    # The whole file in one response, which the peer may compress; we
+    # decode as it arrives and time the bytes on the wire. It is written
+    # to a partial file that survives failures: the next try asks only
+    # for the rest (Range), if the peer still has the same version
+    # (If-Range on the content hash), and starts over otherwise.
+    tmp_path = partial_path(file_path, expected_hash) if expected_hash else f"{file_path}{TEMP_SUFFIX}"
+    offset = os.path.getsize(tmp_path) if expected_hash and os.path.exists(tmp_path) else 0
+    if offset > size:
+        offset = 0
+    # Now and then a file comes uncompressed, to measure the link itself.
+    compress = COMPRESS_TRANSFERS and not link_meter.should_probe(peer_ip, size - offset)
+    headers = {"Accept-Encoding": accept_encoding() if compress else "identity"}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = f'"{expected_hash}"'
+    link_mbps = link_meter.get(peer_ip)
+    if link_mbps is not None:
+        headers[LINK_HEADER] = f"{link_mbps:.1f}"
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with peer_http.get(file_url, stream=True, timeout=10, headers=headers) as response:
+        if offset and response.status_code == 416 and offset == size:
+            # Everything had arrived; only the rename was missing.
+            return finish_download(file_name, tmp_path, file_path, expected_hash)
+        if response.status_code == 206 and response.headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+            print(f"Resuming {file_name} at byte {offset}.")
+        elif response.status_code == 200:
+            offset = 0
+        else:
+            print(f"Failed to download {file_name} from {file_url}: HTTP {response.status_code}")
+            return False
+        encoding = response.headers.get("Content-Encoding")
+        decoder = Decoder(encoding)
+        total_size = int(response.headers.get("Content-Length", 0)) + offset if encoding is None else size
+        wire_bytes = 0
+        with open(tmp_path, "ab" if offset else "wb") as f, \
+                tqdm(total=total_size, initial=offset, unit='B', unit_scale=True, desc=file_name) as progress:
+            for chunk in response.raw.stream(256 * 1024, decode_content=False):
+                wire_bytes += len(chunk)
+                data = decoder.decode(chunk)
+                f.write(data)
+                progress.update(len(data))
+    link_meter.record(peer_ip, wire_bytes, time.perf_counter() - start, compressed=encoding is not None)
+    peer_bytes_received.inc(wire_bytes, peer=peer_ip, method="plain")
+    if encoding is not None and wire_bytes:
+        print(f"  {file_name}: {wire_bytes} bytes on the wire ({encoding}) for {os.path.getsize(tmp_path)}")
+    return finish_download(file_name, tmp_path, file_path, expected_hash)
 
 # ------------------ Watchdog Monitoring ------------------
 
+def is_own_write(path):
+    # Our own downloads, deletes and delta temp files, not user changes.
+    return path.endswith(TEMP_SUFFIX) or transfers.is_busy(relative_name(SYNC_FOLDER, path))
+
 class SyncFolderMonitor(FileSystemEventHandler):
-    def on_created(self, event):
-        global currently_downloading
-        if currently_downloading:
+    # Events only mark paths dirty; process_file_events handles them once
+    # they have settled.
+    def on_any_event(self, event):
+        if event.event_type not in ("created", "modified", "deleted", "moved"):
             return
-        if not event.is_directory:
-            print(f"New file detected: {event.src_path}")
-            update_file_metadata(event.src_path)
-
-    def on_deleted(self, event):
-        global currently_downloading
-        if currently_downloading:
+        if event.is_directory:
+            # A directory deleted or moved away takes its files with it,
+            # without necessarily an event for each of them.
+            if event.event_type in ("deleted", "moved"):
+                directory = relative_name(SYNC_FOLDER, event.src_path)
+                for file_name in metadata_store.names_under(directory):
+                    file_events.add(local_path(SYNC_FOLDER, file_name))
             return
-        if not event.is_directory:
-            file_name = os.path.basename(event.src_path)
-            notify_server_file_deleted(file_name)
+        if event.event_type == "moved" and not is_own_write(event.dest_path):
+            with recent_moves_lock:
+                recent_moves[event.dest_path] = event.src_path
+        for path in (event.src_path, getattr(event, "dest_path", None)):
+            if path and not is_own_write(path):
+                file_events.add(path)
 
-    def on_modified(self, event):
-        global currently_downloading
-        if currently_downloading:
-            return
-        if not event.is_directory:
-            print(f"File modified: {event.src_path}")
-            update_file_metadata(event.src_path)
+def process_file_events(changed, deleted):
+    # One batch of settled paths: hash what changed in parallel (files the
+    # index already knows are skipped), with one index write per batch.
+    # A deleted file whose content turns up under a new name in the same
+    # batch was moved; the server is told so peers can rename their copy.
+    with recent_moves_lock:
+        moved_from = {path: recent_moves.pop(path) for path in changed + deleted if path in recent_moves}
+    known = {}
+    for path in changed:
+        if is_own_write(path):
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        file_hash = file_index.lookup(relative_name(SYNC_FOLDER, path), st)
+        if file_hash is None and path in moved_from:
+            # A rename keeps size, mtime and inode: the old entry still holds.
+            file_hash = file_index.lookup(relative_name(SYNC_FOLDER, moved_from[path]), st)
+        known[path] = (st, file_hash)
+    with hash_seconds.time(call="events"):
+        hashes = hash_files([path for path, (_, file_hash) in known.items() if file_hash is None], HASH_ALGORITHM)
+
+    gone = {}
+    for path in deleted:
+        file_name = relative_name(SYNC_FOLDER, path)
+        info = None if is_own_write(path) else metadata_store.get(file_name)
+        if info is not None:
+            gone[file_name] = info
+
+    updated = []
+    moves = {}  # old name -> new name
+    for path, (st, file_hash) in known.items():
+        file_name = relative_name(SYNC_FOLDER, path)
+        if file_hash is None:
+            file_hash = hashes.get(path)
+            if file_hash is None:
+                print(f"Skipping {path}: could not read it.")
+                continue
+        file_index.store(file_name, st, file_hash)
+        if file_name not in metadata_store:
+            source = match_moved_file(gone, moves, moved_from.get(path), file_hash, st.st_size)
+            if source is not None:
+                moves[source] = file_name
+        set_file_metadata(file_name, st, file_hash)
+        updated.append(file_name)
+    removed = [file_name for file_name in gone if metadata_store.remove(file_name)]
+    for file_name in removed:
+        file_index.discard(file_name)
+        manifest_store.discard(file_name)
+        notify_server_file_deleted(file_name, moves.get(file_name))
+    if updated or removed:
+        file_index.save()
+        print(f"Local changes: {len(updated)} files updated, {len(removed)} deleted, {len(moves)} of them moves.")
+        sync_wakeup.set()
+
+def match_moved_file(gone, moves, watched_source, file_hash, size):
+    # The deleted file a new one was moved from: the source watchdog
+    # reported if its content matches, else any deleted file with the same
+    # hash and size that isn't already paired.
+    candidates = [relative_name(SYNC_FOLDER, watched_source)] if watched_source else []
+    candidates += [name for name, info in gone.items() if info["hash"] == file_hash]
+    for name in candidates:
+        info = gone.get(name)
+        if info is not None and name not in moves and info["hash"] == file_hash and info["size"] == size:
+            return name
+    return None
 
 def update_file_metadata(file_path):
-    metadata = load_metadata()
-    file_name = os.path.basename(file_path)
+    file_name = relative_name(SYNC_FOLDER, file_path)
 
     # Retry logic for locked/incomplete files
     max_attempts = 5
     for attempt in range(max_attempts):
         try:
             if os.path.exists(file_path):
-                metadata[file_name] = {
-                    "size": os.path.getsize(file_path),
-                    "hash": compute_file_hash(file_path),
-                    "last_modified": os.path.getmtime(file_path)
-                }
-                save_metadata(metadata)
+                st = os.stat(file_path)
+                file_hash = file_index.lookup(file_name, st)
+                if file_hash is None:
+                    file_hash = compute_file_hash(file_path)
+                    file_index.store(file_name, st, file_hash)
+                    file_index.save()
+                set_file_metadata(file_name, st, file_hash)
                 return
         except (PermissionError, OSError) as e:
             print(f"Error reading file {file_path}: {e}. Retrying ({attempt+1}/{max_attempts})...")
@@ -301,6 +945,9 @@ def update_file_metadata(file_path):
     print(f"Skipping {file_path} after {max_attempts} failed attempts.")
 
 def start_monitoring():
+    global file_events
+    file_events = EventPipeline(process_file_events)
+    file_events.start()
     observer = Observer()
     observer.schedule(SyncFolderMonitor(), SYNC_FOLDER, recursive=True)
     observer.start()
@@ -314,92 +961,231 @@ def start_monitoring():
 # ------------------ Handling Dynamic IP change ------------------
 
 def rediscover_server_locally():
+    # Returns True if the server turned up at a different address; callers
+    # retry right away then, and back off otherwise.
     global SERVER_URL
-    port = 5000
-    target_name = SERVER_NAME
-
-    hostname = socket.gethostname()
-    local_ip = socket.gethostbyname(hostname)
-    ip_parts = local_ip.split('.')
-    subnet = f"{ip_parts[0]}.{ip_parts[1]}.{ip_parts[2]}.0/24"
-    network = ipaddress.ip_network(subnet, strict=False)
-
-    for ip in network.hosts():
-        try:
-            r = requests.get(f"http://{ip}:{port}/server_name", timeout=0.5)
-            if r.status_code == 200 and r.json().get("name") == target_name:
-                print(f"Rediscovered server at new IP: {ip}")
-                SERVER_URL = f"http://{ip}:{port}"
-                # Update the client setup file with the new IP
-                if os.path.exists(SETUP_FILE):
-                    with open(SETUP_FILE, "r") as f:
-                        lines = f.read().splitlines()
-                    if len(lines) >= 4:
-                        lines[2] = SERVER_URL  # Update server IP line
-                        with open(SETUP_FILE, "w") as f:
-                            f.write("\n".join(lines))
-                        print(f"Updated new SERVER_URL in {SETUP_FILE}: {SERVER_URL}")
-                return True
-        except:
-            pass
-
-    print("Could not rediscover server locally.")
-    return False
+    address = find_server(SERVER_NAME, discovery_cache)
+    if address is None:
+        print("Could not rediscover server locally.")
+        return False
+    new_url = f"http://{address[0]}:{address[1]}"
+    if new_url == SERVER_URL:
+        return False
+    print(f"Rediscovered server at new IP: {address[0]}")
+    SERVER_URL = new_url
+    # Update the client setup file with the new IP
+    if os.path.exists(SETUP_FILE):
+        with open(SETUP_FILE, "r") as f:
+            lines = f.read().splitlines()
+        if len(lines) >= 4:
+            lines[2] = SERVER_URL  # Update server IP line
+            with open(SETUP_FILE, "w") as f:
+                f.write("\n".join(lines))
+            print(f"Updated new SERVER_URL in {SETUP_FILE}: {SERVER_URL}")
+    return True
 
 # ------------------ Periodic Tasks ------------------
 
+def poll_server():
+    # One small request comparing digests. Returns (upload metadata?,
+    # run /sync?, fleet digest), or None if the server has no /poll.
+    global metadata_generation
+    params = {"cursor": sync_cursor} if sync_cursor else {}
+    response = server_http.get(f"{SERVER_URL}/poll/{CLIENT_ID}", params=params, timeout=5)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    status = response.json()
+    upload = metadata_generation is None or metadata_store.has_changes()
+    if status["root"] != metadata_store.root_hash() and not upload:
+        # Nothing unsent, yet the server's copy differs: compare trees.
+        metadata_generation = None
+        upload = True
+    sync = status["sync"] or bool(pending_downloads) or status["digest"] != fleet_digest
+    return upload, sync, status["digest"]
+
 def server_check():
+    global fleet_digest
+    backoff = Backoff(1, RETRY_TIME)
     while True:
         try:
-            if currently_downloading:
-                print("Currently downloading. Skipping sync check this time.")
-            else:
-                requests.get(f"{SERVER_URL}/get_clients", timeout=5)
+            sync_wakeup.clear()
+            status = poll_server() if FAST_POLL else None
+            if status is None:
+                server_http.get(f"{SERVER_URL}/get_clients", timeout=5)
                 update_server_metadata()
                 check_sync()
-            time.sleep(SYNC_TIME)
+            else:
+                upload, sync, digest = status
+                if upload:
+                    update_server_metadata()
+                if sync:
+                    check_sync()
+                    fleet_digest = digest
+            backoff.reset()
+            with sync_round:
+                sync_round.notify_all()
+            # Woken early by a pushed change or a local edit; the timeout is
+            # the polling interval when the server can't push.
+            sync_wakeup.wait(PUSH_SAFETY_TIME if push_available else SYNC_TIME)
         except requests.exceptions.RequestException:
             print("Server offline... Trying local rediscovery...")
             if(rediscover_server_locally() == False):
-                time.sleep(RETRY_TIME)
+                time.sleep(backoff.next())
+        except Exception as e:
+            # A reply we didn't expect mustn't end the sync thread.
+            delay = backoff.next()
+            print(f"Sync round failed: {e!r}. Retrying in {delay:.0f} seconds...")
+            time.sleep(delay)
+
+def watch_server_changes():
+    # Hold a long-poll open on the server and wake the sync loop when it
+    # reports a change for us. Any failure drops back to plain polling.
+    global push_available
+    push_available = True
+    while True:
+        cursor = sync_cursor
+        if cursor is None:
+            # No cursor until the first sync round has run.
+            with sync_round:
+                sync_round.wait(SYNC_TIME)
+            continue
+        try:
+            response = server_http.get(f"{SERVER_URL}/wait/{CLIENT_ID}",
+                                       params={"cursor": cursor, "timeout": LONG_POLL_TIMEOUT},
+                                       timeout=LONG_POLL_TIMEOUT + 10)
+            response.raise_for_status()
+            changed = response.json()["changed"]
+        except (requests.exceptions.RequestException, ValueError, KeyError):
+            if push_available:
+                print(f"Change notifications unavailable, polling every {SYNC_TIME} seconds.")
+            push_available = False
+            time.sleep(SYNC_TIME)
+            continue
+        push_available = True
+        if changed:
+            sync_wakeup.set()
+            # Don't ask again with the same cursor before the round ran.
+            with sync_round:
+                sync_round.wait_for(lambda: sync_cursor != cursor, SYNC_TIME)
+
+def file_server_port():
+    return None if FILE_SERVER_PORT_OFFSET is None else CLIENT_PORT + FILE_SERVER_PORT_OFFSET
+
+def start_file_server():
+    # Strong ETags from the index when it knows the file's hash as it is,
+    # else from the metadata entry recorded for this exact size and mtime:
+    # files written moments ago are never in the index, and without a
+    # strong ETag a peer's If-Range can't match and its resume restarts.
+    def etag_for(file_name, st):
+        file_hash = file_index.lookup(file_name, st)
+        if file_hash is None:
+            info = metadata_store.get(file_name)
+            if info is not None and (info["size"], info["last_modified"]) == (st.st_size, st.st_mtime):
+                file_hash = info["hash"]
+        return f'"{file_hash}"' if file_hash else None
+    FileServer(SYNC_FOLDER, file_server_port(), etag_for, compress=COMPRESS_TRANSFERS).start()
 
 def start_sync_process():
+    global FILE_SERVER_PORT_OFFSET
     initialize_client()
+    prune_partial_downloads()
+    if FILE_SERVER_PORT_OFFSET is not None:
+        try:
+            start_file_server()
+        except OSError as e:
+            print(f"Could not start the file server on port {file_server_port()} ({e}), serving files from Flask.")
+            FILE_SERVER_PORT_OFFSET = None
     register_with_server()
     scan_folder()
     update_server_metadata()
 
     threading.Thread(target=server_check, daemon=True).start()
+    threading.Thread(target=send_deletion_notices, daemon=True).start()
+    if PUSH_NOTIFICATIONS:
+        threading.Thread(target=watch_server_changes, daemon=True).start()
     start_monitoring()
 
 # ------------------ File Server Endpoints ------------------
 
-@app.route("/download/<filename>", methods=["GET"])
+# Also kept for peers from before the file server.
+@app.route("/download/<path:filename>", methods=["GET"])
 def serve_file(filename):
-    file_path = os.path.join(SYNC_FOLDER, filename)
-    if os.path.exists(file_path):
-        return send_file(file_path, as_attachment=True)
+    try:
+        file_path = served_path(SYNC_FOLDER, filename)
+    except ValueError:
+        return {"message": "File not found"}, 404
+    if os.path.isfile(file_path):
+        # conditional=True answers Range requests, used by swarm downloads.
+        return send_file(file_path, as_attachment=True, conditional=True)
     return {"message": "File not found"}, 404
 
+@app.route("/batch_download", methods=["POST"])
+def serve_batch():
+    names = request.json.get("files", [])
+    return Response(pack_files(SYNC_FOLDER, names), mimetype="application/octet-stream")
+
+@app.route("/manifest/<path:filename>", methods=["GET"])
+def serve_manifest(filename):
+    try:
+        file_path = local_path(SYNC_FOLDER, filename)
+    except ValueError:
+        return {"message": "File not found"}, 404
+    info = metadata_store.get(filename) if metadata_store else None
+    if info is None or not os.path.exists(file_path):
+        return {"message": "File not found"}, 404
+    schedule_manifest(filename, info["size"], info["hash"])
+    manifest = manifest_store.ready(filename, info["hash"], MANIFEST_WAIT)
+    if manifest is None:
+        # Still being built; the peer downloads the whole file instead.
+        return {"message": "Manifest not ready"}, 404
+    return jsonify({
+        "hash": info["hash"],
+        "hash_algo": info.get("hash_algo", LEGACY_ALGORITHM),
+        "chunks": [[h, length] for h, _, length in manifest["chunks"]]
+    })
+
+@app.route("/chunk/<chunk_id>", methods=["GET"])
+def serve_chunk(chunk_id):
+    location = manifest_store.locate(chunk_id) if manifest_store else None
+    if location is None:
+        return {"message": "Chunk not found"}, 404
+    file_name, offset, length = location
+    try:
+        with open(served_path(SYNC_FOLDER, file_name), "rb") as f:
+            f.seek(offset)
+            data = f.read(length)
+    except (OSError, ValueError):
+        return {"message": "Chunk not found"}, 404
+    # The file may have changed since its manifest was built.
+    if chunk_hash(data) != chunk_id:
+        return {"message": "Chunk not found"}, 404
+    return Response(data, mimetype="application/octet-stream")
+
 @app.route("/delete_file", methods=["POST"])
 def delete_requested_file():
+    # Pushed by the server; the same delete may also arrive through /sync.
     data = request.json
     file_name = data.get("file_name")
 
-    delete_local_file(file_name)
-    metadata = load_metadata()
-    if file_name in metadata:
-        del metadata[file_name]
-        save_metadata(metadata)
+    if not apply_remote_delete(file_name, data.get("moved_to"), data.get("hash"), data.get("last_modified")):
+        return jsonify({"message": f"{file_name} was edited after the deleted version, kept."}), 409
 
     return jsonify({"message": f"File {file_name} deleted from {SYNC_FOLDER}."})
 
 # ------------------ Main Entry ------------------
 
+def run_http_server(host="0.0.0.0"):
+    if serve is not None:
+        # Long downloads each hold a thread.
+        serve(app, host=host, port=CLIENT_PORT, threads=32)
+    else:
+        app.run(host=host, port=CLIENT_PORT)
+
 if __name__ == "__main__":
     if not os.path.exists(SETUP_FILE):
         threading.Timer(1.0, lambda: webbrowser.open(f"http://127.0.0.1:{CLIENT_PORT}")).start()
-        app.run(host="0.0.0.0", port=CLIENT_PORT)
+        run_http_server()
     else:
         with open(SETUP_FILE, "r") as f:
             lines = f.read().splitlines()
@@ -409,6 +1195,8 @@ if __name__ == "__main__":
             SERVER_NAME = lines[3]
             SYNC_TIME = int(lines[4])
             METADATA_FILE = f"./{CLIENT_ID}_metadata.json"
+            INDEX_FILE = f"./{CLIENT_ID}_index.json"
+            MANIFEST_FILE = f"./{CLIENT_ID}_manifests.json"
 
         threading.Thread(target=start_sync_process, daemon=True).start()
-        app.run(host="0.0.0.0", port=CLIENT_PORT)
\ No newline at end of file
+        run_http_server()
\ No newline at end of file
@@ -0,0 +1,380 @@
+import bisect
+import hashlib
+import json
+import os
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# FastCDC-style content-defined chunking: a gear rolling hash picks chunk
+# boundaries from the content itself, so an edit only changes the chunks it
+# touches instead of shifting every block after it.
+MIN_CHUNK = 16 * 1024
+AVG_CHUNK = 64 * 1024
+MAX_CHUNK = 256 * 1024
+READ_SIZE = 4 * 1024 * 1024
+
+# Files below this are cheaper to fetch whole than to diff.
+DELTA_MIN_SIZE = 1024 * 1024
+
+_M64 = (1 << 64) - 1
+# Normalized chunking: a stricter mask before the average size and a looser
+# one after it keeps chunk sizes close to AVG_CHUNK.
+_MASK_S = ((1 << 18) - 1) << 46
+_MASK_L = ((1 << 14) - 1) << 50
+_GEAR = [
+    int.from_bytes(hashlib.blake2b(bytes([i]), digest_size=8).digest(), "big")
+    for i in range(256)
+]
+# Every bit of the hash has been shifted out after this many bytes, so
+# past the first ones of a chunk it only depends on the last _WINDOW.
+_WINDOW = 64
+_GEAR_ARRAY = numpy.array(_GEAR, dtype=numpy.uint64) if numpy is not None else None
+_HASH_BLOCK = 64 * 1024
+
+
+def chunk_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _find_cut(data, start, end):
+    remaining = end - start
+    if remaining <= MIN_CHUNK:
+        return end
+    stop = start + min(remaining, MAX_CHUNK)
+    normal = start + min(remaining, AVG_CHUNK)
+    gear = _GEAR
+    fp = 0
+    i = start + MIN_CHUNK
+    while i < normal:
+        fp = ((fp << 1) + gear[data[i]]) & _M64
+        if not fp & _MASK_S:
+            return i + 1
+        i += 1
+    while i < stop:
+        fp = ((fp << 1) + gear[data[i]]) & _M64
+        if not fp & _MASK_L:
+            return i + 1
+        i += 1
+    return stop
+
+
+def _window_hashes(values):
+    # The gear hash of the _WINDOW bytes ending at every position of values
+    # (a uint8 array), all at once: the hash over 2m bytes is the one over
+    # the last m plus the one over the m before, shifted m bits further.
+    fp = _GEAR_ARRAY[values]
+    m = 1
+    while m < _WINDOW:
+        fp[m:] += fp[:-m] << numpy.uint64(m)
+        m *= 2
+    return fp
+
+
+class _Candidates:
+    """Positions of data where the windowed gear hash passes the loose
+    mask, and whether each passes the strict one too. Cuts can only be
+    made after one of them, so _find_cut_at only hashes the first bytes
+    of a chunk itself."""
+
+    def __init__(self, data):
+        values = numpy.frombuffer(data, dtype=numpy.uint8)
+        self.loose = []
+        self.strict = []
+        # A block at a time keeps the arrays in cache; each one takes the
+        # window before it along.
+        for start in range(0, len(values), _HASH_BLOCK):
+            lo = max(0, start - _WINDOW + 1)
+            fp = _window_hashes(values[lo:start + _HASH_BLOCK])[start - lo:]
+            hits = numpy.flatnonzero((fp & numpy.uint64(_MASK_L)) == 0)
+            self.loose.extend((hits + start).tolist())
+            self.strict.extend(((fp[hits] & numpy.uint64(_MASK_S)) == 0).tolist())
+
+
+def _find_cut_at(data, start, end, candidates):
+    # Same cut as _find_cut, from the candidates' precomputed hashes.
+    remaining = end - start
+    if remaining <= MIN_CHUNK:
+        return end
+    stop = start + min(remaining, MAX_CHUNK)
+    normal = start + min(remaining, AVG_CHUNK)
+    gear = _GEAR
+    fp = 0
+    i = start + MIN_CHUNK
+    # The hash starts from 0 here, so until a whole window is in, it isn't
+    # the windowed one.
+    head = min(stop, i + _WINDOW - 1)
+    while i < head:
+        fp = ((fp << 1) + gear[data[i]]) & _M64
+        if not fp & (_MASK_S if i < normal else _MASK_L):
+            return i + 1
+        i += 1
+    loose, strict = candidates.loose, candidates.strict
+    k = bisect.bisect_left(loose, i)
+    while k < len(loose) and loose[k] < stop:
+        if loose[k] >= normal or strict[k]:
+            return loose[k] + 1
+        k += 1
+    return stop
+
+
+def chunk_file(file_path):
+    """Return the manifest of a file as a list of [chunk_hash, offset, length].
+
+    With numpy the rolling hash is computed a block at a time, else byte
+    by byte in Python; both cut in the same places."""
+    chunks = []
+    offset = 0
+    buf = b""
+    eof = False
+    with open(file_path, "rb") as f:
+        while True:
+            block = f.read(READ_SIZE)
+            if block:
+                buf += block
+            else:
+                eof = True
+            # Cut only where a full MAX_CHUNK of lookahead is buffered, so
+            # boundaries don't depend on how the file was read.
+            end = len(buf) if eof else len(buf) - MAX_CHUNK
+            candidates = _Candidates(buf) if numpy is not None and end > 0 else None
+            pos = 0
+            while pos < end:
+                if candidates is not None:
+                    cut = _find_cut_at(buf, pos, len(buf), candidates)
+                else:
+                    cut = _find_cut(buf, pos, len(buf))
+                chunks.append([chunk_hash(buf[pos:cut]), offset, cut - pos])
+                offset += cut - pos
+                pos = cut
+            buf = buf[pos:]
+            if eof:
+                return chunks
+
+
+def rebuild_file(remote_chunks, local_path, local_chunks, out_path, fetch_chunk):
+    """Write out_path from remote_chunks ([hash, length] pairs), copying
+    chunks listed in local_chunks from local_path and fetching the rest.
+
+    Returns the number of bytes fetched from the peer."""
+    local = {}
+    for h, offset, length in local_chunks or ():
+        local.setdefault(h, (offset, length))
+
+    fetched = 0
+    written = {}
+    src = open(local_path, "rb") if local else None
+    try:
+        with open(out_path, "w+b") as out:
+            for h, length in remote_chunks:
+                if h in local:
+                    offset, _ = local[h]
+                    src.seek(offset)
+                    data = src.read(length)
+                elif h in written:
+                    # Repeated chunk already fetched earlier in this file.
+                    out.seek(written[h])
+                    data = out.read(length)
+                    out.seek(0, os.SEEK_END)
+                else:
+                    data = fetch_chunk(h)
+                    fetched += len(data)
+                if len(data) != length or chunk_hash(data) != h:
+                    raise ValueError(f"Chunk {h} failed verification")
+                written.setdefault(h, out.tell())
+                out.write(data)
+    finally:
+        if src is not None:
+            src.close()
+    return fetched
+
+
+class ManifestStore:
+    """Chunk manifests per file, built by a background thread and only
+    handed out for the file hash they were built from.
+
+    manifest_file is an append-only log with one JSON record per line,
+    either a file's manifest or its removal, so storing one manifest
+    doesn't rewrite the others. The log is rewritten with just the live
+    manifests once replaced records outnumber them.
+    """
+
+    COMPACT_MIN = 64  # replaced records tolerated beyond the live ones
+
+    def __init__(self, manifest_file):
+        self.manifest_file = manifest_file
+        self.manifests = {}
+        self.locations = {}
+        self.records = 0      # lines in manifest_file
+        self.pending = {}     # file_name -> (file_hash, file_path) to chunk
+        self.lock = threading.Lock()
+        self.file_lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.built = threading.Condition(self.lock)
+
+    def load(self):
+        manifests = {}
+        records = 0
+        rewrite = False
+        try:
+            with open(self.manifest_file, "r") as f:
+                for line in f:
+                    # A line without its newline was cut short by a crash
+                    # (or is the old whole-file format); appending after it
+                    # would spoil the next record, so the log is rewritten.
+                    rewrite |= not line.endswith("\n")
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if not isinstance(record, dict):
+                        continue
+                    records += 1
+                    file_name = record.get("file")
+                    if not isinstance(file_name, str):
+                        # The whole {file_name: manifest} map, as written
+                        # before the log.
+                        manifests.update(record)
+                        rewrite = True
+                    elif record.get("chunks") is None:
+                        manifests.pop(file_name, None)
+                    else:
+                        manifests[file_name] = {"hash": record["hash"], "chunks": record["chunks"]}
+        except FileNotFoundError:
+            pass
+        except (IOError, KeyError) as e:
+            print(f"Warning: Failed to load chunk manifests from {self.manifest_file}: {e}")
+            return
+        with self.lock:
+            self.manifests = manifests
+            self.locations = {}
+            for file_name, manifest in manifests.items():
+                self._index(file_name, manifest)
+            self.records = records
+        if rewrite:
+            self._compact()
+        else:
+            self._compact_if_needed()
+
+    def start(self):
+        threading.Thread(target=self._run, name="manifests", daemon=True).start()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while not self.pending:
+                    self.wakeup.wait()
+                file_name = next(iter(self.pending))
+                file_hash, file_path = self.pending.pop(file_name)
+            try:
+                self.build(file_name, file_hash, file_path)
+            except (OSError, ValueError) as e:
+                print(f"Could not chunk {file_name}: {e}")
+
+    def _append(self, record):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self.file_lock:
+            try:
+                with open(self.manifest_file, "a") as f:
+                    f.write(line)
+            except IOError as e:
+                print(f"Error: Failed to save chunk manifests to {self.manifest_file}: {e}")
+                return
+            with self.lock:
+                self.records += 1
+        self._compact_if_needed()
+
+    def _compact_if_needed(self):
+        with self.lock:
+            needed = self.records > 2 * len(self.manifests) + self.COMPACT_MIN
+        if needed:
+            self._compact()
+
+    def _compact(self):
+        # Under file_lock, so no append lands in the file being replaced.
+        with self.file_lock:
+            with self.lock:
+                snapshot = dict(self.manifests)
+            tmp_path = f"{self.manifest_file}.tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    for file_name, manifest in snapshot.items():
+                        f.write(json.dumps({"file": file_name, **manifest}, separators=(",", ":")) + "\n")
+                os.replace(tmp_path, self.manifest_file)
+            except IOError as e:
+                print(f"Error: Failed to save chunk manifests to {self.manifest_file}: {e}")
+                return
+            with self.lock:
+                self.records = len(snapshot)
+
+    def _index(self, file_name, manifest):
+        for h, offset, length in manifest["chunks"]:
+            self.locations[h] = (file_name, offset, length)
+
+    def _unindex(self, file_name, manifest):
+        for h, _, _ in manifest["chunks"]:
+            if self.locations.get(h, (None,))[0] == file_name:
+                del self.locations[h]
+
+    def schedule(self, file_name, file_hash, file_path):
+        # Have the background thread chunk file_path, unless the manifest
+        # for this hash is there already. A newer request replaces one
+        # still waiting.
+        with self.lock:
+            manifest = self.manifests.get(file_name)
+            if manifest is not None and manifest["hash"] == file_hash:
+                self.pending.pop(file_name, None)
+                return
+            self.pending[file_name] = (file_hash, file_path)
+            self.wakeup.notify()
+
+    def build(self, file_name, file_hash, file_path):
+        """Chunk file_path now and store its manifest under file_hash.
+        Returns None, storing nothing, if the file changed meanwhile."""
+        before = os.stat(file_path)
+        chunks = chunk_file(file_path)
+        after = os.stat(file_path)
+        if (before.st_size, before.st_mtime_ns) != (after.st_size, after.st_mtime_ns):
+            return None
+        manifest = {"hash": file_hash, "chunks": chunks}
+        with self.lock:
+            old = self.manifests.get(file_name)
+            if old is not None:
+                self._unindex(file_name, old)
+            self.manifests[file_name] = manifest
+            self._index(file_name, manifest)
+            self.built.notify_all()
+        self._append({"file": file_name, **manifest})
+        return manifest
+
+    def ready(self, file_name, file_hash, timeout=0):
+        # The manifest of file_name as it hashes to file_hash, or None if
+        # it isn't built within timeout seconds.
+        def current():
+            manifest = self.manifests.get(file_name)
+            return manifest if manifest is not None and manifest["hash"] == file_hash else None
+        with self.lock:
+            return self.built.wait_for(current, timeout) if timeout else current()
+
+    def discard(self, file_name):
+        with self.lock:
+            self.pending.pop(file_name, None)
+            manifest = self.manifests.pop(file_name, None)
+            if manifest is None:
+                return
+            self._unindex(file_name, manifest)
+        self._append({"file": file_name})
+
+    def retain(self, names):
+        # Discard the manifests of files not among names.
+        with self.lock:
+            gone = [file_name for file_name in self.manifests if file_name not in names]
+        for file_name in gone:
+            self.discard(file_name)
+
+    def locate(self, h):
+        with self.lock:
+            return self.locations.get(h)
@@ -0,0 +1,175 @@
+import os
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_DECODE_ERRORS = (zlib.error,) if zstandard is None else (zlib.error, zstandard.ZstdError)
+
+COMPRESS_MIN_SIZE = 4096
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_MIN_SAVING = 0.1  # a level-1 pass over the sample must save at least this much
+CHUNK_SIZE = 256 * 1024
+# Link speed (MB/s) -> level: the slower the link, the more CPU per byte
+# is worth spending. At or above the first threshold compression would
+# only slow the transfer down.
+LEVELS = {
+    "zstd": [(200, None), (50, 1), (10, 3), (2, 9), (0, 15)],
+    "gzip": [(40, None), (10, 1), (2, 6), (0, 9)],
+}
+DEFAULT_LEVEL = {"zstd": 3, "gzip": 6}  # link speed not known yet
+# Sent by the downloader: its recent throughput from us, in MB/s.
+LINK_HEADER = "X-SyncIt-Link-MBps"
+
+# Already compressed; another pass costs CPU and saves nothing.
+COMPRESSED_EXTENSIONS = frozenset((
+    ".7z", ".apk", ".avi", ".avif", ".br", ".bz2", ".cab", ".docx", ".epub", ".flac", ".gif", ".gz", ".heic",
+    ".jar", ".jpeg", ".jpg", ".lz", ".lz4", ".lzma", ".m4a", ".m4v", ".mkv", ".mov", ".mp3", ".mp4", ".odp",
+    ".ods", ".odt", ".ogg", ".opus", ".png", ".pptx", ".rar", ".tgz", ".webm", ".webp", ".whl", ".xlsx",
+    ".xz", ".zip", ".zst",
+))
+
+
+def available_encodings():
+    """Content-codings we can produce and decode, preferred first."""
+    return ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+
+
+def accept_encoding():
+    return ", ".join(available_encodings())
+
+
+def choose_encoding(accept_header):
+    # Our preferred coding among those the client accepts (q=0 refuses).
+    accepted = set()
+    for item in (accept_header or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip().lower())
+    for encoding in available_encodings():
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+def parse_link_mbps(value):
+    try:
+        rate = float(value)
+    except (TypeError, ValueError):
+        return None
+    return rate if rate > 0 else None
+
+
+def level_for(encoding, link_mbps):
+    """Compression level for a link of link_mbps MB/s (None if unknown),
+    or None if the link is fast enough that compressing doesn't pay."""
+    if link_mbps is None:
+        return DEFAULT_LEVEL[encoding]
+    for threshold, level in LEVELS[encoding]:
+        if link_mbps >= threshold:
+            return level
+    return LEVELS[encoding][-1][1]
+
+
+def worth_compressing(path, f, size):
+    """Whether a file looks compressible: not too small, not a known
+    compressed type, and a fast pass over its first bytes shrinks them.
+    Leaves f at the start."""
+    if size < COMPRESS_MIN_SIZE:
+        return False
+    if os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS:
+        return False
+    sample = f.read(SAMPLE_SIZE)
+    f.seek(0)
+    return len(zlib.compress(sample, 1)) <= len(sample) * (1 - SAMPLE_MIN_SAVING)
+
+
+def compress_chunks(f, encoding, level, chunk_size=CHUNK_SIZE):
+    # The rest of f, compressed as it is read.
+    if encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip framing
+    while True:
+        block = f.read(chunk_size)
+        if not block:
+            break
+        out = compressor.compress(block)
+        if out:
+            yield out
+    out = compressor.flush()
+    if out:
+        yield out
+
+
+class Decoder:
+    """Undoes a Content-Encoding chunk by chunk (identity if None)."""
+
+    def __init__(self, encoding):
+        if encoding in (None, "", "identity"):
+            self._decompress = None
+        elif encoding == "gzip":
+            self._decompress = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress
+        elif encoding == "zstd" and zstandard is not None:
+            self._decompress = zstandard.ZstdDecompressor().decompressobj().decompress
+        else:
+            raise ValueError(f"Unsupported content encoding: {encoding}")
+
+    def decode(self, chunk):
+        if self._decompress is None:
+            return chunk
+        try:
+            return self._decompress(chunk)
+        except _DECODE_ERRORS as e:
+            raise ValueError(f"Corrupt compressed stream: {e}")
+
+
+class LinkMeter:
+    """Recent throughput to each peer in MB/s, from the bytes that crossed
+    the wire, smoothed over transfers.
+
+    A compressed transfer can be held back by the sender's CPU rather
+    than the link, so it never sets the estimate, only raises it (the
+    link is at least that fast); uncompressed ones move it either way.
+    should_probe() says when to ask for a file uncompressed so that the
+    estimate comes from the link: before the first such sample, and again
+    every PROBE_EVERY compressed ones.
+    """
+
+    MIN_SAMPLE = 256 * 1024  # smaller transfers mostly measure latency
+    PROBE_EVERY = 16
+
+    def __init__(self, weight=0.3):
+        self.weight = weight
+        self.lock = threading.Lock()
+        self.rates = {}
+        self.since_probe = {}  # compressed samples since the last uncompressed one
+
+    def record(self, peer, wire_bytes, seconds, compressed=False):
+        if wire_bytes < self.MIN_SAMPLE or seconds <= 0:
+            return
+        rate = wire_bytes / seconds / 1e6
+        with self.lock:
+            old = self.rates.get(peer)
+            if compressed:
+                self.since_probe[peer] = self.since_probe.get(peer, 0) + 1
+                if old is not None and rate > old:
+                    self.rates[peer] = old + self.weight * (rate - old)
+            else:
+                self.since_probe[peer] = 0
+                self.rates[peer] = rate if old is None else old + self.weight * (rate - old)
+
+    def should_probe(self, peer, size):
+        # Whether to fetch size bytes from peer uncompressed to measure it.
+        if size < self.MIN_SAMPLE:
+            return False
+        with self.lock:
+            return peer not in self.rates or self.since_probe.get(peer, 0) >= self.PROBE_EVERY
+
+    def get(self, peer):
+        with self.lock:
+            return self.rates.get(peer)
@@ -0,0 +1,170 @@
+import ipaddress
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+SERVER_PORT = 5000
+ANNOUNCE_PORT = 5001  # UDP, see Server-RPi/announcer.py
+PROBE_WORKERS = 128
+PROBE_TIMEOUT = 0.4
+ANNOUNCE_WAIT = 1.5   # a little over the server's announce interval
+
+
+def local_ip():
+    # The address we'd use to reach the outside; nothing is sent.
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(("8.8.8.8", 80))
+        return s.getsockname()[0]
+    except OSError:
+        return socket.gethostbyname(socket.gethostname())
+    finally:
+        s.close()
+
+
+def subnet_hosts(ip=None):
+    """Every host address of the /24 around ip (ours by default)."""
+    network = ipaddress.ip_network(f"{ip or local_ip()}/24", strict=False)
+    return [str(host) for host in network.hosts()]
+
+
+def probe(ip, port=SERVER_PORT, timeout=PROBE_TIMEOUT):
+    # The server's name if a SyncIt server answers at ip:port, else None.
+    try:
+        r = requests.get(f"http://{ip}:{port}/server_name", timeout=timeout)
+        if r.status_code == 200:
+            return r.json().get("name") or f"Server @ {ip}"
+    except (requests.exceptions.RequestException, ValueError):
+        pass
+    return None
+
+
+def scan(hosts, port=SERVER_PORT, target_name=None, workers=PROBE_WORKERS, timeout=PROBE_TIMEOUT):
+    """Probe hosts concurrently with a bounded pool.
+
+    Returns [{"ip", "name"}] for every server found, or, with
+    target_name, as soon as a server with that name answers (probes not
+    yet started are cancelled).
+    """
+    found = []
+    stop = threading.Event()
+
+    def check(ip):
+        if stop.is_set():
+            return ip, None
+        return ip, probe(ip, port, timeout)
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for future in as_completed([pool.submit(check, ip) for ip in hosts]):
+            ip, name = future.result()
+            if name is None:
+                continue
+            found.append({"ip": ip, "name": name})
+            if target_name is not None and name == target_name:
+                stop.set()
+                return [found[-1]]
+        return [] if target_name is not None else found
+    finally:
+        # Don't wait for probes still in flight; they time out on their own.
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def listen_for_announce(target_name=None, wait=ANNOUNCE_WAIT, announce_port=ANNOUNCE_PORT):
+    """Collect UDP announcements for `wait` seconds, or until one from
+    target_name arrives. Returns [{"ip", "name", "port"}]."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    found = {}
+    try:
+        # Several clients on one machine all get the broadcast.
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        s.bind(("", announce_port))
+        deadline = time.monotonic() + wait
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            s.settimeout(remaining)
+            try:
+                data, (ip, _) = s.recvfrom(1024)
+                announce = json.loads(data)
+                server = {"ip": ip, "name": announce["name"], "port": int(announce.get("port", SERVER_PORT))}
+            except socket.timeout:
+                break
+            except (ValueError, KeyError, TypeError):
+                continue
+            found[(ip, server["port"])] = server
+            if target_name is not None and server["name"] == target_name:
+                return [server]
+    except OSError as e:
+        print(f"Can't listen for server announcements: {e}")
+    finally:
+        s.close()
+    return [server for server in found.values() if target_name is None or server["name"] == target_name]
+
+
+class DiscoveryCache:
+    """Last address each server name was found at, kept in a JSON file so
+    it is the first thing tried next time."""
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.cache_file, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError, IOError):
+            return {}
+
+    def get(self, name):
+        with self.lock:
+            address = self._load().get(name)
+        return (address[0], address[1]) if address else None
+
+    def put(self, name, ip, port):
+        with self.lock:
+            data = self._load()
+            if data.get(name) == [ip, port]:
+                return
+            data[name] = [ip, port]
+            tmp_path = f"{self.cache_file}.tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.cache_file)
+            except IOError as e:
+                print(f"Warning: Failed to save {self.cache_file}: {e}")
+
+
+def find_server(target_name, cache=None, hosts=None, port=SERVER_PORT, use_announce=True,
+                workers=PROBE_WORKERS, timeout=PROBE_TIMEOUT, announce_port=ANNOUNCE_PORT):
+    """(ip, port) of the server called target_name, or None.
+
+    Tries the cached address first, then listens briefly for the
+    server's UDP announcement, then scans hosts (our /24 by default) and
+    stops at the first match. Whatever is found goes back in the cache.
+    """
+    address = cache.get(target_name) if cache is not None else None
+    if address is not None and probe(address[0], address[1], timeout) == target_name:
+        return address
+    address = None
+    if use_announce:
+        announced = listen_for_announce(target_name, announce_port=announce_port)
+        if announced:
+            address = (announced[0]["ip"], announced[0]["port"])
+    if address is None:
+        found = scan(hosts if hosts is not None else subnet_hosts(), port, target_name, workers, timeout)
+        if found:
+            address = (found[0]["ip"], port)
+    if address is not None and cache is not None:
+        cache.put(target_name, *address)
+    return address
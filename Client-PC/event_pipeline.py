@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+
+DEBOUNCE_TIME = 1.0
+MAX_BATCH = 5000
+
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+
+class EventPipeline:
+    """Debounces and coalesces filesystem events per path.
+
+    The observer thread only records that a path is dirty. A worker thread
+    waits until a path has seen no events for `debounce` seconds and its
+    size and mtime have stopped changing, then hands it over in a batch:
+    process(changed, deleted) gets the paths that exist and the ones that
+    don't. Whatever sequence of create/modify/move/delete happened in
+    between, only the final state is processed, once.
+    """
+
+    def __init__(self, process, debounce=DEBOUNCE_TIME, max_batch=MAX_BATCH):
+        self.process = process
+        self.debounce = debounce
+        self.max_batch = max_batch
+        self.lock = threading.Lock()
+        self.pending = {}   # path -> [time of last event, signature at last check]
+        self.events_received = 0
+        self.paths_processed = 0
+        self.batches = 0
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def add(self, path):
+        with self.lock:
+            self.events_received += 1
+            entry = self.pending.get(path)
+            if entry is None:
+                self.pending[path] = [time.monotonic(), False]
+            else:
+                entry[0] = time.monotonic()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "events_received": self.events_received,
+                "paths_processed": self.paths_processed,
+                "batches": self.batches,
+                "pending": len(self.pending)
+            }
+
+    def _run(self):
+        while True:
+            time.sleep(self.debounce / 2)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"File event batch failed: {e}")
+
+    def flush(self, force=False):
+        """Process every path that has settled (all pending ones if force)."""
+        now = time.monotonic()
+        with self.lock:
+            quiet = [path for path, (last_event, _) in self.pending.items()
+                     if force or now - last_event >= self.debounce]
+        ready = []
+        for path in quiet:
+            signature = _signature(path)
+            with self.lock:
+                entry = self.pending.get(path)
+                if entry is None or (not force and now - entry[0] < self.debounce):
+                    continue
+                # Still being written if it changed since the last check.
+                if force or entry[1] == signature:
+                    del self.pending[path]
+                    ready.append((path, signature))
+                else:
+                    entry[1] = signature
+        for start in range(0, len(ready), self.max_batch):
+            batch = ready[start:start + self.max_batch]
+            changed = [path for path, signature in batch if signature is not None]
+            deleted = [path for path, signature in batch if signature is None]
+            self.process(changed, deleted)
+            with self.lock:
+                self.paths_processed += len(batch)
+                self.batches += 1
+                print(f"File events: {self.events_received} received, "
+                      f"{self.paths_processed} paths processed in {self.batches} batches.")
+        return len(ready)
@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+import time
+
+from hashing import DEFAULT_WORKERS, LEGACY_ALGORITHM, hash_files
+
+# Downloads are assembled under this suffix and renamed into place once
+# verified; such files are never part of the synced state.
+TEMP_SUFFIX = ".syncit-tmp"
+
+# A file written within this window of being hashed could be modified again
+# without its mtime moving (coarse timestamp granularity), so such entries are
+# never trusted on the next scan.
+RACY_WINDOW_NS = 2_000_000_000
+
+
+class FileIndex:
+    """Persistent stat cache: path -> [size, mtime_ns, inode, hash]."""
+
+    def __init__(self, index_file, algorithm=LEGACY_ALGORITHM):
+        self.index_file = index_file
+        self.algorithm = algorithm
+        self.entries = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        if not os.path.exists(self.index_file):
+            return
+        try:
+            with open(self.index_file, "r") as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"Warning: Failed to load file index from {self.index_file}: {e}")
+            data = {}
+        with self.lock:
+            self.algorithm = data.get("algorithm", LEGACY_ALGORITHM)
+            self.entries = data.get("entries", {})
+            self.dirty = False
+
+    def use_algorithm(self, algorithm):
+        # Hashes from another algorithm are useless, start over.
+        with self.lock:
+            if algorithm != self.algorithm:
+                self.algorithm = algorithm
+                self.entries = {}
+                self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            snapshot = {"algorithm": self.algorithm, "entries": dict(self.entries)}
+            self.dirty = False
+        tmp_path = f"{self.index_file}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f, separators=(",", ":"))
+            os.replace(tmp_path, self.index_file)
+        except IOError as e:
+            print(f"Error: Failed to save file index to {self.index_file}: {e}")
+
+    def lookup(self, name, st):
+        with self.lock:
+            entry = self.entries.get(name)
+        if entry is None:
+            return None
+        size, mtime_ns, inode, file_hash = entry
+        if (size, mtime_ns, inode) != (st.st_size, st.st_mtime_ns, st.st_ino):
+            return None
+        return file_hash
+
+    def store(self, name, st, file_hash):
+        with self.lock:
+            if time.time_ns() - st.st_mtime_ns < RACY_WINDOW_NS:
+                self.entries.pop(name, None)
+            else:
+                self.entries[name] = [st.st_size, st.st_mtime_ns, st.st_ino, file_hash]
+            self.dirty = True
+
+    def discard(self, name):
+        with self.lock:
+            if self.entries.pop(name, None) is not None:
+                self.dirty = True
+
+    def prune(self, live_names):
+        with self.lock:
+            stale = [name for name in self.entries if name not in live_names]
+            for name in stale:
+                del self.entries[name]
+            if stale:
+                self.dirty = True
+
+
+def relative_name(folder, path):
+    """File name as synced: the path relative to folder, '/'-separated."""
+    return os.path.relpath(path, folder).replace(os.sep, "/")
+
+
+def local_path(folder, name):
+    """Inverse of relative_name; raises ValueError for names that would
+    land outside folder."""
+    root = os.path.abspath(folder)
+    path = os.path.abspath(os.path.join(root, *name.split("/")))
+    if not name or os.path.commonpath([root, path]) != root or path == root:
+        raise ValueError(f"invalid file name: {name!r}")
+    return path
+
+
+def served_path(folder, name):
+    """local_path for a file read on behalf of a peer: symlinks are
+    resolved and must still lead inside folder, as in
+    batch_transfer.pack_files. Raises ValueError otherwise."""
+    local_path(folder, name)
+    root = os.path.realpath(folder)
+    path = os.path.realpath(os.path.join(root, *name.split("/")))
+    if os.path.commonpath([root, path]) != root or path == root:
+        raise ValueError(f"{name!r} leads outside the folder")
+    return path
+
+
+def partial_path(path, file_hash, part=""):
+    """Where a download of path with content file_hash is assembled (and
+    any state kept next to it, under part), so an interrupted download
+    can be resumed as long as the wanted version stays the same."""
+    return f"{path}.{file_hash[:16]}{part}{TEMP_SUFFIX}"
+
+
+def _walk_files(folder, prefix=""):
+    # (relative name, DirEntry) for every regular file below folder.
+    # Symlinks are not followed.
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _walk_files(entry.path, f"{prefix}{entry.name}/")
+            elif entry.is_file(follow_symlinks=False) and not entry.name.endswith(TEMP_SUFFIX):
+                yield f"{prefix}{entry.name}", entry
+
+
+def scan_directory(folder, index, algorithm=LEGACY_ALGORITHM, workers=DEFAULT_WORKERS):
+    # Same result as hashing every file under folder, but only files whose
+    # stat tuple changed since the last scan are actually read, and those
+    # in parallel. Files are keyed by relative_name.
+    index.use_algorithm(algorithm)
+    metadata = {}
+    stale = {}
+    for name, entry in _walk_files(folder):
+        st = os.stat(entry.path)
+        file_hash = index.lookup(name, st)
+        if file_hash is None:
+            stale[entry.path] = (name, st)
+            continue
+        metadata[name] = _entry(st, file_hash, algorithm)
+
+    for file_path, file_hash in hash_files(stale, algorithm, workers).items():
+        if file_hash is None:
+            continue
+        name, st = stale[file_path]
+        index.store(name, st, file_hash)
+        metadata[name] = _entry(st, file_hash, algorithm)
+
+    index.prune(metadata)
+    index.save()
+    return metadata
+
+
+def _entry(st, file_hash, algorithm):
+    return {
+        "size": st.st_size,
+        "hash": file_hash,
+        "hash_algo": algorithm,
+        "last_modified": st.st_mtime
+    }
@@ -0,0 +1,196 @@
+import os
+import re
+import stat
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+from compression import LINK_HEADER, choose_encoding, compress_chunks, level_for, parse_link_mbps, worth_compressing
+from file_index import served_path
+from metrics import counter, histogram
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+request_seconds = histogram("syncit_file_server_request_seconds", "Time to answer a file server request, by status.")
+bytes_sent = counter("syncit_peer_bytes_sent_total", "File bytes sent to peers by the file server, by peer.")
+
+
+def weak_etag(st):
+    return f'W/"{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    # Headers and the sendfile()d body are separate writes.
+    disable_nagle_algorithm = True
+    server_version = "SyncItFileServer"
+
+    def do_GET(self):
+        self._timed(send_body=True)
+
+    def do_HEAD(self):
+        self._timed(send_body=False)
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
+    def _timed(self, send_body):
+        start = time.perf_counter()
+        self._status = None
+        try:
+            self._serve(send_body)
+        finally:
+            request_seconds.observe(time.perf_counter() - start, method=self.command, status=self._status)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _serve(self, send_body):
+        path = unquote(urlsplit(self.path).path)
+        if not path.startswith("/download/"):
+            return self._error(404)
+        name = path[len("/download/"):]
+        try:
+            f = open(served_path(self.server.folder, name), "rb")
+        except (ValueError, OSError):
+            return self._error(404)
+        with f:
+            st = os.fstat(f.fileno())
+            if not stat.S_ISREG(st.st_mode):
+                return self._error(404)
+            etag = self.server.etag_for(name, st) or weak_etag(st)
+            start, end = 0, st.st_size - 1
+            status = 200
+            range_header = self.headers.get("Range")
+            if_range = self.headers.get("If-Range")
+            if range_header and (if_range is None or if_range == etag):
+                parsed = self._parse_range(range_header, st.st_size)
+                if parsed is None:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{st.st_size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                start, end = parsed
+                status = 206
+            encoding, level = self._compression(name, f, st) if status == 200 else (None, None)
+            if encoding:
+                # Each representation has its own validator.
+                etag = f'{etag[:-1]}-{encoding}"'
+            if etag in (tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")):
+                return self._send_headers(304, etag, st)
+            if encoding:
+                self._send_headers(status, etag, st, None, encoding=encoding)
+                if send_body:
+                    self._send_chunked(compress_chunks(f, encoding, level))
+                return
+            length = max(0, end - start + 1)
+            self._send_headers(status, etag, st, length,
+                               f"bytes {start}-{end}/{st.st_size}" if status == 206 else None)
+            if send_body and length:
+                # os.sendfile() where the platform has it: the kernel copies
+                # straight from the page cache to the socket.
+                try:
+                    bytes_sent.inc(self.connection.sendfile(f, start, length), peer=self.client_address[0])
+                except OSError:
+                    # Peer went away mid-transfer.
+                    self.close_connection = True
+
+    def _compression(self, name, f, st):
+        # (encoding, level) for a whole-file response, or (None, None) to
+        # send it as is: the client doesn't accept a coding we have, the
+        # link is fast enough without, or the file won't shrink.
+        if not self.server.compress:
+            return None, None
+        encoding = choose_encoding(self.headers.get("Accept-Encoding"))
+        if encoding is None:
+            return None, None
+        level = level_for(encoding, parse_link_mbps(self.headers.get(LINK_HEADER)))
+        if level is None or not worth_compressing(name, f, st.st_size):
+            return None, None
+        return encoding, level
+
+    def _send_chunked(self, blocks):
+        sent = 0
+        try:
+            for block in blocks:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(block), block))
+                sent += len(block)
+            self.wfile.write(b"0\r\n\r\n")
+        except OSError:
+            self.close_connection = True
+        bytes_sent.inc(sent, peer=self.client_address[0])
+
+    def _send_headers(self, status, etag, st, length=0, content_range=None, encoding=None):
+        self.send_response(status)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(st.st_mtime, usegmt=True))
+        self.send_header("Accept-Ranges", "bytes")
+        if self.server.compress:
+            self.send_header("Vary", "Accept-Encoding")
+        if status != 304:
+            self.send_header("Content-Type", "application/octet-stream")
+            if encoding:
+                # Compressed as it is sent, so the length isn't known upfront.
+                self.send_header("Content-Encoding", encoding)
+                self.send_header("Transfer-Encoding", "chunked")
+            else:
+                self.send_header("Content-Length", str(length))
+        if content_range:
+            self.send_header("Content-Range", content_range)
+        self.end_headers()
+
+    def _parse_range(self, header, size):
+        # A single byte range; (start, end) inclusive, or None if it can't
+        # be satisfied.
+        match = _RANGE.match(header.strip())
+        if match is None or size == 0:
+            return None
+        first, last = match.groups()
+        if not first:
+            if not last:
+                return None
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        if start >= size or start > end:
+            return None
+        return start, end
+
+    def _error(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class FileServer(ThreadingHTTPServer):
+    """Serves files under folder at GET/HEAD /download/<name>, separately
+    from the Flask app.
+
+    One thread per connection, connections kept alive, bodies sent with
+    sendfile. Supports a single HTTP Range (with If-Range) and
+    If-None-Match against the ETag from etag_for(name, stat), which should
+    return the quoted content hash when it is known for that stat, or
+    None for a weak size/mtime tag.
+
+    With compress, whole-file responses are compressed on the fly in a
+    coding from the client's Accept-Encoding (see compression.py), at a
+    level picked from the link speed the client reports; range requests
+    and files that don't compress are sent as they are.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, folder, port, etag_for=lambda name, st: None, host="0.0.0.0", compress=True):
+        super().__init__((host, port), _Handler)
+        self.folder = folder
+        self.etag_for = etag_for
+        self.compress = compress
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
@@ -0,0 +1,85 @@
+import hashlib
+import mmap
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+BUFFER_SIZE = 1024 * 1024
+MMAP_THRESHOLD = 64 * 1024 * 1024
+DEFAULT_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+
+# Metadata written before hash_algo existed was always MD5.
+LEGACY_ALGORITHM = "md5"
+
+_HASHERS = {
+    "md5": hashlib.md5,
+    "sha1": hashlib.sha1,
+    "sha256": hashlib.sha256,
+    "blake2b": hashlib.blake2b,
+    "blake2s": hashlib.blake2s,
+}
+if blake3 is not None:
+    _HASHERS["blake3"] = blake3.blake3
+
+_local = threading.local()
+
+
+def available_algorithms():
+    return sorted(_HASHERS)
+
+
+def new_hasher(algorithm):
+    try:
+        return _HASHERS[algorithm]()
+    except KeyError:
+        raise ValueError(f"Unsupported hash algorithm: {algorithm}")
+
+
+def _buffer():
+    # One reusable read buffer per worker thread.
+    buf = getattr(_local, "buffer", None)
+    if buf is None:
+        buf = _local.buffer = bytearray(BUFFER_SIZE)
+    return buf
+
+
+def hash_file(file_path, algorithm=LEGACY_ALGORITHM):
+    hasher = new_hasher(algorithm)
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            # hashlib drops the GIL for large updates, so one update over the
+            # whole mapping lets several big files hash truly in parallel.
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                hasher.update(mapped)
+        else:
+            buf = _buffer()
+            view = memoryview(buf)
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                hasher.update(view[:n])
+    return hasher.hexdigest()
+
+
+def hash_files(file_paths, algorithm=LEGACY_ALGORITHM, workers=DEFAULT_WORKERS):
+    """Hash many files on a thread pool; unreadable files map to None."""
+
+    def hash_one(file_path):
+        try:
+            return file_path, hash_file(file_path, algorithm)
+        except OSError as e:
+            print(f"Error hashing {file_path}: {e}")
+            return file_path, None
+
+    file_paths = list(file_paths)
+    if len(file_paths) <= 1 or workers <= 1:
+        return dict(hash_one(p) for p in file_paths)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(pool.map(hash_one, file_paths))
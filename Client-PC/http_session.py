@@ -0,0 +1,59 @@
+import gzip
+import json
+import random
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+POOL_HOSTS = 16      # hosts with a pool of their own
+POOL_SIZE = 8        # kept-alive connections per host
+RETRIES = 3
+RETRY_BACKOFF = 0.2  # seconds, doubled per retry
+COMPRESS_MIN_SIZE = 1024
+
+
+def make_session(pool_hosts=POOL_HOSTS, pool_size=POOL_SIZE, retries=RETRIES, backoff=RETRY_BACKOFF):
+    """A requests.Session keeping connections alive in one pool per host.
+
+    Failed connects (including a kept-alive connection the other side has
+    since closed) are retried for every method, and 502/503/504 answers
+    for idempotent ones, with exponential backoff. Anything else is left
+    to the caller. Sessions are shared between threads.
+    """
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(502, 503, 504), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def post_json(session, url, payload, compress=False, **kwargs):
+    # Like session.post(url, json=payload), gzipping the body when asked
+    # to and it's big enough to be worth it. Only for servers that accept
+    # Content-Encoding: gzip.
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    headers = {"Content-Type": "application/json"}
+    if compress and len(body) >= COMPRESS_MIN_SIZE:
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+    return session.post(url, data=body, headers=headers, **kwargs)
+
+
+class Backoff:
+    """Delays for a retry loop: base, 2 * base, ... capped at maximum,
+    each with up to 50% jitter so clients don't retry in lockstep."""
+
+    def __init__(self, base=1, maximum=60):
+        self.base = base
+        self.maximum = maximum
+        self.attempts = 0
+
+    def next(self):
+        delay = min(self.maximum, self.base * 2 ** self.attempts)
+        self.attempts += 1
+        return delay * random.uniform(0.5, 1)
+
+    def reset(self):
+        self.attempts = 0
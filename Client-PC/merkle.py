@@ -0,0 +1,112 @@
+import hashlib
+
+# Kept identical to Server-RPi/merkle.py: both sides must hash the same way.
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def leaf_hash(info):
+    return _digest(f"{info.get('hash_algo')}\0{info.get('hash')}\0{info.get('size')}\0"
+                   f"{info.get('last_modified')!r}".encode())
+
+
+class _Dir:
+    __slots__ = ("files", "dirs", "hash")
+
+    def __init__(self):
+        self.files = {}   # name -> leaf hash
+        self.dirs = {}    # name -> _Dir
+        self.hash = None  # None until computed, reset when anything below changes
+
+
+class MerkleTree:
+    """Rolled-up hashes of a file table keyed by '/'-separated paths.
+
+    Each directory's hash covers the sorted names and hashes of its
+    children, so two tables with the same root hash are identical and
+    any differing subtree can be found by descending only into children
+    whose hashes differ. Updates only invalidate the path to the root;
+    hashes are recomputed lazily.
+    """
+
+    def __init__(self, metadata=None):
+        self.root = _Dir()
+        for name, info in (metadata or {}).items():
+            self.set(name, info)
+
+    def _walk(self, parts, create):
+        node = self.root
+        path = [node]
+        for part in parts:
+            child = node.dirs.get(part)
+            if child is None:
+                if not create:
+                    return None
+                child = node.dirs[part] = _Dir()
+            node = child
+            path.append(node)
+        return path
+
+    def set(self, name, info):
+        *parents, leaf = name.split("/")
+        path = self._walk(parents, create=True)
+        path[-1].files[leaf] = leaf_hash(info)
+        for node in path:
+            node.hash = None
+
+    def remove(self, name):
+        *parents, leaf = name.split("/")
+        path = self._walk(parents, create=False)
+        if path is None or path[-1].files.pop(leaf, None) is None:
+            return
+        for node in path:
+            node.hash = None
+        # Drop directories left empty.
+        for depth in range(len(parents), 0, -1):
+            node = path[depth]
+            if node.files or node.dirs:
+                break
+            del path[depth - 1].dirs[parents[depth - 1]]
+
+    def _node(self, directory):
+        if not directory:
+            return self.root
+        path = self._walk(directory.split("/"), create=False)
+        return path[-1] if path else None
+
+    def _hash(self, node):
+        if node.hash is None:
+            lines = [f"f\0{name}\0{h}" for name, h in node.files.items()]
+            lines += [f"d\0{name}\0{self._hash(child)}" for name, child in node.dirs.items()]
+            lines.sort()
+            node.hash = _digest("\n".join(lines).encode())
+        return node.hash
+
+    def root_hash(self):
+        return self._hash(self.root)
+
+    def children(self, directory=""):
+        """{name: [hash, is_dir]} for one directory ('' is the root), or
+        None if there is no such directory."""
+        node = self._node(directory)
+        if node is None:
+            return None
+        children = {name: [h, False] for name, h in node.files.items()}
+        for name, child in node.dirs.items():
+            children[name] = [self._hash(child), True]
+        return children
+
+    def names(self, directory=""):
+        """Every file name in or below directory."""
+        node = self._node(directory)
+        if node is None:
+            return []
+        names = []
+        stack = [(node, f"{directory}/" if directory else "")]
+        while stack:
+            node, prefix = stack.pop()
+            names.extend(prefix + name for name in node.files)
+            stack.extend((child, f"{prefix}{name}/") for name, child in node.dirs.items())
+        return names
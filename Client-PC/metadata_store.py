@@ -0,0 +1,220 @@
+import json
+import os
+import threading
+import time
+
+from merkle import MerkleTree
+from metrics import histogram
+
+FLUSH_INTERVAL = 5
+
+metadata_seconds = histogram("syncit_metadata_seconds", "Time to load or save the metadata file, by operation.")
+
+
+class FileEntry:
+    __slots__ = ("size", "hash", "hash_algo", "last_modified")
+
+    def __init__(self, size, file_hash, hash_algo, last_modified):
+        self.size = size
+        self.hash = file_hash
+        self.hash_algo = hash_algo
+        self.last_modified = last_modified
+
+    @classmethod
+    def from_dict(cls, info):
+        return cls(info.get("size"), info.get("hash"), info.get("hash_algo"), info.get("last_modified"))
+
+    def to_dict(self):
+        info = {"size": self.size, "hash": self.hash, "last_modified": self.last_modified}
+        if self.hash_algo is not None:
+            info["hash_algo"] = self.hash_algo
+        return info
+
+    def same_as(self, other):
+        return (self.size == other.size and self.hash == other.hash
+                and self.hash_algo == other.hash_algo and self.last_modified == other.last_modified)
+
+
+class ClientMetadata:
+    """This client's file metadata, held in memory.
+
+    Every method is thread-safe. Changes mark the store dirty and are
+    written to metadata_file by a background thread every flush_interval
+    seconds, atomically (temp file + rename), so a crash leaves either the
+    old or the new file. Names changed since the server last acknowledged
+    them are tracked separately for delta uploads, and a MerkleTree over
+    the table lets it be compared with the server's copy subtree by
+    subtree. Names are also indexed by content hash, to find local copies
+    of content we are asked to download.
+    """
+
+    def __init__(self, metadata_file, flush_interval=FLUSH_INTERVAL):
+        self.metadata_file = metadata_file
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.entries = {}      # file_name -> FileEntry
+        self.dirty = False     # not yet on disk
+        self.unsent = set()    # changed since the last take_changes()
+        self.tree = MerkleTree()
+        self.by_hash = {}      # hash -> set of file names with that content
+
+    def load(self):
+        try:
+            with metadata_seconds.time(op="load"), open(self.metadata_file, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"Warning: Failed to load metadata from {self.metadata_file}: {e}")
+            data = {}
+        with self.lock:
+            self.entries = {name: FileEntry.from_dict(info) for name, info in data.items()}
+            self.tree = MerkleTree(data)
+            self.by_hash = {}
+            for name, entry in self.entries.items():
+                self.by_hash.setdefault(entry.hash, set()).add(name)
+            # Nothing has been acknowledged yet; the first upload is a full one.
+            self.unsent = set()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    # ---- Reads ----
+
+    def get(self, file_name):
+        with self.lock:
+            entry = self.entries.get(file_name)
+            return entry.to_dict() if entry is not None else None
+
+    def __contains__(self, file_name):
+        with self.lock:
+            return file_name in self.entries
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def root_hash(self):
+        with self.lock:
+            return self.tree.root_hash()
+
+    def tree_children(self, directory=""):
+        with self.lock:
+            return self.tree.children(directory)
+
+    def names_under(self, directory):
+        with self.lock:
+            return self.tree.names(directory)
+
+    def names_with_hash(self, file_hash):
+        with self.lock:
+            return list(self.by_hash.get(file_hash, ()))
+
+    def snapshot(self):
+        # Entries are replaced, never mutated, so a shallow copy is enough
+        # to serialise outside the lock.
+        with self.lock:
+            entries = dict(self.entries)
+        return {name: entry.to_dict() for name, entry in entries.items()}
+
+    # ---- Writes ----
+
+    def put(self, file_name, size, file_hash, hash_algo, last_modified):
+        entry = FileEntry(size, file_hash, hash_algo, last_modified)
+        with self.lock:
+            return self._put(file_name, entry)
+
+    def _put(self, file_name, entry):
+        old = self.entries.get(file_name)
+        if old is not None and old.same_as(entry):
+            return False
+        if old is not None:
+            self._unindex(file_name, old)
+        self.by_hash.setdefault(entry.hash, set()).add(file_name)
+        self.entries[file_name] = entry
+        self.tree.set(file_name, entry.to_dict())
+        self.dirty = True
+        self.unsent.add(file_name)
+        return True
+
+    def replace_all(self, metadata):
+        # Make the store match a fresh scan of the folder.
+        with self.lock:
+            for file_name in [name for name in self.entries if name not in metadata]:
+                self._unindex(file_name, self.entries.pop(file_name))
+                self.tree.remove(file_name)
+                self.unsent.add(file_name)
+                self.dirty = True
+            for file_name, info in metadata.items():
+                self._put(file_name, FileEntry.from_dict(info))
+
+    def remove(self, file_name):
+        with self.lock:
+            entry = self.entries.pop(file_name, None)
+            if entry is None:
+                return False
+            self._unindex(file_name, entry)
+            self.tree.remove(file_name)
+            self.dirty = True
+            self.unsent.add(file_name)
+            return True
+
+    def _unindex(self, file_name, entry):
+        names = self.by_hash.get(entry.hash)
+        if names is not None:
+            names.discard(file_name)
+            if not names:
+                del self.by_hash[entry.hash]
+
+    # ---- Server sync ----
+
+    def take_changes(self):
+        """Return ({name: info} changed, [name] removed) since the last call."""
+        with self.lock:
+            names, self.unsent = self.unsent, set()
+            changed = {name: self.entries[name].to_dict() for name in names if name in self.entries}
+            removed = [name for name in names if name not in self.entries]
+            return changed, removed
+
+    def has_changes(self):
+        with self.lock:
+            return bool(self.unsent)
+
+    def restore_changes(self, names):
+        # An upload failed, send these again next time.
+        with self.lock:
+            self.unsent.update(names)
+
+    def clear_changes(self):
+        with self.lock:
+            self.unsent.clear()
+
+    # ---- Persistence ----
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                if not self.dirty:
+                    return False
+                self.dirty = False
+            data = self.snapshot()
+            tmp_path = f"{self.metadata_file}.tmp"
+            try:
+                # dumps() runs entirely in the C encoder, dump() doesn't.
+                with metadata_seconds.time(op="save"):
+                    body = json.dumps(data, separators=(",", ":"))
+                    with open(tmp_path, "w") as f:
+                        f.write(body)
+                    os.replace(tmp_path, self.metadata_file)
+            except IOError as e:
+                print(f"Error: Failed to save metadata to {self.metadata_file}: {e}")
+                with self.lock:
+                    self.dirty = True
+                return False
+            return True
@@ -0,0 +1,279 @@
+import bisect
+import collections
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Kept identical to Server-RPi/metrics.py: both sides expose the same /metrics.
+
+# Seconds; roughly x2.5 apart from 1 ms to 1 min.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PROFILE_INTERVAL = 0.005  # seconds between profiler samples
+PROFILE_MAX_DEPTH = 64
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _number(value):
+    # Exact for integers however large; Prometheus parses both forms.
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _process_lines():
+    # CPU time and resident memory of this process, as Prometheus'
+    # client libraries name them. Memory is only known on Linux.
+    lines = ["# HELP process_cpu_seconds_total User and system CPU time spent in seconds.",
+             "# TYPE process_cpu_seconds_total counter",
+             f"process_cpu_seconds_total {_number(time.process_time())}"]
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return lines
+    return lines + ["# HELP process_resident_memory_bytes Resident memory size in bytes.",
+                    "# TYPE process_resident_memory_bytes gauge",
+                    f"process_resident_memory_bytes {rss}"]
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.lock = threading.Lock()
+        self.series = {}  # sorted (label, value) pairs -> value
+
+    def _key(self, labels):
+        return tuple(sorted(labels.items()))
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self.lock:
+            return self.series.get(self._key(labels), 0)
+
+    def render(self):
+        with self.lock:
+            series = sorted(self.series.items())
+        return self.header() + [f"{self.name}{_label_text(key)} {_number(value)}" for key, value in series]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                # Per-bucket counts (not cumulative), sum, count.
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        with self.lock:
+            series = sorted((key, [list(counts), total, count]) for key, (counts, total, count) in self.series.items())
+        lines = self.header()
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{self.name}_bucket{_label_text(key + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_label_text(key)} {count}")
+        return lines
+
+
+class Registry:
+    """Counters and histograms by name, rendered in the Prometheus text
+    exposition format. Asking for a metric that exists returns it, so
+    modules can declare what they record at import time."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _get(self, cls, name, help_text, *args):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help_text, *args)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"{name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, help_text):
+        return self._get(Counter, name, help_text)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        lines = [line for metric in metrics for line in metric.render()]
+        return "\n".join(lines + _process_lines()) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+
+
+class Profiler:
+    """Sampling profiler that can be switched on and off while running.
+
+    A background thread records the stack of every other thread each
+    interval; report() returns the counts as folded stacks ("a;b;c 42"
+    per line, the input format of flamegraph.pl and speedscope), most
+    frequent first.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.interval = PROFILE_INTERVAL
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, interval=None, reset=True):
+        with self.lock:
+            if reset:
+                self.stacks.clear()
+                self.samples = 0
+            if interval:
+                self.interval = interval
+            if self.running:
+                return
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        thread = self.thread
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            folded = []
+            for thread_id, frame in frames.items():
+                if thread_id == own:
+                    continue
+                names = []
+                while frame is not None and len(names) < PROFILE_MAX_DEPTH:
+                    code = frame.f_code
+                    names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                folded.append(";".join(reversed(names)))
+            with self.lock:
+                self.stacks.update(folded)
+                self.samples += 1
+
+    def report(self, limit=None):
+        with self.lock:
+            stacks = self.stacks.most_common(limit)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def status(self):
+        with self.lock:
+            return {"running": self.running, "interval": self.interval, "samples": self.samples,
+                    "stacks": len(self.stacks)}
+
+
+PROFILER = Profiler()
+
+
+def instrument_app(app, registry=REGISTRY, profiler=PROFILER):
+    """Time every request to a Flask app per endpoint and add:
+
+    GET /metrics    everything in registry, Prometheus text format
+    GET /profile    profiler status, or ?format=folded for the stacks
+    POST /profile   {"enabled": bool, "interval": seconds} to switch it
+    """
+    from flask import Response, g, jsonify, request
+
+    requests_total = registry.counter("syncit_http_requests_total", "HTTP requests handled, by endpoint and status.")
+    latency = registry.histogram("syncit_http_request_seconds", "Time to handle an HTTP request, by endpoint.")
+    sent = registry.counter("syncit_http_response_bytes_total", "Response body bytes with a known length, by endpoint.")
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            # The route pattern, not the path, keeps the label set small.
+            endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            latency.observe(time.perf_counter() - start, endpoint=endpoint, method=request.method)
+            requests_total.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+            if response.content_length is not None:
+                sent.inc(response.content_length, endpoint=endpoint)
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def _metrics():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+    @app.route("/profile", methods=["GET", "POST"])
+    def _profile():
+        if request.method == "POST":
+            data = request.get_json(silent=True) or {}
+            if data.get("enabled", True):
+                try:
+                    profiler.start(float(data.get("interval") or 0) or None, reset=data.get("reset", True))
+                except (TypeError, ValueError):
+                    return jsonify({"message": "interval must be a number of seconds"}), 400
+            else:
+                profiler.stop()
+            return jsonify(profiler.status())
+        if request.args.get("format") == "folded":
+            limit = request.args.get("limit", type=int)
+            return Response(profiler.report(limit), mimetype="text/plain")
+        return jsonify(profiler.status())
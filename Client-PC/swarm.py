@@ -0,0 +1,106 @@
+import os
+import threading
+
+import requests
+
+# Files at least this big are split across every peer that has them.
+SWARM_MIN_SIZE = 32 * 1024 * 1024
+SEGMENT_SIZE = 4 * 1024 * 1024
+CONNECTIONS_PER_PEER = 2
+
+
+class SwarmError(Exception):
+    pass
+
+
+def _load_done(state_path):
+    # Segments recorded as written by an earlier, interrupted attempt.
+    try:
+        with open(state_path, "r") as f:
+            return {tuple(map(int, line.split())) for line in f if len(line.split()) == 2}
+    except (OSError, ValueError):
+        return set()
+
+
+def swarm_download(urls, dest_path, size, segment_size=SEGMENT_SIZE,
+                   connections_per_peer=CONNECTIONS_PER_PEER, timeout=10, http=requests, state_path=None):
+    """Fetch one file from several peers in parallel with HTTP Range requests.
+
+    Segments are handed out from a shared queue, so faster peers simply
+    take more of them, and a segment from a failing peer goes back to the
+    queue for the others. Returns {url: bytes fetched}.
+
+    With state_path, every segment written is recorded there and both
+    files are kept if the download fails, so the next call with the same
+    paths only fetches the segments still missing.
+    """
+    segments = [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+    cond = threading.Condition()
+    active = [0]  # segments currently being fetched
+    fetched = {url: 0 for url in urls}
+    failed_urls = set()
+    errors = []
+
+    done = set()
+    if state_path and os.path.exists(dest_path) and os.path.getsize(dest_path) == size:
+        done = _load_done(state_path)
+    if done:
+        segments = [segment for segment in segments if segment not in done]
+    else:
+        with open(dest_path, "wb") as f:
+            f.truncate(size)
+        if state_path:
+            open(state_path, "w").close()
+    state = open(state_path, "a") if state_path else None
+
+    def worker(url):
+        with open(dest_path, "r+b") as out:
+            while True:
+                with cond:
+                    # A segment in flight elsewhere may still come back.
+                    while not segments and active[0] and url not in failed_urls:
+                        cond.wait()
+                    if not segments or url in failed_urls:
+                        return
+                    start, end = segments.pop(0)
+                    active[0] += 1
+                ok = False
+                try:
+                    response = http.get(url, headers={"Range": f"bytes={start}-{end}"}, timeout=timeout)
+                    if response.status_code != 206 or len(response.content) != end - start + 1:
+                        raise SwarmError(f"bad range response ({response.status_code}) from {url}")
+                    out.seek(start)
+                    out.write(response.content)
+                    out.flush()
+                    ok = True
+                except (requests.exceptions.RequestException, SwarmError) as e:
+                    errors.append(str(e))
+                finally:
+                    with cond:
+                        active[0] -= 1
+                        if ok:
+                            fetched[url] += end - start + 1
+                            if state:
+                                state.write(f"{start} {end}\n")
+                                state.flush()
+                        else:
+                            segments.insert(0, (start, end))
+                            failed_urls.add(url)
+                        cond.notify_all()
+
+    threads = [
+        threading.Thread(target=worker, args=(url,), daemon=True)
+        for url in urls for _ in range(connections_per_peer)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if state:
+        state.close()
+
+    if segments:
+        if not state_path:
+            os.remove(dest_path)
+        raise SwarmError(f"every peer failed: {'; '.join(errors)}")
+    return fetched
@@ -0,0 +1,109 @@
+import threading
+import time
+from contextlib import contextmanager
+
+PRIORITIES = {
+    "smallest": lambda job: (job["size"], job["file_name"]),
+    "newest": lambda job: (-job["last_modified"], job["file_name"]),
+    "fifo": lambda job: 0,
+}
+
+# Watchdog reports our own writes a moment after they finish; paths stay
+# "busy" for this long so those echoes are ignored.
+SETTLE_TIME = 2.0
+
+
+class TransferScheduler:
+    """Runs a batch of downloads on a bounded pool of workers.
+
+    At most max_workers transfers run at once, at most per_peer_limit of
+    them against the same peer, and pending jobs start in priority order.
+    Every file being transferred is tracked individually so the watchdog
+    can tell our own writes apart from user changes.
+    """
+
+    def __init__(self, max_workers=4, per_peer_limit=2, priority="smallest"):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown download priority: {priority}")
+        self.max_workers = max_workers
+        self.per_peer_limit = per_peer_limit
+        self.priority = priority
+        self.lock = threading.Lock()
+        self.in_flight = {}   # file_name -> number of active claims
+        self.settling = {}    # file_name -> time its last claim ended
+
+    # ---- In-flight tracking ----
+
+    @contextmanager
+    def claim(self, file_name):
+        with self.lock:
+            self.in_flight[file_name] = self.in_flight.get(file_name, 0) + 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.in_flight[file_name] -= 1
+                if not self.in_flight[file_name]:
+                    del self.in_flight[file_name]
+                now = time.monotonic()
+                self.settling[file_name] = now
+                if len(self.settling) > 1024:
+                    self.settling = {n: t for n, t in self.settling.items() if now - t < SETTLE_TIME}
+
+    def is_busy(self, file_name):
+        with self.lock:
+            if file_name in self.in_flight:
+                return True
+            ended = self.settling.get(file_name)
+            if ended is None:
+                return False
+            if time.monotonic() - ended < SETTLE_TIME:
+                return True
+            del self.settling[file_name]
+            return False
+
+    # ---- Batches ----
+
+    def run_batch(self, jobs, download):
+        """Run download(job) for every job, return {file_name: result}.
+
+        Each job is a dict with file_name, peer (any hashable), size and
+        last_modified."""
+        queue = sorted(jobs, key=PRIORITIES[self.priority])
+        results = {}
+        per_peer = {}
+        cond = threading.Condition()
+
+        def next_job():
+            for i, job in enumerate(queue):
+                if per_peer.get(job["peer"], 0) < self.per_peer_limit:
+                    return queue.pop(i)
+            return None
+
+        def worker():
+            while True:
+                with cond:
+                    job = next_job()
+                    while job is None and queue:
+                        cond.wait()
+                        job = next_job()
+                    if job is None:
+                        return
+                    per_peer[job["peer"]] = per_peer.get(job["peer"], 0) + 1
+                try:
+                    with self.claim(job["file_name"]):
+                        result = download(job)
+                except Exception as e:
+                    print(f"Transfer of {job['file_name']} failed: {e}")
+                    result = False
+                with cond:
+                    results[job["file_name"]] = result
+                    per_peer[job["peer"]] -= 1
+                    cond.notify_all()
+
+        workers = [threading.Thread(target=worker, daemon=True) for _ in range(min(self.max_workers, len(queue)))]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        return results
@@ -0,0 +1,37 @@
+import json
+import socket
+import threading
+import time
+
+ANNOUNCE_PORT = 5001
+ANNOUNCE_INTERVAL = 1.0
+
+
+class Announcer:
+    """Broadcasts this server's name and HTTP port over UDP every
+    interval seconds, so clients can find it without scanning the
+    subnet (see Client-PC/discovery.py)."""
+
+    def __init__(self, name, http_port, address="<broadcast>", announce_port=ANNOUNCE_PORT,
+                 interval=ANNOUNCE_INTERVAL):
+        self.payload = json.dumps({"name": name, "port": http_port}).encode()
+        self.target = (address, announce_port)
+        self.interval = interval
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        warned = False
+        while True:
+            try:
+                s.sendto(self.payload, self.target)
+                warned = False
+            except OSError as e:
+                # No broadcast route (yet); clients fall back to scanning.
+                if not warned:
+                    print(f"Server announcement failed: {e}")
+                    warned = True
+            time.sleep(self.interval)
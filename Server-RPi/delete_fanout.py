@@ -0,0 +1,91 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+FANOUT_WORKERS = 8
+PUSH_TIMEOUT = 5
+RETRY_BASE = 5
+RETRY_MAX = 300
+# Tombstones are kept this long after every client has applied them, so a
+# client that was away can still be told its copy was deleted.
+TOMBSTONE_TTL = 30 * 24 * 3600
+
+
+class DeleteFanout:
+    """Pushes queued deletes to clients from a background thread.
+
+    The queue itself lives in the store (pending_deletes), so nothing is
+    lost on restart. Deliveries run concurrently; a failed one is retried
+    with exponential backoff; one the client refuses with 409 because its
+    copy was edited after the deleted version is dropped. Clients that are
+    offline aren't pushed to at all, they pick their deletes up from /sync
+    when they're back.
+    """
+
+    def __init__(self, store, is_alive, workers=FANOUT_WORKERS):
+        self.store = store
+        self.is_alive = is_alive
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        # Connections to clients are kept alive between deliveries;
+        # failed connects get a quick retry before the backoff below.
+        self.http = requests.Session()
+        self.http.mount("http://", HTTPAdapter(pool_connections=64, pool_maxsize=workers,
+                                               max_retries=Retry(connect=2, read=0, backoff_factor=0.2)))
+        self.wakeup = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def kick(self):
+        self.wakeup.set()
+
+    def _run(self):
+        last_prune = 0
+        while True:
+            self.wakeup.wait(RETRY_BASE)
+            self.wakeup.clear()
+            try:
+                self.deliver_due()
+                if time.time() - last_prune > 3600:
+                    self.store.prune_tombstones(time.time() - TOMBSTONE_TTL)
+                    last_prune = time.time()
+            except Exception as e:
+                print(f"Delete fan-out round failed: {e}")
+
+    def deliver_due(self):
+        clients = self.store.load_clients()
+        due = [
+            item for item in self.store.due_deletes(time.time())
+            if item[0] in clients and self.is_alive(item[0])
+        ]
+        list(self.pool.map(lambda item: self._deliver(clients[item[0]], *item), due))
+
+    def _deliver(self, client_info, client_id, file_name, version, attempts):
+        url = f"http://{client_info['ip']}:{client_info['port']}/delete_file"
+        payload = {"file_name": file_name, "version": version}
+        deleted = self.store.deleted_versions([file_name]).get(file_name)
+        if deleted is not None:
+            payload["last_modified"], payload["hash"] = deleted
+        move = self.store.moves([file_name]).get(file_name)
+        if move is not None:
+            payload["moved_to"] = move[0]
+        try:
+            response = self.http.post(url, json=payload, timeout=PUSH_TIMEOUT)
+            if response.status_code == 409:
+                # The client's copy was edited after the deleted version; it
+                # keeps it and its next upload brings the file back.
+                self.store.ack_delete(client_id, file_name, version)
+                print(f"{client_id} kept a newer copy of {file_name} instead of deleting it")
+                return
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            delay = min(RETRY_MAX, RETRY_BASE * 2 ** attempts)
+            print(f"Failed to send delete of {file_name} to {client_id} ({e}), retrying in {delay}s")
+            self.store.defer_delete(client_id, file_name, version, attempts + 1, time.time() + delay)
+            return
+        self.store.ack_delete(client_id, file_name, version)
+        print(f"Sent delete request for {file_name} to {client_id} at {client_info['ip']}:{client_info['port']}")
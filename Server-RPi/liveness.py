@@ -0,0 +1,88 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PROBE_INTERVAL = 5
+LIVENESS_TTL = 30
+PROBE_WORKERS = 16
+
+
+class LivenessTracker:
+    """Cached alive/dead state of every client, kept fresh in the background.
+
+    A request from a client counts as a heartbeat. Clients that haven't
+    been heard from within probe_interval are probed concurrently by a
+    background thread, so readers never wait on the network. A cached
+    state older than ttl (the prober fell behind) counts as dead.
+    on_change(alive) is called with the new set whenever it changes.
+    """
+
+    def __init__(self, load_clients, probe, on_change, probe_interval=PROBE_INTERVAL,
+                 ttl=LIVENESS_TTL, workers=PROBE_WORKERS):
+        self.load_clients = load_clients
+        self.probe = probe
+        self.on_change = on_change
+        self.probe_interval = probe_interval
+        self.ttl = ttl
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.state = {}   # client_id -> (alive, time last confirmed)
+        self.alive = frozenset()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def heartbeat(self, client_id):
+        with self.lock:
+            self.state[client_id] = (True, time.monotonic())
+            if client_id not in self.alive:
+                self._publish()
+
+    def is_alive(self, client_id):
+        with self.lock:
+            return client_id in self.alive
+
+    def alive_clients(self):
+        with self.lock:
+            return set(self.alive)
+
+    def _run(self):
+        while True:
+            try:
+                self.probe_stale()
+            except Exception as e:
+                print(f"Liveness probe round failed: {e}")
+            time.sleep(self.probe_interval)
+
+    def probe_stale(self):
+        clients = self.load_clients()
+        now = time.monotonic()
+        with self.lock:
+            stale = [
+                client_id for client_id in clients
+                if client_id not in self.state or now - self.state[client_id][1] >= self.probe_interval
+            ]
+        results = self.pool.map(
+            lambda client_id: self.probe(clients[client_id]["ip"], clients[client_id]["port"]), stale)
+        probed = dict(zip(stale, results))
+        with self.lock:
+            now = time.monotonic()
+            for client_id, alive in probed.items():
+                current = self.state.get(client_id)
+                # A heartbeat that arrived during the probe wins.
+                if alive or current is None or now - current[1] >= self.probe_interval:
+                    self.state[client_id] = (alive, now)
+            for client_id in list(self.state):
+                if client_id not in clients:
+                    del self.state[client_id]
+            self._publish()
+
+    def _publish(self):
+        now = time.monotonic()
+        alive = frozenset(
+            client_id for client_id, (is_alive, seen) in self.state.items()
+            if is_alive and now - seen < self.ttl
+        )
+        if alive != self.alive:
+            self.alive = alive
+            self.on_change(alive)
@@ -1,72 +1,162 @@
+import gzip
+import io
 import json
-import os
-import requests
 import socket
 import time
 import threading
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from announcer import Announcer
+from delete_fanout import DeleteFanout
+from liveness import LivenessTracker
+from metrics import counter, histogram, instrument_app
+from store import MetadataStore
+from sync_planner import SyncPlanner
+
+try:
+    # Keeps connections alive; Werkzeug's development server closes each one.
+    from waitress import serve
+except ImportError:
+    serve = None
 
 app = Flask(__name__)
+# Request timings, GET /metrics (Prometheus) and the /profile switch.
+instrument_app(app)
 
 SERVER_NAME = "File Sync Server"
+DB_FILE = "./server_state.db"
 METADATA_FILE = "./server_metadata.json"
 CLIENTS_FILE = "./clients.json"
+# Every client hashes with this algorithm so hashes are comparable fleet-wide.
+HASH_ALGORITHM = "blake2b"
+LEGACY_HASH_ALGORITHM = "md5"
+# Longest a /wait request is held open; clients re-issue it right away.
+LONG_POLL_TIMEOUT = 25
+SERVER_PORT = 5000
+# UDP broadcast of SERVER_NAME so clients find us without scanning the subnet.
+ANNOUNCE_PRESENCE = True
+# Worker threads when served by waitress. Every client's /wait long-poll
+# holds one, so keep this well above the number of clients.
+WSGI_THREADS = 128
+
+store = None
+planner = None
+liveness = None
+delete_fanout = None
+# Keeps the store and the planner applying updates in the same order.
+state_lock = threading.Lock()
+
+metadata_seconds = histogram("syncit_metadata_seconds", "Time to load or store client metadata, by operation.")
+metadata_entries = counter("syncit_metadata_entries_total", "File entries stored from client uploads, by kind of upload.")
+plan_seconds = histogram("syncit_sync_plan_seconds", "Time to work out sync instructions, by call.")
+liveness_seconds = histogram("syncit_liveness_check_seconds", "Time to probe whether a client is up.")
+liveness_checks = counter("syncit_liveness_checks_total", "Client liveness probes, by result.")
 
 # ------------------ File Management ------------------
 
 def initialize_files():
-    if not os.path.exists(METADATA_FILE):
-        with open(METADATA_FILE, "w") as f:
-            json.dump({}, f)
-    if not os.path.exists(CLIENTS_FILE):
-        with open(CLIENTS_FILE, "w") as f:
-            json.dump({}, f)
+    global store, planner, liveness, delete_fanout
+    store = MetadataStore(DB_FILE)
+    # Servers that ran before the SQLite store kept their state in JSON.
+    store.migrate_from_json(METADATA_FILE, CLIENTS_FILE)
+    planner = SyncPlanner(uses_server_hash)
+    planner.load(load_metadata())
+    # Clients still hashing with another algorithm are left out by the
+    # planner until they rescan, whatever their liveness.
+    liveness = LivenessTracker(load_clients, is_client_alive, planner.set_alive)
+    liveness.start()
+    # Deletes queued before a restart are retried from the store.
+    delete_fanout = DeleteFanout(store, liveness.is_alive)
+    delete_fanout.start()
 
 def load_metadata():
-    if not os.path.exists(METADATA_FILE):
-        return {}
-    with open(METADATA_FILE, "r") as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return {}
-
-def save_metadata(metadata):
-    with open(METADATA_FILE, "w") as f:
-        json.dump(metadata, f, indent=4)
+    with metadata_seconds.time(op="load"):
+        return store.load_metadata()
 
 def load_clients():
-    if not os.path.exists(CLIENTS_FILE):
-        return {}
-    with open(CLIENTS_FILE, "r") as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return {}
-
-def save_clients(new_clients):
-    try:
-        existing_clients = load_clients()
-        existing_clients.update(new_clients)
-    except json.JSONDecodeError:
-        existing_clients = new_clients
-    with open(CLIENTS_FILE, "w") as f:
-        json.dump(existing_clients, f, indent=4)
+    return store.load_clients()
+
+def drop_deleted(client_id, files):
+    # Entries for a tombstoned file that are no newer than the deleted
+    # version come from a client that hasn't applied the delete yet: they
+    # are left out and the delete is queued for it again. A newer entry
+    # means the file was created again.
+    kept = {}
+    requeued = False
+    for name, info in files.items():
+        tombstone = store.tombstone(name)
+        if tombstone is not None:
+            if (info.get("last_modified") or 0) <= (tombstone[1] or 0):
+                requeued |= store.queue_delete(client_id, name)
+                continue
+            store.clear_tombstone(name)
+        kept[name] = info
+    if requeued:
+        delete_fanout.kick()
+    return kept
+
+def uses_server_hash(info):
+    return info.get("hash_algo", LEGACY_HASH_ALGORITHM) == HASH_ALGORITHM
 
 # ------------------ Network Utility ------------------
 
+def compact_json_response(payload):
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    response = Response(body, mimetype="application/json")
+    if len(body) > 1024 and "gzip" in request.headers.get("Accept-Encoding", ""):
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers["Content-Encoding"] = "gzip"
+        response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+class GzipRequestMiddleware:
+    # Inflates request bodies sent with Content-Encoding: gzip (clients
+    # compress large metadata uploads) before Flask parses them.
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        if environ.get("HTTP_CONTENT_ENCODING", "").lower() == "gzip":
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+            try:
+                body = gzip.decompress(environ["wsgi.input"].read(length))
+            except (OSError, EOFError):
+                start_response("400 Bad Request", [("Content-Type", "text/plain")])
+                return [b"Malformed gzip body"]
+            environ["wsgi.input"] = io.BytesIO(body)
+            environ["CONTENT_LENGTH"] = str(len(body))
+            del environ["HTTP_CONTENT_ENCODING"]
+        return self.wsgi_app(environ, start_response)
+
+app.wsgi_app = GzipRequestMiddleware(app.wsgi_app)
+
 def is_client_alive(ip, port, timeout=2):
-    try:
-        with socket.create_connection((ip, port), timeout=timeout):
-            return True
-    except:
-        return False
+    with liveness_seconds.time():
+        try:
+            with socket.create_connection((ip, port), timeout=timeout):
+                alive = True
+        except:
+            alive = False
+    liveness_checks.inc(result="up" if alive else "down")
+    return alive
+
+def heartbeat(client_id):
+    # Any request from a registered client proves it is up, and tells us
+    # where it is now: an idle client only ever polls, so its address is
+    # kept current from here rather than waiting for it to re-register.
+    if not client_id:
+        return
+    client = store.get_client(client_id)
+    if client is None:
+        return
+    liveness.heartbeat(client_id)
+    if request.remote_addr and client.get("ip") != request.remote_addr:
+        store.update_client_ip(client_id, request.remote_addr)
 
 # ------------------ Client Endpoints ------------------
 
 @app.route("/server_name", methods=["GET"])
 def get_server_name():
-    return jsonify({"name": SERVER_NAME})
+    return jsonify({"name": SERVER_NAME, "hash_algorithm": HASH_ALGORITHM})
 
 @app.route("/register", methods=["POST"])
 def register_client():
@@ -74,149 +164,176 @@ def register_client():
     client_id = data.get("client_id")
     client_port = data.get("port")
     sync_folder = data.get("sync_folder")
+    # Separate sendfile server for /download, if the client runs one.
+    file_port = data.get("file_port")
 
-    clients = load_clients()
-    clients[client_id] = {
-        "ip": request.remote_addr,
-        "port": client_port,
-        "sync_folder": sync_folder
-    }
-    save_clients(clients)
+    store.register_client(client_id, request.remote_addr, client_port, sync_folder, file_port)
+    heartbeat(client_id)
 
-    return jsonify({"message": "Client registered", "client_id": client_id})
+    return jsonify({
+        "message": "Client registered",
+        "client_id": client_id,
+        "hash_algorithm": HASH_ALGORITHM,
+        "request_encodings": ["gzip"]
+    })
 
 @app.route("/update_metadata", methods=["POST"])
 def update_metadata():
     data = request.json
     client_id = data.get("client_id")
-    file_metadata = data.get("metadata")
 
-    metadata = load_metadata()
-    metadata[client_id] = file_metadata
-    save_metadata(metadata)
+    with state_lock:
+        if "metadata" in data:
+            file_metadata = drop_deleted(client_id, data["metadata"])
+            with metadata_seconds.time(op="replace"):
+                generation = store.replace_client_files(client_id, file_metadata)
+            planner.update_client(client_id, file_metadata)
+            metadata_entries.inc(len(file_metadata), upload="full")
+        else:
+            # Delta upload: only valid on top of the generation we hold.
+            current = store.generation(client_id)
+            if data.get("base_generation") != current:
+                return jsonify({"message": "Metadata generation mismatch", "resync": True, "generation": current}), 409
+            changed = drop_deleted(client_id, data.get("changed", {}))
+            removed = data.get("removed", [])
+            with metadata_seconds.time(op="delta"):
+                generation = store.apply_client_delta(client_id, changed, removed)
+            planner.apply_delta(client_id, changed, removed)
+            metadata_entries.inc(len(changed) + len(removed), upload="delta")
 
     # Update client's IP if changed
-    clients = load_clients()
-    if client_id in clients:
-        old_ip = clients[client_id]["ip"]
+    client_info = store.get_client(client_id)
+    if client_info is not None:
         new_ip = request.remote_addr
-        if old_ip != new_ip:
-            clients[client_id]["ip"] = new_ip
-            save_clients(clients)
+        if client_info["ip"] != new_ip:
+            store.update_client_ip(client_id, new_ip)
             print(f"Updated IP for {client_id}: {new_ip}")
-
-    return jsonify({"message": "Metadata updated"})
+    heartbeat(client_id)
+
+    return jsonify({"message": "Metadata updated", "generation": generation})
+
+@app.route("/tree/<client_id>", methods=["GET"])
+def client_tree(client_id):
+    # One directory of the Merkle tree over this client's table, so the
+    # client can find what differs without sending everything.
+    directory = request.args.get("dir", "")
+    generation, root_hash, children = store.tree(client_id, directory)
+    heartbeat(client_id)
+    return compact_json_response({
+        "generation": generation,
+        "root": root_hash,
+        "children": children or {}
+    })
 
 @app.route("/delete_file", methods=["POST"])
 def handle_file_deletion():
     data = request.json
     file_name = data.get("file_name")
+    # Set when the client saw the file being renamed rather than deleted.
+    moved_to = data.get("moved_to")
+    heartbeat(data.get("client_id"))
 
-    metadata = load_metadata()
-    clients = load_clients()
-
-    file_found = False
+    with state_lock:
+        version = store.remove_file(file_name, deleted_by=data.get("client_id"), moved_to=moved_to)
+        if version is not None:
+            planner.remove_file(file_name)
 
-    for client, files in metadata.items():
-        if file_name in files:
-            file_found = True
-            del metadata[client][file_name]
-
-    if file_found:
-        save_metadata(metadata)
-        for client_id, client_info in clients.items():
-            try:
-                client_ip = client_info["ip"]
-                client_port = client_info["port"]
-                delete_url = f"http://{client_ip}:{client_port}/delete_file"
-                requests.post(delete_url, json={"file_name": file_name}, timeout=5)
-                print(f"Sent delete request to {client_id} at {client_ip}:{client_port}")
-            except requests.exceptions.RequestException as e:
-                print(f"Failed to send delete request to {client_id}: {e}")
-        return jsonify({"message": f"File {file_name} deleted across all clients."})
+    if version is not None:
+        # Clients are told in the background; offline ones get it from /sync.
+        delete_fanout.kick()
+        return jsonify({"message": f"File {file_name} deleted across all clients.", "version": version})
 
     return jsonify({"message": f"File {file_name} not found in metadata."})
 
 @app.route("/sync", methods=["GET"])
 def sync_files():
-    full_metadata = load_metadata()
+    # Liveness comes from the background tracker, no probing here. Clients
+    # still on this endpoint predate subfolders and can't write nested
+    # paths, so only top-level files are listed for them.
     full_clients = load_clients()
 
-    clients = {}
-    metadata = {}
-
-    # Filter only alive clients
-    for client_id, client_info in full_clients.items():
-        ip = client_info["ip"]
-        port = client_info["port"]
-        if is_client_alive(ip, port):
-            clients[client_id] = client_info
-            if client_id in full_metadata:
-                metadata[client_id] = full_metadata[client_id]
-
     sync_instructions = {}
-
-    # Build full file index
-    all_files = set()
-    file_locations = {}
-
-    for client_id, files in metadata.items():
-        for file_name in files.keys():
-            all_files.add(file_name)
-            if file_name not in file_locations:
-                file_locations[file_name] = []
-            file_locations[file_name].append(client_id)
-
-    for client_id, client_files in metadata.items():
-        sync_instructions[client_id] = {"delete_files": []}
-
-        for file_name in all_files:
-            # File is missing in this client
-            if file_name not in client_files:
-                versions = []
-                for peer_id in file_locations[file_name]:
-                    peer_info = metadata[peer_id][file_name]
-                    versions.append({
-                        "client_id": peer_id,
-                        "hash": peer_info["hash"],
-                        "last_modified": peer_info["last_modified"]
-                    })
-                if versions:
-                    latest = max(versions, key=lambda x: x["last_modified"])
-                    peer_info = clients[latest["client_id"]]
-                    sync_instructions[client_id][file_name] = {
-                        "ip": peer_info["ip"],
-                        "port": peer_info["port"],
-                        "sync_folder": peer_info["sync_folder"]
-                    }
-
-            # File exists, but maybe outdated version
-            else:
-                client_file_info = client_files[file_name]
-                versions = []
-                for peer_id in file_locations[file_name]:
-                    peer_info = metadata[peer_id][file_name]
-                    versions.append({
-                        "client_id": peer_id,
-                        "hash": peer_info["hash"],
-                        "last_modified": peer_info["last_modified"]
-                    })
-
-                if versions:
-                    # Get latest version across all alive clients
-                    latest = max(versions, key=lambda x: x["last_modified"])
-
-                    # If client's file hash != latest file hash
-                    if client_file_info["hash"] != latest["hash"]:
-                        peer_info = clients[latest["client_id"]]
-                        sync_instructions[client_id][file_name] = {
-                            "ip": peer_info["ip"],
-                            "port": peer_info["port"],
-                            "sync_folder": peer_info["sync_folder"]
-                        }
+    with plan_seconds.time(call="plan_all"):
+        plans = planner.plan_all()
+    for client_id, plan in plans.items():
+        sync_instructions[client_id] = {
+            "delete_files": [file_name for file_name, _ in store.pending_deletes_for(client_id)
+                             if "/" not in file_name]
+        }
+        for file_name, source_id in plan.items():
+            if "/" in file_name:
+                continue
+            peer_info = full_clients[source_id]
+            sync_instructions[client_id][file_name] = {
+                "ip": peer_info["ip"],
+                "port": peer_info["port"],
+                "sync_folder": peer_info["sync_folder"]
+            }
 
     return jsonify(sync_instructions)
 
+@app.route("/sync/<client_id>", methods=["GET"])
+def sync_client(client_id):
+    # Only this client's instructions, and only what changed since the
+    # cursor it got last time. Peers are listed once and referenced by id;
+    # every peer is listed each time so downloads still pending from an
+    # earlier round pick up a peer's new address.
+    heartbeat(client_id)
+    full_clients = load_clients()
+    # Deletes up to deletes_ack were applied by the client last round.
+    try:
+        store.ack_deletes(client_id, int(request.args.get("deletes_ack", 0)))
+    except ValueError:
+        pass
+    deletes = store.pending_deletes_for(client_id)
+
+    with plan_seconds.time(call="changes_for"):
+        cursor, reset, updated, dropped = planner.changes_for(client_id, request.args.get("cursor"))
+    downloads = []
+    for file_name, source_id in updated.items():
+        info = planner.file_info(source_id, file_name) or {}
+        # Every alive peer with the same content can serve a range of it.
+        sources = planner.sources_for(file_name) or [source_id]
+        downloads.append([file_name, sources, info.get("size", 0), info.get("last_modified", 0), info.get("hash")])
+    peers = {
+        peer_id: [peer_info["ip"], peer_info["port"], peer_info["sync_folder"], peer_info.get("file_port")]
+        for peer_id, peer_info in full_clients.items() if peer_id != client_id
+    }
+
+    return compact_json_response({
+        "cursor": cursor,
+        "reset": reset,
+        "peers": peers,
+        "get": downloads,
+        "drop": dropped,
+        "delete_files": [file_name for file_name, _ in deletes],
+        "moves": store.moves([file_name for file_name, _ in deletes]),
+        "deleted": store.deleted_versions([file_name for file_name, _ in deletes]),
+        "delete_version": max((version for _, version in deletes), default=0)
+    })
+
+@app.route("/poll/<client_id>", methods=["GET"])
+def poll(client_id):
+    # The cheap idle round: the server's root hash of this client's table,
+    # a digest over every client's table and whether /sync/<client_id>
+    # has anything for this cursor. Clients only upload metadata or call
+    # /sync when one of these says so.
+    heartbeat(client_id)
+    pending = planner.has_changes(client_id, request.args.get("cursor")) or bool(store.pending_deletes_for(client_id))
+    return jsonify({"root": store.root_hash(client_id), "digest": store.global_digest(), "sync": pending})
+
+@app.route("/wait/<client_id>", methods=["GET"])
+def wait_for_changes(client_id):
+    # Long-poll: returns as soon as /sync/<client_id> would report something
+    # new for this cursor, or after the timeout with changed=false.
+    try:
+        timeout = min(float(request.args.get("timeout", LONG_POLL_TIMEOUT)), LONG_POLL_TIMEOUT)
+    except ValueError:
+        timeout = LONG_POLL_TIMEOUT
+    heartbeat(client_id)
+    changed = planner.wait_for_changes(client_id, request.args.get("cursor"), timeout)
+    return jsonify({"changed": changed})
+
 @app.route("/get_clients", methods=["GET"])
 def get_clients():
     requesting_ip = request.remote_addr
@@ -231,4 +348,11 @@ def get_clients():
 
 if __name__ == "__main__":
     initialize_files()
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    if ANNOUNCE_PRESENCE:
+        Announcer(SERVER_NAME, SERVER_PORT).start()
+    if serve is not None:
+        serve(app, host="0.0.0.0", port=SERVER_PORT, threads=WSGI_THREADS)
+    else:
+        # No reloader: it would run a second copy of the background
+        # workers and caches above against the same database.
+        app.run(host="0.0.0.0", port=SERVER_PORT, debug=True, use_reloader=False)
@@ -0,0 +1,415 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from merkle import MerkleTree
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clients (
+    client_id TEXT PRIMARY KEY,
+    ip TEXT,
+    port INTEGER,
+    sync_folder TEXT,
+    file_port INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+    client_id TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    size INTEGER,
+    hash TEXT,
+    hash_algo TEXT,
+    last_modified REAL,
+    PRIMARY KEY (client_id, file_name)
+);
+CREATE TABLE IF NOT EXISTS generations (
+    client_id TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tombstones (
+    file_name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    last_modified REAL,
+    deleted_at REAL,
+    moved_to TEXT,
+    hash TEXT
+);
+CREATE TABLE IF NOT EXISTS pending_deletes (
+    client_id TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (client_id, file_name)
+);
+CREATE INDEX IF NOT EXISTS files_by_hash ON files (hash);
+CREATE INDEX IF NOT EXISTS files_by_name ON files (file_name);
+"""
+
+
+def _row_to_entry(size, file_hash, hash_algo, last_modified):
+    entry = {"size": size, "hash": file_hash, "last_modified": last_modified}
+    if hash_algo is not None:
+        entry["hash_algo"] = hash_algo
+    return entry
+
+
+class MetadataStore:
+    """Server state in SQLite (WAL mode) with an in-memory read cache.
+
+    Reads are served from the cache. Writes go through one lock, each in
+    its own transaction, and the cache is only updated after the commit.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        # Columns added after the first release of this schema.
+        self._add_column(conn, "clients", "file_port", "INTEGER")
+        self._add_column(conn, "tombstones", "moved_to", "TEXT")
+        self._add_column(conn, "tombstones", "hash", "TEXT")
+        self.clients = {}
+        self.metadata = {}
+        self.generations = {}
+        # file_name -> (version, last_modified of the deleted version, deleted_at,
+        #               new name if it was moved, hash of the moved content)
+        self.tombstones = {}
+        self.tombstone_version = 0
+        self.pending_deletes = {}  # client_id -> {file_name: [version, attempts, next_attempt]}
+        self.trees = {}            # client_id -> MerkleTree of its files
+        self.fleet_digest = None   # over every client's root hash, None until computed
+        self._load_cache()
+
+    def _conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    @staticmethod
+    def _add_column(conn, table, column, decl):
+        if column not in {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}:
+            with conn:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+    def _load_cache(self):
+        conn = self._conn()
+        for client_id, ip, port, sync_folder, file_port in conn.execute(
+                "SELECT client_id, ip, port, sync_folder, file_port FROM clients"):
+            self.clients[client_id] = {"ip": ip, "port": port, "sync_folder": sync_folder, "file_port": file_port}
+        for client_id, file_name, size, file_hash, hash_algo, last_modified in conn.execute(
+                "SELECT client_id, file_name, size, hash, hash_algo, last_modified FROM files"):
+            self.metadata.setdefault(client_id, {})[file_name] = _row_to_entry(size, file_hash, hash_algo, last_modified)
+        for client_id, files in self.metadata.items():
+            self.trees[client_id] = MerkleTree(files)
+        for client_id, generation in conn.execute("SELECT client_id, generation FROM generations"):
+            self.generations[client_id] = generation
+        for file_name, version, last_modified, deleted_at, moved_to, file_hash in conn.execute(
+                "SELECT file_name, version, last_modified, deleted_at, moved_to, hash FROM tombstones"):
+            self.tombstones[file_name] = (version, last_modified, deleted_at, moved_to, file_hash)
+            self.tombstone_version = max(self.tombstone_version, version)
+        for client_id, file_name, version, attempts, next_attempt in conn.execute(
+                "SELECT client_id, file_name, version, attempts, next_attempt FROM pending_deletes"):
+            self.pending_deletes.setdefault(client_id, {})[file_name] = [version, attempts, next_attempt]
+
+    # ---- Reads (cache only) ----
+
+    def load_clients(self):
+        with self.lock:
+            return {client_id: dict(info) for client_id, info in self.clients.items()}
+
+    def get_client(self, client_id):
+        with self.lock:
+            info = self.clients.get(client_id)
+            return dict(info) if info is not None else None
+
+    def load_metadata(self):
+        with self.lock:
+            return {client_id: dict(files) for client_id, files in self.metadata.items()}
+
+    def client_files(self, client_id):
+        with self.lock:
+            return dict(self.metadata.get(client_id, {}))
+
+    def generation(self, client_id):
+        # Bumped on every metadata write, lets clients upload deltas.
+        with self.lock:
+            return self.generations.get(client_id, 0)
+
+    def tree(self, client_id, directory=""):
+        """(generation, root hash, children of directory) of a client's
+        table; children is None if the directory doesn't exist."""
+        with self.lock:
+            tree = self.trees.get(client_id) or MerkleTree()
+            return self.generations.get(client_id, 0), tree.root_hash(), tree.children(directory)
+
+    def root_hash(self, client_id):
+        with self.lock:
+            tree = self.trees.get(client_id)
+            return tree.root_hash() if tree is not None else MerkleTree().root_hash()
+
+    def global_digest(self):
+        # Changes whenever any client's table does.
+        with self.lock:
+            if self.fleet_digest is None:
+                roots = "\n".join(f"{client_id}\0{tree.root_hash()}" for client_id, tree in sorted(self.trees.items()))
+                self.fleet_digest = hashlib.blake2b(roots.encode(), digest_size=16).hexdigest()
+            return self.fleet_digest
+
+    def tombstone(self, file_name):
+        # (version, last_modified of the deleted version) or None.
+        with self.lock:
+            tombstone = self.tombstones.get(file_name)
+            return tombstone[:2] if tombstone is not None else None
+
+    def moves(self, names):
+        # {file_name: [moved_to, hash]} for the tombstones among names that
+        # record a move rather than a delete.
+        with self.lock:
+            return {
+                name: [self.tombstones[name][3], self.tombstones[name][4]]
+                for name in names if name in self.tombstones and self.tombstones[name][3]
+            }
+
+    def deleted_versions(self, names):
+        # {file_name: [last_modified, hash]} of what was deleted, for the
+        # tombstones among names. Clients keep copies edited since.
+        with self.lock:
+            return {
+                name: [self.tombstones[name][1], self.tombstones[name][4]]
+                for name in names if name in self.tombstones
+            }
+
+    def pending_deletes_for(self, client_id):
+        # [(file_name, version)] still to be applied by this client, oldest first.
+        with self.lock:
+            pending = self.pending_deletes.get(client_id, {})
+            return sorted(((name, entry[0]) for name, entry in pending.items()), key=lambda item: item[1])
+
+    def due_deletes(self, now):
+        # [(client_id, file_name, version, attempts)] whose next push attempt is due.
+        with self.lock:
+            return [
+                (client_id, file_name, version, attempts)
+                for client_id, pending in self.pending_deletes.items()
+                for file_name, (version, attempts, next_attempt) in pending.items()
+                if next_attempt <= now
+            ]
+
+    # ---- Writes ----
+
+    def register_client(self, client_id, ip, port, sync_folder, file_port=None):
+        with self.lock:
+            conn = self._conn()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO clients (client_id, ip, port, sync_folder, file_port) VALUES (?, ?, ?, ?, ?)",
+                    (client_id, ip, port, sync_folder, file_port))
+            self.clients[client_id] = {"ip": ip, "port": port, "sync_folder": sync_folder, "file_port": file_port}
+
+    def update_client_ip(self, client_id, ip):
+        with self.lock:
+            if client_id not in self.clients:
+                return
+            conn = self._conn()
+            with conn:
+                conn.execute("UPDATE clients SET ip = ? WHERE client_id = ?", (ip, client_id))
+            self.clients[client_id]["ip"] = ip
+
+    def replace_client_files(self, client_id, files):
+        # Only rows that actually changed are written.
+        with self.lock:
+            old_files = self.metadata.get(client_id, {})
+            changed = {name: info for name, info in files.items() if old_files.get(name) != info}
+            removed = [name for name in old_files if name not in files]
+            return self._apply(client_id, changed, removed)
+
+    def apply_client_delta(self, client_id, changed, removed):
+        with self.lock:
+            return self._apply(client_id, changed, removed)
+
+    def _apply(self, client_id, changed, removed):
+        # One transaction per client update; returns the new generation.
+        generation = self.generations.get(client_id, 0) + 1
+        upserts = [
+            (client_id, name, info.get("size"), info.get("hash"), info.get("hash_algo"), info.get("last_modified"))
+            for name, info in changed.items()
+        ]
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO files (client_id, file_name, size, hash, hash_algo, last_modified) "
+                "VALUES (?, ?, ?, ?, ?, ?)", upserts)
+            conn.executemany("DELETE FROM files WHERE client_id = ? AND file_name = ?",
+                             [(client_id, name) for name in removed])
+            conn.execute("INSERT OR REPLACE INTO generations (client_id, generation) VALUES (?, ?)",
+                         (client_id, generation))
+        client_files = self.metadata.setdefault(client_id, {})
+        tree = self.trees.setdefault(client_id, MerkleTree())
+        for name in removed:
+            if client_files.pop(name, None) is not None:
+                tree.remove(name)
+        for name, info in changed.items():
+            client_files[name] = _row_to_entry(info.get("size"), info.get("hash"), info.get("hash_algo"), info.get("last_modified"))
+            tree.set(name, client_files[name])
+        self.generations[client_id] = generation
+        self.fleet_digest = None
+        return generation
+
+    def remove_file(self, file_name, deleted_by=None, moved_to=None):
+        """Delete a file everywhere: drop it from every client's table,
+        record a tombstone and queue the delete for every other client.
+        With moved_to, the tombstone records that the file was renamed,
+        so clients holding the same content can rename theirs instead.
+        Returns the tombstone version, or None if nobody had the file."""
+        with self.lock:
+            holders = [client_id for client_id, files in self.metadata.items() if file_name in files]
+            if not holders:
+                return None
+            # The holders' server-side tables changed behind their backs, so
+            # their next delta upload has to be refused in favour of a full one.
+            bumped = [(client_id, self.generations.get(client_id, 0) + 1) for client_id in holders]
+            version = self.tombstone_version + 1
+            last_modified = max(self.metadata[client_id][file_name].get("last_modified") or 0 for client_id in holders)
+            deleted_at = time.time()
+            # The content deleted (or moved): the deleter's copy, else the
+            # newest. Clients only delete copies that still match it.
+            deleted = self.metadata.get(deleted_by, {}).get(file_name) or max(
+                (self.metadata[client_id][file_name] for client_id in holders),
+                key=lambda info: info.get("last_modified") or 0)
+            file_hash = deleted.get("hash")
+            recipients = [client_id for client_id in self.clients if client_id != deleted_by]
+            conn = self._conn()
+            with conn:
+                conn.execute("DELETE FROM files WHERE file_name = ?", (file_name,))
+                conn.executemany("INSERT OR REPLACE INTO generations (client_id, generation) VALUES (?, ?)", bumped)
+                conn.execute("INSERT OR REPLACE INTO tombstones (file_name, version, last_modified, deleted_at, moved_to, hash) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", (file_name, version, last_modified, deleted_at, moved_to, file_hash))
+                conn.executemany("INSERT OR REPLACE INTO pending_deletes (client_id, file_name, version) VALUES (?, ?, ?)",
+                                 [(client_id, file_name, version) for client_id in recipients])
+            for client_id, generation in bumped:
+                del self.metadata[client_id][file_name]
+                self.trees[client_id].remove(file_name)
+                self.generations[client_id] = generation
+            self.fleet_digest = None
+            self.tombstone_version = version
+            self.tombstones[file_name] = (version, last_modified, deleted_at, moved_to, file_hash)
+            for client_id in recipients:
+                self.pending_deletes.setdefault(client_id, {})[file_name] = [version, 0, 0]
+            return version
+
+    def clear_tombstone(self, file_name):
+        # The file was created again after it was deleted; pending deletes
+        # must not remove the new version.
+        with self.lock:
+            if file_name not in self.tombstones:
+                return
+            conn = self._conn()
+            with conn:
+                conn.execute("DELETE FROM tombstones WHERE file_name = ?", (file_name,))
+                conn.execute("DELETE FROM pending_deletes WHERE file_name = ?", (file_name,))
+            del self.tombstones[file_name]
+            for pending in self.pending_deletes.values():
+                pending.pop(file_name, None)
+
+    def queue_delete(self, client_id, file_name):
+        # Re-queue a tombstoned file for a client that still reports it.
+        with self.lock:
+            tombstone = self.tombstones.get(file_name)
+            pending = self.pending_deletes.setdefault(client_id, {})
+            if tombstone is None or file_name in pending:
+                return False
+            conn = self._conn()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO pending_deletes (client_id, file_name, version) VALUES (?, ?, ?)",
+                             (client_id, file_name, tombstone[0]))
+            pending[file_name] = [tombstone[0], 0, 0]
+            return True
+
+    def ack_delete(self, client_id, file_name, version):
+        with self.lock:
+            entry = self.pending_deletes.get(client_id, {}).get(file_name)
+            if entry is None or entry[0] != version:
+                return
+            conn = self._conn()
+            with conn:
+                conn.execute("DELETE FROM pending_deletes WHERE client_id = ? AND file_name = ? AND version = ?",
+                             (client_id, file_name, version))
+            del self.pending_deletes[client_id][file_name]
+
+    def ack_deletes(self, client_id, up_to_version):
+        # The client applied every delete it was handed up to this version.
+        with self.lock:
+            pending = self.pending_deletes.get(client_id, {})
+            done = [name for name, entry in pending.items() if entry[0] <= up_to_version]
+            if not done:
+                return
+            conn = self._conn()
+            with conn:
+                conn.execute("DELETE FROM pending_deletes WHERE client_id = ? AND version <= ?",
+                             (client_id, up_to_version))
+            for name in done:
+                del pending[name]
+
+    def defer_delete(self, client_id, file_name, version, attempts, next_attempt):
+        with self.lock:
+            entry = self.pending_deletes.get(client_id, {}).get(file_name)
+            if entry is None or entry[0] != version:
+                return
+            conn = self._conn()
+            with conn:
+                conn.execute("UPDATE pending_deletes SET attempts = ?, next_attempt = ? "
+                             "WHERE client_id = ? AND file_name = ?", (attempts, next_attempt, client_id, file_name))
+            entry[1], entry[2] = attempts, next_attempt
+
+    def prune_tombstones(self, older_than):
+        # Tombstones nobody is waiting on can go once they're old enough.
+        with self.lock:
+            waiting = {name for pending in self.pending_deletes.values() for name in pending}
+            expired = [name for name, (_, _, deleted_at, _, _) in self.tombstones.items()
+                       if name not in waiting and (deleted_at or 0) < older_than]
+            if not expired:
+                return 0
+            conn = self._conn()
+            with conn:
+                conn.executemany("DELETE FROM tombstones WHERE file_name = ?", [(name,) for name in expired])
+            for name in expired:
+                del self.tombstones[name]
+            return len(expired)
+
+    # ---- Migration ----
+
+    def migrate_from_json(self, metadata_file, clients_file):
+        # One-time import of the JSON files used before the SQLite store.
+        with self.lock:
+            if self.clients or self.metadata:
+                return
+        for path, loader in ((clients_file, self._import_clients), (metadata_file, self._import_metadata)):
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+            except (json.JSONDecodeError, IOError) as e:
+                print(f"Warning: Could not migrate {path}: {e}")
+                continue
+            loader(data)
+            os.replace(path, f"{path}.migrated")
+            print(f"Migrated {path} into {self.db_path}")
+
+    def _import_clients(self, clients):
+        for client_id, info in clients.items():
+            self.register_client(client_id, info.get("ip"), info.get("port"), info.get("sync_folder"),
+                                 info.get("file_port"))
+
+    def _import_metadata(self, metadata):
+        for client_id, files in metadata.items():
+            self.replace_client_files(client_id, files)
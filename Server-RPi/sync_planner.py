@@ -0,0 +1,262 @@
+import threading
+import uuid
+
+
+class SyncPlanner:
+    """Incremental /sync planner.
+
+    Keeps, per file, which active client holds the latest version, plus each
+    client's pending download plan. Metadata updates only touch the files
+    that changed, and a client's plan is brought up to date by replaying the
+    files changed since it was last planned instead of walking every file.
+    """
+
+    def __init__(self, comparable=lambda info: True):
+        # comparable(info) tells whether an entry's hash can be compared
+        # with the rest of the fleet; clients with any other entries sit
+        # out of planning until they rescan.
+        self.comparable = comparable
+        self.lock = threading.Lock()
+        # Notified whenever plans may have changed; see wait_for_changes.
+        self.changed = threading.Condition(self.lock)
+        self.files = {}        # client_id -> {file_name: info}
+        self.holders = {}      # file_name -> set of client_ids that have it
+        self.latest = {}       # file_name -> client_id with the latest active version
+        self.alive = set()
+        self.foreign = {}      # client_id -> number of entries that aren't comparable
+        self.active = set()    # alive, eligible clients that reported metadata
+        self.seq = 0
+        self.log_base = 0      # change_log[i] was logged at seq log_base + i + 1
+        self.change_log = []
+        self.cursors = {}      # client_id -> seq its plan reflects
+        self.plans = {}        # client_id -> {file_name: source client_id}
+        # Per-client log of plan entries that changed, so /sync/<client_id>
+        # can answer with only what changed since the client's cursor.
+        # Cursors carry the epoch so ones issued before a restart are reset.
+        self.epoch = uuid.uuid4().hex[:8]
+        self.plan_logs = {}    # client_id -> [file_name, ...]
+        self.plan_log_bases = {}
+
+    # ---- Updates ----
+
+    def load(self, metadata):
+        for client_id, client_files in metadata.items():
+            self.update_client(client_id, client_files)
+
+    def update_client(self, client_id, new_files):
+        old_files = self.files.get(client_id, {})
+        changed = {name: info for name, info in new_files.items() if old_files.get(name) != info}
+        removed = [name for name in old_files if name not in new_files]
+        self.apply_delta(client_id, changed, removed)
+
+    def apply_delta(self, client_id, changed, removed):
+        with self.lock:
+            client_files = self.files.setdefault(client_id, {})
+            foreign = self.foreign.get(client_id, 0)
+            for name in removed:
+                info = client_files.pop(name, None)
+                if info is not None:
+                    foreign -= not self.comparable(info)
+                    self._drop_holder(name, client_id)
+            for name, info in changed.items():
+                old = client_files.get(name)
+                if old is not None:
+                    foreign -= not self.comparable(old)
+                foreign += not self.comparable(info)
+                client_files[name] = info
+                self.holders.setdefault(name, set()).add(client_id)
+            self.foreign[client_id] = foreign
+            self._update_active()
+            for name in list(changed) + list(removed):
+                self._refresh(name)
+            self.changed.notify_all()
+
+    def remove_file(self, file_name):
+        with self.lock:
+            for client_id in self.holders.pop(file_name, ()):
+                info = self.files[client_id].pop(file_name)
+                self.foreign[client_id] -= not self.comparable(info)
+            self._update_active()
+            self._refresh(file_name)
+            self.changed.notify_all()
+
+    def set_alive(self, alive):
+        with self.lock:
+            self.alive = set(alive)
+            self._update_active()
+            self.changed.notify_all()
+
+    def _drop_holder(self, name, client_id):
+        holders = self.holders.get(name)
+        if holders is not None:
+            holders.discard(client_id)
+            if not holders:
+                del self.holders[name]
+
+    def _update_active(self):
+        active = {c for c in self.alive if c in self.files and not self.foreign.get(c)}
+        if active == self.active:
+            return
+        toggled = active ^ self.active
+        self.active = active
+        touched = set()
+        for client_id in toggled:
+            touched.update(self.files.get(client_id, ()))
+            # Clients (re)joining get a fresh plan; departed ones are dropped.
+            self.cursors.pop(client_id, None)
+            self.plans.pop(client_id, None)
+        for name in touched:
+            self._refresh(name)
+
+    def _refresh(self, name):
+        best = None
+        for client_id in self.holders.get(name, ()):
+            if client_id not in self.active:
+                continue
+            key = (self.files[client_id][name]["last_modified"], client_id)
+            if best is None or key > best:
+                best = key
+        if best is None:
+            self.latest.pop(name, None)
+        else:
+            self.latest[name] = best[1]
+        self.seq += 1
+        self.change_log.append(name)
+
+    # ---- Planning ----
+
+    def _plan_entry(self, client_id, name):
+        source_id = self.latest.get(name)
+        if source_id is None:
+            return None
+        mine = self.files[client_id].get(name)
+        if mine is None or mine["hash"] != self.files[source_id][name]["hash"]:
+            return source_id
+        return None
+
+    def _catch_up(self, client_id):
+        cursor = self.cursors.get(client_id)
+        plan = self.plans.get(client_id)
+        log = self.plan_logs.setdefault(client_id, [])
+        if cursor is None or cursor < self.log_base or plan is None:
+            # Rebuilding from scratch invalidates every cursor handed out.
+            self.plan_log_bases[client_id] = self.plan_log_bases.get(client_id, 0) + len(log) + 1
+            log.clear()
+            plan = {}
+            names = self.latest
+        else:
+            names = set(self.change_log[cursor - self.log_base:])
+        for name in names:
+            source_id = self._plan_entry(client_id, name)
+            if source_id is None:
+                if plan.pop(name, None) is not None:
+                    log.append(name)
+            elif plan.get(name) != source_id:
+                plan[name] = source_id
+                log.append(name)
+        if len(log) > 2 * len(plan) + 1024:
+            # Nobody is consuming this log (legacy /sync only), cap it.
+            self.plan_log_bases[client_id] += len(log) + 1
+            log.clear()
+        self.plans[client_id] = plan
+        self.cursors[client_id] = self.seq
+        return plan
+
+    def _trim_log(self):
+        if not self.cursors:
+            floor = self.seq
+        else:
+            floor = min(self.cursors.values())
+        if floor > self.log_base:
+            del self.change_log[:floor - self.log_base]
+            self.log_base = floor
+
+    def plan_for(self, client_id):
+        with self.lock:
+            if client_id not in self.active:
+                return {}
+            plan = dict(self._catch_up(client_id))
+            self._trim_log()
+            return plan
+
+    def plan_all(self):
+        with self.lock:
+            plans = {client_id: dict(self._catch_up(client_id)) for client_id in self.active}
+            self._trim_log()
+            return plans
+
+    def changes_for(self, client_id, cursor=None):
+        """Plan changes for one client since cursor.
+
+        Returns (new_cursor, reset, updated, dropped): when reset is true,
+        updated is the whole plan and the client should forget its own."""
+        with self.lock:
+            if client_id not in self.active:
+                return None, True, {}, []
+            plan = self._catch_up(client_id)
+            self._trim_log()
+            log = self.plan_logs[client_id]
+            base = self.plan_log_bases[client_id]
+            position = self._parse_cursor(cursor)
+            if position is None or not base <= position <= base + len(log):
+                updated, dropped, reset = dict(plan), [], True
+            else:
+                updated, dropped, reset = {}, [], False
+                for name in set(log[position - base:]):
+                    if name in plan:
+                        updated[name] = plan[name]
+                    else:
+                        dropped.append(name)
+            # Everything before the returned cursor has now been handed out.
+            end = base + len(log)
+            del log[:]
+            self.plan_log_bases[client_id] = end
+            return f"{self.epoch}:{end}", reset, updated, dropped
+
+    def wait_for_changes(self, client_id, cursor, timeout):
+        """Block until changes_for(client_id, cursor) has something new,
+        or timeout seconds pass. Returns whether it does."""
+        with self.changed:
+            return self.changed.wait_for(lambda: self._has_changes(client_id, cursor), timeout)
+
+    def has_changes(self, client_id, cursor):
+        # wait_for_changes without the wait.
+        with self.lock:
+            return self._has_changes(client_id, cursor)
+
+    def _has_changes(self, client_id, cursor):
+        if client_id not in self.active:
+            return False
+        self._catch_up(client_id)
+        self._trim_log()
+        # Anything but the cursor changes_for would hand out now means
+        # there is news (or the cursor is stale and needs a reset).
+        end = self.plan_log_bases[client_id] + len(self.plan_logs[client_id])
+        return self._parse_cursor(cursor) != end
+
+    def sources_for(self, file_name):
+        # Every active client holding the latest version, the one that
+        # defines it first.
+        with self.lock:
+            latest_id = self.latest.get(file_name)
+            if latest_id is None:
+                return []
+            latest_hash = self.files[latest_id][file_name]["hash"]
+            others = sorted(
+                client_id for client_id in self.holders.get(file_name, ())
+                if client_id != latest_id and client_id in self.active
+                and self.files[client_id][file_name]["hash"] == latest_hash
+            )
+            return [latest_id] + others
+
+    def file_info(self, client_id, file_name):
+        with self.lock:
+            return self.files.get(client_id, {}).get(file_name)
+
+    def _parse_cursor(self, cursor):
+        if not cursor:
+            return None
+        epoch, _, position = cursor.partition(":")
+        if epoch != self.epoch or not position.isdigit():
+            return None
+        return int(position)
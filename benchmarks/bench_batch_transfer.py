@@ -0,0 +1,90 @@
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+from werkzeug.serving import make_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Client-PC"))
+
+import c1  # noqa: E402
+from batch_transfer import plan_batches, unpack_stream  # noqa: E402
+from hashing import hash_file  # noqa: E402
+
+
+def per_file(base_url, names, dest):
+    # What the client did before: one requests.get per file.
+    for name in names:
+        response = requests.get(f"{base_url}/download/{name}", stream=True, timeout=10)
+        response.raise_for_status()
+        with open(os.path.join(dest, name), "wb") as f:
+            for chunk in response.iter_content(chunk_size=4096):
+                f.write(chunk)
+
+
+def batched(base_url, names, dest, expected, algorithm):
+    stored = 0
+    for batch in plan_batches([(name, 0) for name in names]):
+        with requests.post(f"{base_url}/batch_download", json={"files": batch}, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            stored += len(unpack_stream(response.raw, dest, {name: expected[name] for name in batch}, algorithm))
+    return stored
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Small-file transfer: one request per file vs batched stream")
+    parser.add_argument("--files", type=int, default=10_000)
+    parser.add_argument("--size", type=int, default=4096, help="bytes per file")
+    parser.add_argument("--port", type=int, default=8700)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="syncit-batch-")
+    server = None
+    try:
+        source = os.path.join(workdir, "source")
+        os.makedirs(source)
+        names = [f"file_{i:05d}.txt" for i in range(args.files)]
+        for name in names:
+            with open(os.path.join(source, name), "wb") as f:
+                f.write(os.urandom(args.size))
+        algorithm = "blake2b"
+        expected = {name: hash_file(os.path.join(source, name), algorithm) for name in names}
+
+        # The peer side is the client's own Flask app serving `source`.
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        c1.SYNC_FOLDER = source
+        server = make_server("127.0.0.1", args.port, c1.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{args.port}"
+
+        results = {}
+        for label, run in (("per-file", lambda dest: per_file(base_url, names, dest)),
+                           ("batched", lambda dest: batched(base_url, names, dest, expected, algorithm))):
+            dest = os.path.join(workdir, label)
+            os.makedirs(dest)
+            start = time.perf_counter()
+            run(dest)
+            elapsed = time.perf_counter() - start
+            received = [name for name in names
+                        if os.path.exists(os.path.join(dest, name))
+                        and hash_file(os.path.join(dest, name), algorithm) == expected[name]]
+            if len(received) != len(names):
+                raise RuntimeError(f"{label}: only {len(received)} of {len(names)} files arrived intact")
+            results[label] = elapsed
+            print(f"{label:>9}: {elapsed:7.2f}s  {len(names) / elapsed:9.0f} files/s  "
+                  f"{len(names) * args.size / elapsed / 1e6:7.1f} MB/s")
+
+        print(f"speedup: {results['per-file'] / results['batched']:.1f}x for {args.files} files of {args.size} bytes")
+    finally:
+        if server is not None:
+            server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Client-PC"))
+
+from metadata_store import ClientMetadata  # noqa: E402
+
+
+def make_info(i):
+    return {"size": i * 7, "hash": f"{i:064x}", "hash_algo": "blake2b", "last_modified": 1_700_000_000.0 + i}
+
+
+def measure_memory(build):
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, current
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Client metadata: in-memory store vs JSON file per update")
+    parser.add_argument("--entries", type=int, default=1_000_000)
+    parser.add_argument("--updates", type=int, default=100_000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="syncit-metadata-")
+    try:
+        path = os.path.join(workdir, "metadata.json")
+        names = [f"folder{i % 1000}/file_{i}.dat" for i in range(args.entries)]
+
+        with open(path, "w") as f:
+            json.dump({name: make_info(i) for i, name in enumerate(names)}, f, indent=4)
+
+        def build_dicts():
+            with open(path) as f:
+                return json.load(f)
+        plain, plain_bytes = measure_memory(build_dicts)
+        del plain
+
+        def build_store():
+            store = ClientMetadata(path)
+            store.load()
+            return store
+        store, store_bytes = measure_memory(build_store)
+        print(f"{args.entries:,} entries in memory: dicts {plain_bytes / 2**20:,.0f} MiB, "
+              f"__slots__ entries {store_bytes / 2**20:,.0f} MiB")
+
+        # Old path: every update re-reads and rewrites the whole JSON file.
+        start = time.perf_counter()
+        with open(path) as f:
+            metadata = json.load(f)
+        metadata[names[0]] = make_info(-1)
+        with open(path, "w") as f:
+            json.dump(metadata, f, indent=4)
+        old_update = time.perf_counter() - start
+        del metadata
+
+        # New path: in-memory updates while the write-behind flusher runs.
+        store.flush_interval = 1
+        store.start()
+        latencies = []
+        for n in range(args.updates):
+            i = (n * 7919) % args.entries
+            t = time.perf_counter()
+            store.put(names[i], i, f"{n:064x}", "blake2b", 1_800_000_000.0 + n)
+            latencies.append(time.perf_counter() - t)
+        latencies.sort()
+        start = time.perf_counter()
+        store.dirty = True
+        store.flush()
+        flush_time = time.perf_counter() - start
+
+        print(f"update, load+save JSON per call: {old_update * 1000:,.0f} ms")
+        print(f"update, in-memory store:         p50 {percentile(latencies, 0.5) * 1e6:.1f} us, "
+              f"p99 {percentile(latencies, 0.99) * 1e6:.1f} us, max {latencies[-1] * 1000:.1f} ms "
+              f"({args.updates:,} updates, flushing every {store.flush_interval}s)")
+        print(f"atomic flush of {len(store):,} entries: {flush_time * 1000:,.0f} ms, "
+              f"{os.path.getsize(path) / 2**20:,.0f} MiB on disk")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import argparse
+import glob
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "Client-PC"))
+
+from compression import LINK_HEADER, Decoder, LinkMeter, accept_encoding, available_encodings  # noqa: E402
+from http_session import make_session  # noqa: E402
+
+SERVER_PORT = 15095
+PROXY_PORT = 15096
+FILE_SIZE = 2 << 20
+
+
+def serve_files(folder, port):
+    from file_server import FileServer
+
+    FileServer(folder, port, host="127.0.0.1").serve_forever()
+
+
+def run_proxy(port, target_port, mbps):
+    # Forwards to the file server, holding the download direction to mbps
+    # MB/s (0 = unlimited): a stand-in for a slow link.
+    listener = socket.create_server(("127.0.0.1", port))
+
+    def pump(src, dst, limit):
+        start, sent = time.perf_counter(), 0
+        try:
+            while True:
+                data = src.recv(64 * 1024)
+                if not data:
+                    break
+                dst.sendall(data)
+                sent += len(data)
+                if limit:
+                    now = time.perf_counter()
+                    ahead = sent / (limit * 1e6) - (now - start)
+                    if ahead > 0:
+                        time.sleep(ahead)
+                    elif ahead < -0.05:
+                        # Idle time doesn't bank more than a 50 ms burst.
+                        start = now - sent / (limit * 1e6) - 0.05
+        except OSError:
+            pass
+        finally:
+            for s in (src, dst):
+                try:
+                    s.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    while True:
+        client, _ = listener.accept()
+        upstream = socket.create_connection(("127.0.0.1", target_port))
+        for s in (client, upstream):
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        threading.Thread(target=pump, args=(client, upstream, 0), daemon=True).start()
+        threading.Thread(target=pump, args=(upstream, client, mbps), daemon=True).start()
+
+
+def make_dataset(folder, total_mb):
+    # Roughly what a synced work folder holds: logs, CSV exports, source
+    # code, and media that is already compressed.
+    rng = random.Random(1)
+    words = [b"INFO", b"WARN", b"ERROR", b"sync", b"client", b"upload", b"GET", b"/download", b"200", b"404"]
+    source = b"".join(open(path, "rb").read() for path in glob.glob(os.path.join(ROOT, "*", "*.py")))
+
+    def log_file(size):
+        lines = []
+        for _ in range(size // 40):  # lines are longer than that
+            lines.append(b"2024-05-%02d %02d:%02d:%02d " % (rng.randint(1, 28), rng.randint(0, 23), rng.randint(0, 59),
+                                                            rng.randint(0, 59)) +
+                         b" ".join(rng.choice(words) for _ in range(8)) + b"\n")
+        return b"".join(lines)[:size]
+
+    def csv_file(size):
+        rows = [b"id,timestamp,value,label\n"]
+        for i in range(size // 20):
+            rows.append(b"%d,%d,%.4f,%s\n" % (i, 1_700_000_000 + i, rng.random() * 1000, rng.choice(words)))
+        return b"".join(rows)[:size]
+
+    def source_file(size):
+        return (source * (size // len(source) + 1))[:size]
+
+    kinds = [("log", log_file), ("csv", csv_file), ("py", source_file), ("log", log_file), ("jpg", os.urandom)]
+    count = max(len(kinds), total_mb * (1 << 20) // FILE_SIZE)
+    names = []
+    for i in range(count):
+        ext, make = kinds[i % len(kinds)]
+        name = f"file{i}.{ext}"
+        with open(os.path.join(folder, name), "wb") as f:
+            f.write(make(FILE_SIZE))
+        names.append(name)
+    return names
+
+
+def download_all(session, base_url, names, accept, meter=None):
+    # Effective MB/s (file bytes / wall time) and bytes on the wire, the
+    # way c1.py's plain downloads fetch a file.
+    total = wire = 0
+    start = time.perf_counter()
+    for name in names:
+        probe = meter is not None and meter.should_probe("peer", FILE_SIZE)
+        headers = {"Accept-Encoding": "identity" if probe else accept}
+        if meter is not None and meter.get("peer") is not None:
+            headers[LINK_HEADER] = f"{meter.get('peer'):.1f}"
+        t0 = time.perf_counter()
+        with session.get(f"{base_url}/download/{name}", headers=headers, stream=True, timeout=120) as response:
+            response.raise_for_status()
+            encoding = response.headers.get("Content-Encoding")
+            decoder = Decoder(encoding)
+            file_wire = 0
+            for chunk in response.raw.stream(256 * 1024, decode_content=False):
+                file_wire += len(chunk)
+                total += len(decoder.decode(chunk))
+        if meter is not None:
+            meter.record("peer", file_wire, time.perf_counter() - t0, compressed=encoding is not None)
+        wire += file_wire
+    return total / (time.perf_counter() - start) / 1e6, wire
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Effective download MB/s from the file server, with and without "
+                                                 "compression, over throttled links")
+    parser.add_argument("--size-mb", type=int, default=64, help="size of the mixed dataset")
+    parser.add_argument("--links", type=float, nargs="+", default=[5, 25, 100, 0],
+                        help="link speeds in MB/s to simulate (0 = unthrottled loopback)")
+    parser.add_argument("--serve", nargs=2, metavar=("FOLDER", "PORT"), help=argparse.SUPPRESS)
+    parser.add_argument("--proxy", nargs=3, type=float, metavar=("PORT", "TARGET", "MBPS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve_files(args.serve[0], int(args.serve[1]))
+        return
+    if args.proxy:
+        run_proxy(int(args.proxy[0]), int(args.proxy[1]), args.proxy[2])
+        return
+
+    workdir = tempfile.mkdtemp(prefix="syncit-compression-")
+    procs = []
+    try:
+        names = make_dataset(workdir, args.size_mb)
+        size = sum(os.path.getsize(os.path.join(workdir, name)) for name in names)
+        print(f"{len(names)} files, {size / 1e6:.0f} MB: logs, CSV, source code and random .jpg\n")
+        procs.append(subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", workdir, str(SERVER_PORT)]))
+        # The adaptive runs start with nothing known about the link, like a
+        # client that just started, once over only compressible files.
+        compressible = [name for name in names if not name.endswith(".jpg")]
+        modes = [("uncompressed", "identity", False, names)]
+        modes += [(f"{encoding}, default level", encoding, False, names) for encoding in available_encodings()]
+        modes.append((f"adaptive ({accept_encoding()})", accept_encoding(), True, names))
+        modes.append(("adaptive, compressible only", accept_encoding(), True, compressible))
+        for mbps in args.links:
+            proxy = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--proxy",
+                                      str(PROXY_PORT), str(SERVER_PORT), str(mbps)])
+            time.sleep(1)
+            print(f"link {'unthrottled' if not mbps else f'{mbps:g} MB/s'}:")
+            for label, accept, adaptive, files in modes:
+                session = make_session()
+                meter = LinkMeter() if adaptive else None
+                effective, wire = download_all(session, f"http://127.0.0.1:{PROXY_PORT}", files, accept, meter)
+                print(f"  {label:<28} {effective:8.1f} MB/s effective, {wire / 1e6:7.1f} MB on the wire")
+            proxy.terminate()
+            proxy.wait()
+    except requests.exceptions.RequestException as e:
+        print(f"Benchmark failed: {e}")
+    finally:
+        for proc in procs:
+            proc.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
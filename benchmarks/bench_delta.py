@@ -0,0 +1,116 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Client-PC"))
+
+from chunking import chunk_file, rebuild_file  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def write_random(path, size, seed):
+    rng = random.Random(seed)
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining:
+            block = min(remaining, 8 * MB)
+            f.write(rng.randbytes(block))
+            remaining -= block
+
+
+def edit_file(src, dst, edit_fraction, edits, seed):
+    # Spread the edit over several regions, mixing in-place overwrites with
+    # insertions so chunk boundaries have to re-synchronise.
+    rng = random.Random(seed)
+    size = os.path.getsize(src)
+    edit_bytes = int(size * edit_fraction) // edits
+    offsets = sorted(rng.randrange(0, size - edit_bytes) for _ in range(edits))
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        pos = 0
+        for n, offset in enumerate(offsets):
+            offset = max(offset, pos)
+            shutil.copyfileobj(_limited(fin, offset - pos), fout)
+            fout.write(rng.randbytes(edit_bytes))
+            if n % 2:
+                fin.seek(edit_bytes, os.SEEK_CUR)
+                pos = offset + edit_bytes
+            else:
+                pos = offset
+        shutil.copyfileobj(fin, fout)
+
+
+class _limited:
+    def __init__(self, f, n):
+        self.f, self.n = f, n
+
+    def read(self, size=-1):
+        if self.n <= 0:
+            return b""
+        size = self.n if size < 0 else min(size, self.n)
+        data = self.f.read(size)
+        self.n -= len(data)
+        return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes transferred for a small edit to a large file")
+    parser.add_argument("--size-mb", type=int, default=1024)
+    parser.add_argument("--edit", type=float, default=0.01, help="fraction of the file that changes")
+    parser.add_argument("--edits", type=int, default=10, help="number of edited regions")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="syncit-delta-")
+    try:
+        old_path = os.path.join(workdir, "old.img")
+        new_path = os.path.join(workdir, "new.img")
+        out_path = os.path.join(workdir, "rebuilt.img")
+        size = args.size_mb * MB
+        print(f"Generating {args.size_mb} MB file and a {args.edit:.1%} edit...")
+        write_random(old_path, size, 1)
+        edit_file(old_path, new_path, args.edit, args.edits, 2)
+
+        start = time.perf_counter()
+        old_chunks = chunk_file(old_path)
+        chunk_time = time.perf_counter() - start
+        new_chunks = chunk_file(new_path)
+
+        # The peer serves chunks straight out of its copy of the new file.
+        by_hash = {h: (offset, length) for h, offset, length in new_chunks}
+        peer = open(new_path, "rb")
+
+        def fetch_chunk(h):
+            offset, length = by_hash[h]
+            peer.seek(offset)
+            return peer.read(length)
+
+        manifest_bytes = len(json.dumps([[h, length] for h, _, length in new_chunks], separators=(",", ":")))
+        start = time.perf_counter()
+        fetched = rebuild_file([[h, length] for h, _, length in new_chunks], old_path, old_chunks, out_path, fetch_chunk)
+        rebuild_time = time.perf_counter() - start
+        peer.close()
+
+        with open(out_path, "rb") as a, open(new_path, "rb") as b:
+            while True:
+                x, y = a.read(8 * MB), b.read(8 * MB)
+                assert x == y, "rebuilt file differs from the peer's version"
+                if not x:
+                    break
+
+        new_size = os.path.getsize(new_path)
+        delta_total = fetched + manifest_bytes
+        print(f"chunks: {len(new_chunks)} (avg {new_size // len(new_chunks)} bytes), chunking {size / MB / chunk_time:.1f} MB/s")
+        print(f"full download:  {new_size:>14,} bytes")
+        print(f"delta transfer: {delta_total:>14,} bytes ({fetched:,} chunk data + {manifest_bytes:,} manifest)")
+        print(f"saved: {1 - delta_total / new_size:.2%}, rebuild took {rebuild_time:.1f}s")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
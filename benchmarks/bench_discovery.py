@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "Client-PC"))
+sys.path.insert(0, os.path.join(ROOT, "Server-RPi"))
+
+import requests  # noqa: E402
+from announcer import Announcer  # noqa: E402
+from discovery import DiscoveryCache, find_server, probe, scan  # noqa: E402
+
+TARGET = "File Sync Server"
+
+
+def start_stand_in(ip, port, name):
+    # Answers /server_name like server.py does.
+    body = json.dumps({"name": name}).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((ip, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_silent_host(ip, port):
+    # Accepts the connection (backlog) but never answers, so a probe costs
+    # its full timeout, like a LAN address with nothing behind it.
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind((ip, port))
+    s.listen(512)
+    return s
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<38} {elapsed:7.2f}s  -> {result}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LAN discovery time against local stand-in servers on 127.0.0.x")
+    parser.add_argument("--port", type=int, default=15000)
+    parser.add_argument("--announce-port", type=int, default=15001)
+    parser.add_argument("--target", type=int, default=200, help="last octet of the matching server")
+    parser.add_argument("--skip-sequential", action="store_true", help="skip the old one-by-one scan (~target/2 s)")
+    args = parser.parse_args()
+
+    hosts = [f"127.0.0.{i}" for i in range(1, 255)]
+    target_ip = f"127.0.0.{args.target}"
+    decoys = {f"127.0.0.{i}": f"Other Server {i}" for i in (17, 90)}
+    servers, silent = [], []
+    for ip in hosts:
+        if ip == target_ip:
+            servers.append(start_stand_in(ip, args.port, TARGET))
+        elif ip in decoys:
+            servers.append(start_stand_in(ip, args.port, decoys[ip]))
+        else:
+            silent.append(start_silent_host(ip, args.port))
+    workdir = tempfile.mkdtemp(prefix="syncit-discovery-")
+    try:
+        print(f"254 hosts on 127.0.0.0/24, '{TARGET}' at {target_ip}, 2 decoys, the rest silent\n")
+
+        if not args.skip_sequential:
+            def sequential():
+                # rediscover_server_locally() before: one host at a time, 0.5 s timeout.
+                for ip in hosts:
+                    try:
+                        r = requests.get(f"http://{ip}:{args.port}/server_name", timeout=0.5)
+                        if r.status_code == 200 and r.json().get("name") == TARGET:
+                            return ip
+                    except requests.exceptions.RequestException:
+                        pass
+                return None
+            timed("old: sequential probes", sequential)
+
+        def thread_per_host():
+            # discover_servers() before: 254 threads, 0.4 s timeout, wait for all.
+            found = []
+            threads = [threading.Thread(target=lambda ip=ip: found.append(probe(ip, args.port))) for ip in hosts]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            return sum(name is not None for name in found)
+        timed("old: one thread per host, all", thread_per_host)
+
+        timed("pool scan, all servers", lambda: len(scan(hosts, args.port)))
+        timed("pool scan, first match", lambda: scan(hosts, args.port, TARGET))
+
+        cache = DiscoveryCache(os.path.join(workdir, "server_cache.json"))
+        timed("find_server, no announce, cold cache",
+              lambda: find_server(TARGET, cache, hosts, args.port, use_announce=False))
+        timed("find_server, cached address", lambda: find_server(TARGET, cache, hosts, args.port))
+
+        # Loopback stands in for the broadcast address.
+        Announcer(TARGET, args.port, address="127.0.0.1", announce_port=args.announce_port).start()
+        timed("find_server, UDP announce",
+              lambda: find_server(TARGET, None, hosts, args.port, announce_port=args.announce_port))
+    finally:
+        for server in servers:
+            server.shutdown()
+        for s in silent:
+            s.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
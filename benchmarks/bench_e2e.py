@@ -0,0 +1,409 @@
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from client_process import start_client, stop_client
+from load_test_metadata import start_server, stop_server
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SERVER_URL = "http://127.0.0.1:5000"
+TEMP_SUFFIX = ".syncit-tmp"  # Client-PC/file_index.py
+_SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+_LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+# ------------------ Metrics ------------------
+
+def scrape(base_url):
+    # {(name, ((label, value), ...)): value} from a /metrics endpoint.
+    samples = {}
+    try:
+        text = requests.get(f"{base_url}/metrics", timeout=5).text
+    except requests.exceptions.RequestException:
+        return samples
+    for line in text.splitlines():
+        match = _SAMPLE.match(line)
+        if match is None:
+            continue
+        name, labels, value = match.groups()
+        samples[(name, tuple(sorted(_LABEL.findall(labels or ""))))] = float(value)
+    return samples
+
+
+def total(samples, name, **labels):
+    return sum(value for (sample_name, sample_labels), value in samples.items()
+               if sample_name == name and all((k, v) in sample_labels for k, v in labels.items()))
+
+
+def by_label(samples, name, label):
+    result = {}
+    for (sample_name, sample_labels), value in samples.items():
+        if sample_name == name:
+            key = dict(sample_labels).get(label, "")
+            result[key] = result.get(key, 0) + value
+    return result
+
+
+def increase(after, before):
+    # A counter that went down was reset by a restart: it counted from 0.
+    return after - before if after >= before else after
+
+
+def diff(after, before):
+    return {key: after[key] - before.get(key, 0) for key in after if after[key] - before.get(key, 0)}
+
+
+class Fleet:
+    """The server and the clients' /metrics, scraped around each phase."""
+
+    def __init__(self, client_urls):
+        self.client_urls = client_urls
+
+    def snapshot(self):
+        return {"server": scrape(SERVER_URL), "clients": [scrape(url) for url in self.client_urls]}
+
+    def server_rss(self):
+        return total(scrape(SERVER_URL), "process_resident_memory_bytes")
+
+    @staticmethod
+    def report(before, after, seconds, peak_rss):
+        server_before, server_after = before["server"], after["server"]
+        clients = list(zip(before["clients"], after["clients"]))
+
+        def clients_total(name, **labels):
+            return sum(increase(total(a, name, **labels), total(b, name, **labels)) for b, a in clients)
+
+        server_requests = diff(by_label(server_after, "syncit_http_requests_total", "endpoint"),
+                               by_label(server_before, "syncit_http_requests_total", "endpoint"))
+        server_requests.pop("/metrics", None)  # our own scrapes
+        server_cpu = total(server_after, "process_cpu_seconds_total") - total(server_before, "process_cpu_seconds_total")
+        return {
+            "seconds": round(seconds, 3),
+            "peer_bytes": int(clients_total("syncit_peer_bytes_received_total")),
+            "peer_bytes_by_method": {
+                method: int(sum(increase(by_label(a, "syncit_peer_bytes_received_total", "method").get(method, 0),
+                                         by_label(b, "syncit_peer_bytes_received_total", "method").get(method, 0))
+                                for b, a in clients))
+                for method in ("plain", "swarm", "delta", "batch")
+            },
+            "metadata_upload_bytes": int(clients_total("syncit_metadata_upload_bytes_total")),
+            "server_response_bytes": int(total(server_after, "syncit_http_response_bytes_total") -
+                                         total(server_before, "syncit_http_response_bytes_total")),
+            "server_requests": int(sum(server_requests.values())),
+            "server_requests_by_endpoint": {endpoint: int(n) for endpoint, n in sorted(server_requests.items())},
+            "peer_requests": int(clients_total("syncit_http_requests_total") +
+                                 clients_total("syncit_file_server_request_seconds_count")),
+            "downloads": int(clients_total("syncit_downloads_total", result="ok")),
+            "failed_downloads": int(clients_total("syncit_downloads_total", result="failed")),
+            "server_cpu_seconds": round(server_cpu, 3),
+            "server_cpu_percent": round(100 * server_cpu / seconds, 1) if seconds else None,
+            "server_rss_peak_bytes": int(peak_rss),
+            "clients_cpu_seconds": round(clients_total("process_cpu_seconds_total"), 3),
+        }
+
+
+# ------------------ Folder state ------------------
+
+class Tree:
+    """What every folder should hold, {name: (size, md5)}, and a check of
+    whether a folder does, with hashes cached on (size, mtime)."""
+
+    def __init__(self):
+        self.expected = {}
+        self.cache = {}
+
+    def write(self, folder, name, data):
+        path = os.path.join(folder, *name.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        self.expected[name] = (len(data), hashlib.md5(data).hexdigest())
+
+    def write_large(self, folder, name, size_mb, rng):
+        path = os.path.join(folder, *name.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        digest = hashlib.md5()
+        with open(path, "wb") as f:
+            for _ in range(size_mb):
+                block = rng.randbytes(1 << 20)
+                f.write(block)
+                digest.update(block)
+        self.expected[name] = (size_mb << 20, digest.hexdigest())
+
+    def delete(self, folder, name):
+        os.remove(os.path.join(folder, *name.split("/")))
+        del self.expected[name]
+
+    def rename(self, folder, old, new):
+        path = os.path.join(folder, *new.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.rename(os.path.join(folder, *old.split("/")), path)
+        self.expected[new] = self.expected.pop(old)
+
+    def listing(self, folder):
+        found = {}
+        for root, _, names in os.walk(folder):
+            for name in names:
+                if name.endswith(TEMP_SUFFIX):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found[os.path.relpath(path, folder).replace(os.sep, "/")] = (path, st)
+        return found
+
+    def matches(self, folder):
+        found = self.listing(folder)
+        if found.keys() != self.expected.keys():
+            return False
+        if any(st.st_size != self.expected[name][0] for name, (_, st) in found.items()):
+            return False
+        for name, (path, st) in found.items():
+            key = (path, st.st_size, st.st_mtime_ns)
+            if key not in self.cache:
+                digest = hashlib.md5()
+                with open(path, "rb") as f:
+                    for block in iter(lambda: f.read(1 << 20), b""):
+                        digest.update(block)
+                self.cache[key] = digest.hexdigest()
+            if self.cache[key] != self.expected[name][1]:
+                return False
+        return True
+
+
+def wait_for_convergence(tree, folders, fleet, timeout):
+    # Seconds until every folder holds tree.expected (None on timeout), and
+    # the server's peak RSS meanwhile.
+    start = time.perf_counter()
+    peak_rss = fleet.server_rss()
+    pending = list(folders)
+    next_rss = start
+    while pending:
+        now = time.perf_counter()
+        if now - start > timeout:
+            return None, peak_rss
+        if now >= next_rss:
+            peak_rss = max(peak_rss, fleet.server_rss())
+            next_rss = now + 0.5
+        pending = [folder for folder in pending if not tree.matches(folder)]
+        if pending:
+            time.sleep(0.1)
+    return time.perf_counter() - start, peak_rss
+
+
+# ------------------ Clients ------------------
+
+class Clients:
+    """The c1.py processes, one per folder, each of which can be stopped
+    and started again with the same folder, port and state."""
+
+    def __init__(self, workdir, folders, args):
+        self.workdir = workdir
+        self.folders = folders
+        self.args = args
+        self.procs = {}
+
+    def start(self, n):
+        client_id = f"client{n}"
+        self.procs[n] = start_client(client_id, self.folders[n], SERVER_URL, self.args.base_port + n,
+                                     os.path.join(self.workdir, client_id), SYNC_TIME=self.args.sync_time)
+
+    def stop(self, n):
+        proc = self.procs.pop(n, None)
+        if proc is not None:
+            stop_client(proc)
+
+    def stop_all(self):
+        for n in list(self.procs):
+            self.stop(n)
+
+
+# ------------------ Workload ------------------
+
+def run_phase(name, change, tree, folders, fleet, args):
+    before = fleet.snapshot()
+    change()
+    seconds, peak_rss = wait_for_convergence(tree, folders, fleet, args.timeout)
+    time.sleep(args.settle)  # let the last metadata uploads land in the counters
+    after = fleet.snapshot()
+    result = {"phase": name, "converged": seconds is not None, "files": len(tree.expected)}
+    result.update(Fleet.report(before, after, seconds if seconds is not None else args.timeout, peak_rss))
+    print(f"{name:<8} {'converged' if seconds is not None else 'TIMED OUT':<9} in {result['seconds']:7.2f}s  "
+          f"peer {result['peer_bytes'] / 1e6:8.1f} MB  server {result['server_requests']:6} req "
+          f"{result['server_cpu_seconds']:6.2f} CPU-s  peak RSS {result['server_rss_peak_bytes'] / 1e6:6.1f} MB")
+    return result
+
+
+def wait_until(check, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.1)
+    return False
+
+
+def workload(args, tree, folders, rng, fleet, clients):
+    small_names = [f"small/d{i % 50}/f{i}.txt" for i in range(args.small_files)]
+
+    def small_data(i, version):
+        line = f"file {i} version {version} ".encode()
+        return (line * (args.small_size // len(line) + 1))[:args.small_size]
+
+    def initial():
+        for i, name in enumerate(small_names):
+            tree.write(folders[0], name, small_data(i, 0))
+        for i in range(args.huge_files):
+            tree.write_large(folders[0], f"huge/h{i}.bin", args.huge_mb, rng)
+
+    def churn():
+        # Each client edits its own share, so nothing conflicts.
+        edited = rng.sample(range(len(small_names)), min(args.churn, len(small_names)))
+        for n, i in enumerate(edited):
+            tree.write(folders[n % len(folders)], small_names[i], small_data(i, 1))
+
+    def deletes():
+        for name in rng.sample(small_names, min(args.deletes, len(small_names))):
+            tree.delete(folders[0], name)
+            small_names.remove(name)
+
+    def renames():
+        folder = folders[1 % len(folders)]
+        for name in rng.sample(small_names, min(args.renames, len(small_names))):
+            new = name.replace("small/", "renamed/", 1)
+            tree.rename(folder, name, new)
+            small_names[small_names.index(name)] = new
+
+    def offline_edit():
+        # A client edits a file while it is down and another client deletes
+        # it meanwhile. The delete the server pushes once the first one is
+        # back must not take the edit: the file converges to the edited copy.
+        if len(folders) < 2:
+            return
+        i = rng.randrange(len(small_names))
+        name = small_names[i]
+        path = os.path.join(folders[1], *name.split("/"))
+        deleted_mtime = os.stat(path).st_mtime
+        clients.stop(1)
+        tree.write(folders[1], name, small_data(i, 2))
+        deletes_before = total(scrape(SERVER_URL), "syncit_http_requests_total", endpoint="/delete_file")
+        os.remove(os.path.join(folders[0], *name.split("/")))
+        wait_until(lambda: total(scrape(SERVER_URL), "syncit_http_requests_total", endpoint="/delete_file") >
+                   deletes_before, args.timeout)
+        clients.start(1)
+        wait_until(lambda: requests.get(f"{fleet.client_urls[1]}/metrics", timeout=1).ok, 30)
+        # The delete as the fan-out pushes it, whether or not it got there first.
+        response = requests.post(f"{fleet.client_urls[1]}/delete_file", timeout=5, json={
+            "file_name": name, "version": 0, "last_modified": deleted_mtime})
+        if response.status_code != 409:
+            print(f"offline  client1 applied the delete of {name} over its offline edit")
+
+    return [("initial", initial), ("churn", churn), ("deletes", deletes), ("renames", renames),
+            ("offline", offline_edit)]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end sync of server.py and N headless c1.py clients: "
+                                                 "time to convergence, bytes, server CPU/memory and requests per phase")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--small-files", type=int, default=2000)
+    parser.add_argument("--small-size", type=int, default=4096)
+    parser.add_argument("--huge-files", type=int, default=2)
+    parser.add_argument("--huge-mb", type=int, default=64)
+    parser.add_argument("--churn", type=int, default=200, help="small files edited, spread over the clients")
+    parser.add_argument("--deletes", type=int, default=100)
+    parser.add_argument("--renames", type=int, default=100)
+    parser.add_argument("--sync-time", type=int, default=5, help="client SYNC_TIME")
+    parser.add_argument("--base-port", type=int, default=6301)
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for each phase to converge")
+    parser.add_argument("--settle", type=float, default=2, help="seconds after convergence before reading metrics")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="e2e_results.json",
+                        help="results file; a .jsonl file gets one line appended per run")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory and logs")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="syncit-e2e-")
+    server = None
+    clients = None
+    phases = []
+    try:
+        os.makedirs(os.path.join(workdir, "server"))
+        server = start_server(os.path.join(workdir, "server"))
+        folders, client_urls = [], []
+        clients = Clients(workdir, folders, args)
+        for n in range(args.clients):
+            folders.append(os.path.join(workdir, f"client{n}-folder"))
+            os.makedirs(folders[-1])
+            os.makedirs(os.path.join(workdir, f"client{n}"))
+            client_urls.append(f"http://127.0.0.1:{args.base_port + n}")
+            clients.start(n)
+        fleet = Fleet(client_urls)
+        tree = Tree()
+
+        # Once the warm-up file is everywhere, every client is registered and active.
+        time.sleep(2)
+        tree.write(folders[0], "warmup.txt", b"warmup")
+        if wait_for_convergence(tree, folders, fleet, 60 + 3 * args.sync_time)[0] is None:
+            raise RuntimeError(f"clients never synced, see the logs in {workdir}")
+
+        for name, change in workload(args, tree, folders, rng, fleet, clients):
+            phases.append(run_phase(name, change, tree, folders, fleet, args))
+    finally:
+        if clients is not None:
+            clients.stop_all()
+        if server is not None:
+            stop_server(server)
+        if args.keep:
+            print(f"Work directory kept: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "benchmark": "e2e",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "keep")},
+        "phases": phases,
+        "converged": all(phase["converged"] for phase in phases),
+        "total_seconds": round(sum(phase["seconds"] for phase in phases), 3),
+    }
+    if args.output.endswith(".jsonl"):
+        with open(args.output, "a") as f:
+            f.write(json.dumps(results, separators=(",", ":")) + "\n")
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    sys.exit(0 if results["converged"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Client-PC"))
+
+from event_pipeline import EventPipeline  # noqa: E402
+from hashing import hash_files  # noqa: E402
+
+MB = 1024 * 1024
+
+
+class Forward(FileSystemEventHandler):
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.hash_events = 0  # events the old per-event handler hashed a file for
+
+    def on_any_event(self, event):
+        # Same filter as SyncFolderMonitor: reads (opened/closed) don't count.
+        if event.is_directory or event.event_type not in ("created", "modified", "deleted", "moved"):
+            return
+        self.hash_events += event.event_type in ("created", "modified")
+        for path in (event.src_path, getattr(event, "dest_path", None)):
+            if path:
+                self.pipeline.add(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watchdog events received vs paths actually processed")
+    parser.add_argument("--large-mb", type=int, default=256, help="size of the large file copied in 1 MB writes")
+    parser.add_argument("--small", type=int, default=2000, help="small files created, edited and some deleted")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="syncit-events-")
+    hashed = {"files": 0, "bytes": 0}
+
+    def process(changed, deleted):
+        hashed["files"] += len(changed)
+        hashed["bytes"] += sum(os.path.getsize(path) for path in changed if os.path.exists(path))
+        hash_files(changed, "blake2b")
+
+    pipeline = EventPipeline(process)
+    pipeline.start()
+    observer = Observer()
+    handler = Forward(pipeline)
+    observer.schedule(handler, workdir, recursive=True)
+    observer.start()
+    try:
+        start = time.perf_counter()
+        # A large copy: one event per write.
+        block = os.urandom(MB)
+        with open(os.path.join(workdir, "large.bin"), "wb") as f:
+            for _ in range(args.large_mb):
+                f.write(block)
+                f.flush()
+        # Small files: created, rewritten, some deleted again, some renamed.
+        for i in range(args.small):
+            path = os.path.join(workdir, f"small_{i}.txt")
+            with open(path, "w") as f:
+                f.write("draft")
+            with open(path, "w") as f:
+                f.write(f"final {i}")
+            if i % 10 == 0:
+                os.remove(path)
+            elif i % 10 == 1:
+                os.replace(path, path + ".renamed")
+        while pipeline.stats()["pending"] or time.perf_counter() - start < 2 * pipeline.debounce:
+            time.sleep(0.1)
+        time.sleep(2 * pipeline.debounce)
+        elapsed = time.perf_counter() - start
+    finally:
+        observer.stop()
+        observer.join()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    stats = pipeline.stats()
+    print(f"events received:  {stats['events_received']}")
+    print(f"paths processed:  {stats['paths_processed']} in {stats['batches']} batches "
+          f"({stats['events_received'] / max(stats['paths_processed'], 1):.1f} events per path)")
+    print(f"files hashed:     {hashed['files']} ({hashed['bytes'] / MB:.1f} MB), "
+          f"vs {handler.hash_events} with one hash per create/modify event")
+    print(f"settled after:    {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Client-PC"))
+
+from http_session import make_session  # noqa: E402
+
+FLASK_PORT = 15090
+FILE_SERVER_PORT = 15091
+
+
+def serve_flask(folder, port):
+    # The /download route of c1.py, on Werkzeug's development server.
+    from flask import Flask, send_file
+    from file_index import local_path
+
+    app = Flask(__name__)
+
+    @app.route("/download/<path:filename>", methods=["GET"])
+    def serve_file(filename):
+        file_path = local_path(folder, filename)
+        if os.path.isfile(file_path):
+            return send_file(file_path, as_attachment=True, conditional=True)
+        return {"message": "File not found"}, 404
+
+    app.run(host="127.0.0.1", port=port, threaded=True)
+
+
+def serve_file_server(folder, port):
+    from file_server import FileServer
+
+    FileServer(folder, port, host="127.0.0.1").serve_forever()
+
+
+def wait_for(url):
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.exceptions.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def make_files(folder, large_mb, small_count, small_size):
+    with open(os.path.join(folder, "large.bin"), "wb") as f:
+        block = os.urandom(1 << 20)
+        for _ in range(large_mb):
+            f.write(block)
+    os.makedirs(os.path.join(folder, "small"))
+    for i in range(small_count):
+        with open(os.path.join(folder, "small", f"f{i}.dat"), "wb") as f:
+            f.write(os.urandom(small_size))
+
+
+def large_throughput(session, base_url, size):
+    start = time.perf_counter()
+    received = 0
+    with session.get(f"{base_url}/download/large.bin", stream=True, timeout=60) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=1 << 20):
+            received += len(chunk)
+    elapsed = time.perf_counter() - start
+    assert received == size, (received, size)
+    return size / elapsed / 1e6
+
+
+def small_rate(session, base_url, count, threads):
+    names = [f"small/f{i}.dat" for i in range(count)]
+
+    def worker(part):
+        for name in part:
+            session.get(f"{base_url}/download/{name}", timeout=10).raise_for_status()
+
+    workers = [threading.Thread(target=worker, args=(names[i::threads],)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peer downloads: Flask send_file route vs the sendfile file server")
+    parser.add_argument("--large-mb", type=int, default=1024, help="size of the large file")
+    parser.add_argument("--small-files", type=int, default=10000)
+    parser.add_argument("--small-size", type=int, default=4096)
+    parser.add_argument("--threads", type=int, default=8, help="concurrent small-file downloads")
+    parser.add_argument("--serve", nargs=3, metavar=("KIND", "FOLDER", "PORT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        kind, folder, port = args.serve
+        (serve_flask if kind == "flask" else serve_file_server)(folder, int(port))
+        return
+
+    workdir = tempfile.mkdtemp(prefix="syncit-fileserver-")
+    servers = []
+    try:
+        print(f"Writing a {args.large_mb} MB file and {args.small_files:,} x {args.small_size} B files...")
+        make_files(workdir, args.large_mb, args.small_files, args.small_size)
+        targets = (("Flask send_file", "flask", FLASK_PORT), ("sendfile file server", "file_server", FILE_SERVER_PORT))
+        for _, kind, port in targets:
+            servers.append(subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", kind, workdir, str(port)],
+                                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        for label, _, port in targets:
+            base_url = f"http://127.0.0.1:{port}"
+            wait_for(base_url)
+            session = make_session(pool_size=args.threads)
+            large_throughput(session, base_url, args.large_mb << 20)  # warm the page cache
+            mbps = large_throughput(session, base_url, args.large_mb << 20)
+            files = small_rate(session, base_url, args.small_files, args.threads)
+            print(f"{label:<22} large file {mbps:8.0f} MB/s   small files {files:8.0f} files/s")
+    finally:
+        for server in servers:
+            server.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
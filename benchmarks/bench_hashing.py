@@ -0,0 +1,80 @@
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Client-PC"))
+
+from hashing import available_algorithms, hash_files  # noqa: E402
+
+
+def legacy_md5(file_path):
+    # compute_file_hash as it was: MD5, 4 KiB reads, one file at a time.
+    hasher = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(4096), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def generate_files(folder, count, size):
+    rng = random.Random(42)
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f"f{i:05d}.bin")
+        with open(path, "wb") as f:
+            f.write(rng.randbytes(size))
+        paths.append(path)
+    return paths
+
+
+def report(label, seconds, paths, total_bytes):
+    mb = total_bytes / (1024 * 1024)
+    print(f"{label:<28} {mb / seconds:10.1f} MB/s {len(paths) / seconds:12.1f} files/s")
+
+
+def run_workload(name, paths, total_bytes, workers):
+    print(f"\n{name}: {len(paths)} files, {total_bytes / (1024 * 1024):.0f} MB")
+    start = time.perf_counter()
+    for path in paths:
+        legacy_md5(path)
+    report("legacy md5 (4 KiB, serial)", time.perf_counter() - start, paths, total_bytes)
+
+    for algorithm in available_algorithms():
+        for n in sorted({1, workers}):
+            start = time.perf_counter()
+            hash_files(paths, algorithm, workers=n)
+            report(f"{algorithm} x{n}", time.perf_counter() - start, paths, total_bytes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="File hashing throughput")
+    parser.add_argument("--small-files", type=int, default=5000)
+    parser.add_argument("--small-size", type=int, default=16 * 1024)
+    parser.add_argument("--large-files", type=int, default=8)
+    parser.add_argument("--large-size", type=int, default=128 * 1024 * 1024)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="syncit-hash-")
+    try:
+        small_dir = os.path.join(workdir, "small")
+        large_dir = os.path.join(workdir, "large")
+        os.makedirs(small_dir)
+        os.makedirs(large_dir)
+        small = generate_files(small_dir, args.small_files, args.small_size)
+        large = generate_files(large_dir, args.large_files, args.large_size)
+        # Results are page-cache warm after generation, which isolates hashing
+        # cost from disk speed.
+        run_workload("small files", small, args.small_files * args.small_size, args.workers)
+        run_workload("large files", large, args.large_files * args.large_size, args.workers)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Client-PC"))
+
+from http_session import make_session, post_json  # noqa: E402
+from load_test_metadata import start_server, stop_server  # noqa: E402
+
+SERVER_URL = "http://127.0.0.1:5000"
+KEEPALIVE_PORT = 15080
+
+
+def serve_keepalive(port):
+    # Stand-in for server.py under a WSGI server that keeps connections
+    # alive (waitress); Werkzeug's development server closes every one.
+    body = json.dumps({"name": "File Sync Server", "hash_algorithm": "blake2b"}).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out as separate writes.
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+
+def rate(get, threads, duration):
+    # Requests/s with `threads` threads calling get() back to back.
+    counts = [0] * threads
+    deadline = time.perf_counter() + duration
+
+    def worker(i):
+        while time.perf_counter() < deadline:
+            get().raise_for_status()
+            counts[i] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Requests/s to a spawned server.py: new connection per call vs pooled session")
+    parser.add_argument("--duration", type=float, default=5, help="seconds per measurement")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--entries", type=int, default=20000, help="entries in the metadata upload")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve_keepalive(args.serve)
+        return
+
+    stand_in = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", str(KEEPALIVE_PORT)])
+    workdir = tempfile.mkdtemp(prefix="syncit-http-")
+    server = start_server(workdir)
+    try:
+        session = make_session()
+        targets = (("server.py", SERVER_URL), ("keep-alive stand-in", f"http://127.0.0.1:{KEEPALIVE_PORT}"))
+        for label, base_url in targets:
+            url = f"{base_url}/server_name"
+            for threads in args.threads:
+                bare = rate(lambda: requests.get(url, timeout=5), threads, args.duration)
+                pooled = rate(lambda: session.get(url, timeout=5), threads, args.duration)
+                print(f"{label}, {threads} thread(s): new connection {bare:7.0f} req/s, "
+                      f"pooled session {pooled:7.0f} req/s ({pooled / bare:.1f}x)")
+
+        metadata = {
+            f"folder{i % 100}/file_{i}.dat": {"size": i, "hash": f"{i:064x}", "hash_algo": "blake2b",
+                                              "last_modified": 1_700_000_000.0 + i}
+            for i in range(args.entries)
+        }
+        session.post(f"{SERVER_URL}/register", json={"client_id": "bench", "port": 1, "sync_folder": "/tmp"})
+        for compress in (False, True):
+            payload = {"client_id": "bench", "metadata": metadata}
+            start = time.perf_counter()
+            response = post_json(session, f"{SERVER_URL}/update_metadata", payload, compress=compress, timeout=60)
+            elapsed = time.perf_counter() - start
+            response.raise_for_status()
+            print(f"full upload of {args.entries:,} entries, {'gzip' if compress else 'plain'}: "
+                  f"{len(response.request.body):,} bytes in {elapsed * 1000:.0f} ms")
+    finally:
+        stand_in.terminate()
+        stop_server(server)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from client_process import start_client, stop_client
+from load_test_metadata import start_server, stop_server
+
+SERVER_URL = "http://127.0.0.1:5000"
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def process_cpu_seconds(pid):
+    # user + system CPU of the process. Linux only.
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def measure(fast_poll, args):
+    workdir = tempfile.mkdtemp(prefix="syncit-idle-")
+    server = None
+    clients = []
+    try:
+        os.makedirs(os.path.join(workdir, "server"))
+        server = start_server(os.path.join(workdir, "server"))
+        for n in range(args.clients):
+            client_id = f"C{n}"
+            folder = os.path.join(workdir, f"{client_id}-folder")
+            for d in range(args.files // 100 + 1):
+                os.makedirs(os.path.join(folder, f"dir{d}"), exist_ok=True)
+            for i in range(args.files):
+                with open(os.path.join(folder, f"dir{i // 100}", f"{client_id}_{i}.txt"), "w") as f:
+                    f.write(f"{client_id} {i}")
+            client_workdir = os.path.join(workdir, client_id)
+            os.makedirs(client_workdir)
+            # No long-poll: every client runs a round every SYNC_TIME seconds.
+            clients.append(start_client(client_id, folder, SERVER_URL, args.base_port + n, client_workdir,
+                                        SYNC_TIME=args.sync_time, PUSH_NOTIFICATIONS=0,
+                                        FAST_POLL=int(fast_poll)))
+        # Let every client finish its initial upload and downloads.
+        time.sleep(args.settle)
+        start_cpu, start = process_cpu_seconds(server.pid), time.monotonic()
+        time.sleep(args.duration)
+        used = process_cpu_seconds(server.pid) - start_cpu
+        return used / (time.monotonic() - start)
+    finally:
+        for proc in clients:
+            stop_client(proc)
+        if server is not None:
+            stop_server(server)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server CPU while the fleet is idle: full rounds vs /poll digests")
+    parser.add_argument("--clients", type=int, default=5)
+    parser.add_argument("--files", type=int, default=2000, help="files per client (every client ends up with all)")
+    parser.add_argument("--sync-time", type=int, default=2, help="client SYNC_TIME (round interval)")
+    parser.add_argument("--settle", type=int, default=60, help="seconds allowed for the initial sync")
+    parser.add_argument("--duration", type=int, default=30, help="seconds of idle time measured")
+    parser.add_argument("--base-port", type=int, default=6301)
+    args = parser.parse_args()
+
+    results = {}
+    for fast_poll in (False, True):
+        results[fast_poll] = measure(fast_poll, args)
+        label = "/poll digests" if fast_poll else "full rounds"
+        print(f"{label:>14}: server CPU {results[fast_poll] * 100:5.1f}% of one core "
+              f"({args.clients} idle clients, {args.clients * args.files:,} files, round every {args.sync_time}s)")
+    print(f"reduction: {results[False] / max(results[True], 1e-6):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
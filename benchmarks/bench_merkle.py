@@ -0,0 +1,83 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Client-PC"))
+
+from merkle import MerkleTree  # noqa: E402
+
+
+def make_info(i, version=0):
+    return {"size": i * 7, "hash": f"{i + version:064x}", "hash_algo": "blake2b",
+            "last_modified": 1_700_000_000.0 + i + version}
+
+
+def reconcile(local, remote):
+    # Same walk as reconcile_metadata() in c1.py, with each remote
+    # children() call standing in for one GET /tree request.
+    requests_made, bytes_received = 1, len(json.dumps(remote.children("")))
+    if local.root_hash() == remote.root_hash():
+        return requests_made, bytes_received, 0
+    differing = 0
+    stack = [("", remote.children(""))]
+    while stack:
+        directory, theirs_all = stack.pop()
+        mine_all = local.children(directory) or {}
+        prefix = f"{directory}/" if directory else ""
+        for name in set(mine_all) | set(theirs_all):
+            mine, theirs = mine_all.get(name), theirs_all.get(name)
+            if mine == theirs:
+                continue
+            if theirs is not None and theirs[1]:
+                children = remote.children(prefix + name)
+                requests_made += 1
+                bytes_received += len(json.dumps(children))
+                stack.append((prefix + name, children))
+            else:
+                differing += 1
+    return requests_made, bytes_received, differing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merkle tree reconcile vs full metadata upload")
+    parser.add_argument("--entries", type=int, default=200_000)
+    parser.add_argument("--dirs", type=int, default=200, help="top-level directories")
+    parser.add_argument("--subdirs", type=int, default=20, help="subdirectories per directory")
+    parser.add_argument("--changed", type=int, default=20, help="files changed, all in one subdirectory")
+    args = parser.parse_args()
+
+    names = [f"dir{i % args.dirs}/sub{(i // args.dirs) % args.subdirs}/file_{i}.dat" for i in range(args.entries)]
+    metadata = {name: make_info(i) for i, name in enumerate(names)}
+
+    start = time.perf_counter()
+    remote = MerkleTree(metadata)
+    remote.root_hash()
+    build = time.perf_counter() - start
+    local = MerkleTree(metadata)
+
+    # A handful of edits in one corner of the tree.
+    target = [name for name in names if name.startswith("dir7/sub3/")][:args.changed]
+    for i, name in enumerate(target):
+        local.set(name, make_info(i, version=1))
+
+    start = time.perf_counter()
+    requests_made, tree_bytes, differing = reconcile(local, remote)
+    walk = time.perf_counter() - start
+    changed = {name: make_info(i, version=1) for i, name in enumerate(target)}
+    delta_bytes = len(json.dumps({"client_id": "A", "base_generation": 1, "changed": changed, "removed": []}))
+    full_bytes = len(json.dumps({"client_id": "A", "metadata": metadata}))
+
+    idle_requests, idle_bytes, _ = reconcile(MerkleTree(metadata), remote)
+
+    print(f"{args.entries:,} entries, tree built and hashed in {build:.2f}s")
+    print(f"unchanged:        {idle_requests} request, {idle_bytes:,} bytes")
+    print(f"{len(target)} files changed: {requests_made} tree requests, {tree_bytes:,} bytes down + "
+          f"{delta_bytes:,} bytes delta up ({differing} differing entries found in {walk * 1000:.1f} ms)")
+    print(f"full upload:      {full_bytes:,} bytes "
+          f"({full_bytes / max(tree_bytes + delta_bytes, 1):,.0f}x the tree reconcile)")
+
+
+if __name__ == "__main__":
+    main()
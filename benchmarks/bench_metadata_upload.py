@@ -0,0 +1,63 @@
+import argparse
+import hashlib
+import json
+import random
+
+
+def encoded_size(payload):
+    # requests serialises json= bodies with the default json.dumps separators.
+    return len(json.dumps(payload).encode())
+
+
+def make_entry(rng, name):
+    return {
+        "size": rng.randint(1, 10_000_000),
+        "hash": hashlib.blake2b(name.encode() + rng.randbytes(8)).hexdigest(),
+        "hash_algo": "blake2b",
+        "last_modified": 1_700_000_000 + rng.random() * 10_000_000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes on the wire per /update_metadata: full vs delta")
+    parser.add_argument("--files", type=int, default=100_000)
+    parser.add_argument("--polls", type=int, default=20)
+    parser.add_argument("--changes", type=int, default=10, help="files added/changed/removed between polls")
+    args = parser.parse_args()
+    rng = random.Random(3)
+
+    metadata = {f"folder{i % 100}/file_{i}.dat": make_entry(rng, str(i)) for i in range(args.files)}
+    acked = dict(metadata)
+    full_total = delta_total = 0
+    next_id = args.files
+    for poll in range(args.polls):
+        names = list(metadata)
+        for _ in range(args.changes):
+            op = rng.random()
+            if op < 0.5:
+                name = rng.choice(names)
+                metadata[name] = make_entry(rng, name)
+            elif op < 0.8:
+                name = f"new/file_{next_id}.dat"
+                next_id += 1
+                metadata[name] = make_entry(rng, name)
+            else:
+                metadata.pop(rng.choice(names), None)
+
+        full_total += encoded_size({"client_id": "client-1", "metadata": metadata})
+        delta_total += encoded_size({
+            "client_id": "client-1",
+            "base_generation": poll + 1,
+            "changed": {name: info for name, info in metadata.items() if acked.get(name) != info},
+            "removed": [name for name in acked if name not in metadata]
+        })
+        acked = dict(metadata)
+
+    print(f"{args.files} files, {args.polls} polls, {args.changes} changes per poll")
+    print(f"full uploads:  {full_total / args.polls:>14,.0f} bytes per poll")
+    print(f"delta uploads: {delta_total / args.polls:>14,.0f} bytes per poll "
+          f"({full_total / max(delta_total, 1):,.0f}x smaller)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from client_process import start_client, stop_client
+from load_test_metadata import percentile, start_server, stop_server
+
+SERVER_URL = "http://127.0.0.1:5000"
+
+
+def wait_for_file(path, content, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with open(path, "rb") as f:
+                if f.read() == content:
+                    return True
+        except OSError:
+            pass
+        time.sleep(0.01)
+    return False
+
+
+def measure(mode, args):
+    # Fresh server and two clients; write on A, time until B has the file.
+    workdir = tempfile.mkdtemp(prefix=f"syncit-propagation-{mode}-")
+    server = None
+    clients = []
+    try:
+        os.makedirs(os.path.join(workdir, "server"))
+        server = start_server(os.path.join(workdir, "server"))
+        folders = {}
+        for n, client_id in enumerate(("A", "B")):
+            folders[client_id] = os.path.join(workdir, f"{client_id}-folder")
+            client_workdir = os.path.join(workdir, client_id)
+            os.makedirs(client_workdir)
+            clients.append(start_client(client_id, folders[client_id], SERVER_URL, args.base_port + n,
+                                        client_workdir, SYNC_TIME=args.sync_time,
+                                        PUSH_NOTIFICATIONS=int(mode == "push")))
+
+        # Warm-up file: once it arrives both clients are registered and active.
+        time.sleep(2)
+        with open(os.path.join(folders["A"], "warmup.txt"), "wb") as f:
+            f.write(b"warmup")
+        if not wait_for_file(os.path.join(folders["B"], "warmup.txt"), b"warmup", 3 * args.sync_time + 30):
+            raise RuntimeError(f"{mode}: clients never synced, see logs in {workdir}")
+
+        latencies = []
+        for i in range(args.writes):
+            # Writes land at random points of the polling interval.
+            time.sleep(args.sync_time * (i % 4) / 4 + 0.5)
+            content = f"write {i} at {time.time()}".encode()
+            start = time.perf_counter()
+            with open(os.path.join(folders["A"], f"file_{i}.txt"), "wb") as f:
+                f.write(content)
+            if not wait_for_file(os.path.join(folders["B"], f"file_{i}.txt"), content, 3 * args.sync_time + 30):
+                raise RuntimeError(f"{mode}: file_{i}.txt never reached B")
+            latencies.append(time.perf_counter() - start)
+        return sorted(latencies)
+    finally:
+        for proc in clients:
+            stop_client(proc)
+        if server is not None:
+            stop_server(server)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Propagation latency A -> B: push notifications vs polling")
+    parser.add_argument("--writes", type=int, default=8)
+    parser.add_argument("--sync-time", type=int, default=10, help="client SYNC_TIME (polling interval)")
+    parser.add_argument("--base-port", type=int, default=6201)
+    args = parser.parse_args()
+
+    for mode in ("poll", "push"):
+        latencies = measure(mode, args)
+        print(f"{mode:>5}: p50 {percentile(latencies, 0.5):6.2f}s  max {latencies[-1]:6.2f}s  "
+              f"({args.writes} writes, SYNC_TIME={args.sync_time}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Client-PC"))
+
+from file_index import FileIndex, scan_directory  # noqa: E402
+
+
+def md5_file(file_path):
+    hasher = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(4096), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def full_scan(folder):
+    metadata = {}
+    for file_name in os.listdir(folder):
+        file_path = os.path.join(folder, file_name)
+        if os.path.isfile(file_path):
+            metadata[file_name] = {
+                "size": os.path.getsize(file_path),
+                "hash": md5_file(file_path),
+                "hash_algo": "md5",
+                "last_modified": os.path.getmtime(file_path)
+            }
+    return metadata
+
+
+def generate_tree(folder, file_count, max_size):
+    rng = random.Random(1234)
+    for i in range(file_count):
+        with open(os.path.join(folder, f"file_{i:06d}.bin"), "wb") as f:
+            f.write(rng.randbytes(rng.randint(1, max_size)))
+    # Age the tree past the racy window so warm scans can trust the index.
+    old = time.time() - 60
+    for file_name in os.listdir(folder):
+        os.utime(os.path.join(folder, file_name), (old, old))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold vs warm scan_folder startup time")
+    parser.add_argument("--files", type=int, default=100_000)
+    parser.add_argument("--max-size", type=int, default=16 * 1024)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="syncit-scan-")
+    try:
+        folder = os.path.join(workdir, "sync")
+        os.makedirs(folder)
+        index_file = os.path.join(workdir, "index.json")
+        print(f"Generating {args.files} files in {folder}...")
+        generate_tree(folder, args.files, args.max_size)
+
+        start = time.perf_counter()
+        reference = full_scan(folder)
+        full_time = time.perf_counter() - start
+
+        index = FileIndex(index_file)
+        start = time.perf_counter()
+        cold = scan_directory(folder, index, "md5")
+        cold_time = time.perf_counter() - start
+
+        index = FileIndex(index_file)
+        start = time.perf_counter()
+        index.load()
+        warm = scan_directory(folder, index, "md5")
+        warm_time = time.perf_counter() - start
+
+        assert cold == reference, "cold indexed scan differs from full scan"
+        assert warm == reference, "warm indexed scan differs from full scan"
+
+        print(f"full scan (no index): {full_time:8.2f}s")
+        print(f"cold scan (empty index): {cold_time:8.2f}s")
+        print(f"warm scan (loaded index): {warm_time:8.2f}s  ({full_time / warm_time:.1f}x faster)")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import argparse
+import hashlib
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Client-PC"))
+
+from swarm import swarm_download  # noqa: E402
+
+
+def serve_peer(path, port, rate):
+    # One simulated peer: serves `path` with Range support, throttled to
+    # `rate` bytes/s across all of its connections (a shared uplink).
+    size = os.path.getsize(path)
+    uplink = threading.Lock()
+    state = {"next_free": time.monotonic()}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            start, end, status = 0, size - 1, 200
+            header = self.headers.get("Range")
+            if header and header.startswith("bytes="):
+                first, last = header[6:].split("-")
+                start, end, status = int(first), min(int(last or size - 1), size - 1), 206
+            self.send_response(status)
+            self.send_header("Content-Length", str(end - start + 1))
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.end_headers()
+            with open(path, "rb") as f:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining:
+                    block = f.read(min(64 * 1024, remaining))
+                    with uplink:
+                        now = time.monotonic()
+                        state["next_free"] = max(state["next_free"], now) + len(block) / rate
+                        delay = state["next_free"] - now
+                    time.sleep(delay)
+                    self.wfile.write(block)
+                    remaining -= len(block)
+
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+
+def wait_for(url):
+    for _ in range(100):
+        try:
+            requests.head(url, timeout=0.5)
+            return
+        except requests.exceptions.RequestException:
+            time.sleep(0.05)
+    raise RuntimeError(f"{url} did not start")
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "blake2b").hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single-peer vs multi-peer (swarm) download time")
+    parser.add_argument("--size-mb", type=int, default=128)
+    parser.add_argument("--peers", type=int, default=4)
+    parser.add_argument("--rate-mb", type=float, default=20.0, help="upload bandwidth of each peer in MB/s")
+    parser.add_argument("--base-port", type=int, default=8600)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="syncit-swarm-")
+    procs = []
+    try:
+        source = os.path.join(workdir, "source.bin")
+        with open(source, "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        expected = file_digest(source)
+        size = os.path.getsize(source)
+
+        urls = []
+        for i in range(args.peers):
+            port = args.base_port + i
+            proc = multiprocessing.Process(target=serve_peer, args=(source, port, args.rate_mb * 1024 * 1024),
+                                           daemon=True)
+            proc.start()
+            procs.append(proc)
+            urls.append(f"http://127.0.0.1:{port}/source.bin")
+        for url in urls:
+            wait_for(url)
+
+        dest = os.path.join(workdir, "dest.bin")
+        results = {}
+        for label, peer_urls in (("single peer", urls[:1]), (f"{args.peers} peers", urls)):
+            start = time.perf_counter()
+            fetched = swarm_download(peer_urls, dest, size)
+            elapsed = time.perf_counter() - start
+            if file_digest(dest) != expected:
+                raise RuntimeError(f"{label}: downloaded file does not match")
+            results[label] = elapsed
+            share = ", ".join(f"{count / size:.0%}" for count in fetched.values())
+            print(f"{label:>12}: {elapsed:6.2f}s  {size / elapsed / 1e6:7.1f} MB/s  (share per peer: {share})")
+            os.remove(dest)
+
+        single, swarm = results.values()
+        print(f"speedup: {single / swarm:.2f}x with {args.peers} peers at {args.rate_mb} MB/s each")
+    finally:
+        for proc in procs:
+            proc.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server-RPi"))
+
+from sync_planner import SyncPlanner  # noqa: E402
+
+
+def legacy_index(metadata):
+    all_files = set()
+    file_locations = {}
+    for client_id, files in metadata.items():
+        for file_name in files.keys():
+            all_files.add(file_name)
+            if file_name not in file_locations:
+                file_locations[file_name] = []
+            file_locations[file_name].append(client_id)
+    return all_files, file_locations
+
+
+def legacy_plan_client(metadata, all_files, file_locations, client_id):
+    # The per-client body of the original sync_files() loop.
+    client_files = metadata[client_id]
+    instructions = {"delete_files": []}
+    for file_name in all_files:
+        versions = []
+        for peer_id in file_locations[file_name]:
+            peer_info = metadata[peer_id][file_name]
+            versions.append({
+                "client_id": peer_id,
+                "hash": peer_info["hash"],
+                "last_modified": peer_info["last_modified"]
+            })
+        latest = max(versions, key=lambda x: x["last_modified"])
+        if file_name not in client_files or client_files[file_name]["hash"] != latest["hash"]:
+            instructions[file_name] = latest["client_id"]
+    return instructions
+
+
+def build_fleet(clients, files):
+    # Every client starts fully in sync; entries are shared between clients to
+    # keep memory manageable at 50 x 200k.
+    shared = {
+        f"dir{i % 500}/file_{i}.dat": {"size": 4096, "hash": f"{i:032x}", "last_modified": 1_000_000.0 + i}
+        for i in range(files)
+    }
+    return {f"client-{c}": dict(shared) for c in range(clients)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/sync planning latency, legacy vs incremental")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--files", type=int, default=200_000)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--churn", type=int, default=50, help="files changed per round")
+    parser.add_argument("--legacy-sample", type=int, default=2,
+                        help="clients timed for the legacy planner, the rest is extrapolated")
+    args = parser.parse_args()
+    rng = random.Random(7)
+
+    print(f"Building fleet: {args.clients} clients x {args.files} files...")
+    metadata = build_fleet(args.clients, args.files)
+    client_ids = list(metadata)
+
+    start = time.perf_counter()
+    all_files, file_locations = legacy_index(metadata)
+    index_time = time.perf_counter() - start
+    sample = client_ids[:max(1, min(args.legacy_sample, args.clients))]
+    start = time.perf_counter()
+    for client_id in sample:
+        legacy_plan_client(metadata, all_files, file_locations, client_id)
+    per_client = (time.perf_counter() - start) / len(sample)
+    legacy_time = index_time + per_client * args.clients
+    del all_files, file_locations
+
+    planner = SyncPlanner()
+    start = time.perf_counter()
+    planner.load(metadata)
+    planner.set_alive(client_ids)
+    load_time = time.perf_counter() - start
+    start = time.perf_counter()
+    planner.plan_all()
+    first_plan_time = time.perf_counter() - start
+
+    names = list(metadata[client_ids[0]])
+    round_times = []
+    apply_times = []
+    for r in range(args.rounds):
+        # One client edits a handful of files and uploads its metadata, then
+        # the fleet polls.
+        writer = rng.choice(client_ids)
+        files = dict(metadata[writer])
+        for name in rng.sample(names, args.churn):
+            files[name] = {"size": 4096, "hash": f"r{r}-{name}", "last_modified": 2_000_000.0 + r}
+        metadata[writer] = files
+        start = time.perf_counter()
+        planner.update_client(writer, files)
+        apply_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        plans = planner.plan_all()
+        round_times.append(time.perf_counter() - start)
+        assert len(plans) == args.clients
+
+    round_times.sort()
+    print(f"legacy sync_files planning: {legacy_time:10.2f}s per poll "
+          f"(extrapolated from {len(sample)} of {args.clients} clients)")
+    print(f"incremental planner load:   {load_time:10.2f}s once at startup")
+    print(f"incremental first plan:     {first_plan_time:10.2f}s once")
+    print(f"incremental per poll:       {sum(round_times) / len(round_times) * 1000:10.2f}ms mean, "
+          f"{round_times[-1] * 1000:.2f}ms max over {args.rounds} rounds of {args.churn} changed files")
+    print(f"incremental metadata apply: {sum(apply_times) / len(apply_times) * 1000:10.2f}ms mean per /update_metadata")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+import threading
+
+CLIENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Client-PC")
+
+
+def start_client(client_id, folder, server_url, port, workdir, **overrides):
+    """Run c1.py as a separate process without the setup UI.
+
+    Keyword arguments override c1 module settings, e.g. SYNC_TIME=5."""
+    args = [sys.executable, os.path.abspath(__file__), client_id, folder, server_url, str(port), workdir]
+    args += [f"{name}={value}" for name, value in overrides.items()]
+    log = open(os.path.join(workdir, f"{client_id}.log"), "a")  # restarts add to it
+    return subprocess.Popen(args, stdout=log, stderr=subprocess.STDOUT)
+
+
+def stop_client(proc):
+    proc.terminate()
+    proc.wait()
+
+
+def _run(argv):
+    client_id, folder, server_url, port, workdir = argv[:5]
+    sys.path.insert(0, os.path.abspath(CLIENT_DIR))
+    os.chdir(workdir)
+    import c1
+    c1.CLIENT_ID = client_id
+    c1.SYNC_FOLDER = folder
+    c1.SERVER_URL = server_url
+    c1.CLIENT_PORT = int(port)
+    c1.SERVER_NAME = "File Sync Server"
+    c1.METADATA_FILE = f"./{client_id}_metadata.json"
+    c1.INDEX_FILE = f"./{client_id}_index.json"
+    c1.MANIFEST_FILE = f"./{client_id}_manifests.json"
+    for override in argv[5:]:
+        name, value = override.split("=", 1)
+        current = getattr(c1, name)
+        setattr(c1, name, value in ("1", "True") if isinstance(current, bool) else type(current)(value))
+    threading.Thread(target=c1.start_sync_process, daemon=True).start()
+    c1.run_http_server(host="127.0.0.1")
+
+
+if __name__ == "__main__":
+    _run(sys.argv[1:])
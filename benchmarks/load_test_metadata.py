@@ -0,0 +1,101 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server-RPi", "server.py")
+
+
+def start_server(workdir):
+    proc = subprocess.Popen([sys.executable, os.path.abspath(SERVER_SCRIPT)], cwd=workdir,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            requests.get("http://127.0.0.1:5000/server_name", timeout=0.5)
+            return proc
+        except requests.exceptions.RequestException:
+            time.sleep(0.1)
+    stop_server(proc)
+    raise RuntimeError("server.py did not start")
+
+
+def stop_server(proc):
+    proc.terminate()
+    proc.wait()
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent /update_metadata load test")
+    parser.add_argument("--url", help="existing server to target (default: spawn server.py in a temp dir)")
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--files", type=int, default=2000, help="files per client")
+    parser.add_argument("--requests", type=int, default=50, help="updates sent per client")
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="syncit-load-")
+    proc = None
+    url = args.url
+    try:
+        if url is None:
+            proc = start_server(workdir)
+            url = "http://127.0.0.1:5000"
+
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def run_client(n):
+            client_id = f"load-{n}"
+            session = requests.Session()
+            session.post(f"{url}/register", json={"client_id": client_id, "port": 7000 + n, "sync_folder": "/tmp"})
+            files = {
+                f"file_{i}.txt": {"size": 100, "hash": f"{n}-{i}", "hash_algo": "blake2b", "last_modified": 1.0}
+                for i in range(args.files)
+            }
+            for r in range(args.requests):
+                for i in range(r % args.files, args.files, max(1, args.files // 5)):
+                    files[f"file_{i}.txt"] = {"size": 100, "hash": f"{n}-{i}-{r}", "hash_algo": "blake2b",
+                                              "last_modified": 2.0 + r}
+                start = time.perf_counter()
+                try:
+                    response = session.post(f"{url}/update_metadata", json={"client_id": client_id, "metadata": files})
+                    response.raise_for_status()
+                except requests.exceptions.RequestException as e:
+                    with lock:
+                        errors.append(str(e))
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(run_client, range(args.clients)))
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        print(f"{len(latencies)} updates ({args.files} files each) from {args.clients} clients, "
+              f"concurrency {args.concurrency}, {len(errors)} errors")
+        print(f"throughput: {len(latencies) / elapsed:.1f} requests/s")
+        if latencies:
+            print(f"latency: p50 {percentile(latencies, 0.50) * 1000:.1f}ms, "
+                  f"p99 {percentile(latencies, 0.99) * 1000:.1f}ms, max {latencies[-1] * 1000:.1f}ms")
+    finally:
+        if proc is not None:
+            stop_server(proc)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()